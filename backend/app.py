@@ -2,34 +2,74 @@ from gevent import monkey
 monkey.patch_all()
 from psycogreen.gevent import patch_psycopg
 patch_psycopg()
+import gevent
+import gevent.event
+import gevent.events
+import zope.event
 import time
-from flask import Flask, request, jsonify
+import json
+import zlib
+import contextvars
+import sys
+import hmac
+import cProfile
+import pstats
+import io
+import glob
+import uuid
+import base64
+import hashlib
+import fcntl
+from flask import Flask, request, jsonify, Response, has_request_context, g
 from flask_cors import CORS
-from flask_socketio import SocketIO, emit, join_room
+from flask_socketio import SocketIO, emit, join_room, leave_room, close_room, disconnect, ConnectionRefusedError
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.exceptions import HTTPException
 import sqlite3
 import psycopg2
 import psycopg2.extras
 from urllib.parse import urlparse
 import bcrypt
 import os
-from datetime import datetime
+from collections import OrderedDict, defaultdict, deque
+from functools import wraps
+from itertools import islice
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 load_dotenv()
 
 # Database Setup
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "connect.db")
+DB_PATH = os.getenv("SQLITE_PATH", os.path.join(BASE_DIR, "connect.db"))
 DATABASE_URL = os.getenv("DATABASE_URL")
 if DATABASE_URL:
     DATABASE_URL = DATABASE_URL.strip()
+# Supabase's pooler needs SSL; a local Postgres (or a migration target) may not offer it
+DATABASE_SSLMODE = os.getenv("DATABASE_SSLMODE") or os.getenv("PGSSLMODE") or "require"
 
 if DATABASE_URL:
     print(f"✅ Configured to use PostgreSQL: {DATABASE_URL.split('@')[1]}")
 else:
     print("⚠️ Configured to use local SQLite")
 
+# Optional read replicas: Postgres URLs, or SQLite file paths when running on SQLite
+DATABASE_READ_URLS = [url.strip() for url in os.getenv("DATABASE_READ_URL", "").split(",") if url.strip()]
+if DATABASE_READ_URLS:
+    print(f"✅ Routing reads across {len(DATABASE_READ_URLS)} replica(s)")
+
+# Number of reverse proxies in front of the app. Only then is X-Forwarded-For trusted
+# (for request.remote_addr); otherwise any client could pick its own address
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", 0))
+
 app = Flask(__name__)
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
 CORS(app)
 socketio = SocketIO(app, cors_allowed_origins="*")
 
@@ -49,6 +89,7 @@ class PostgresCursor:
         # Handle SQLite specific syntax
         query = query.replace('INTEGER PRIMARY KEY AUTOINCREMENT', 'SERIAL PRIMARY KEY')
         query = query.replace('datetime("now")', 'NOW()')
+        query = query.replace(' BLOB', ' BYTEA')
         
         # Handle lastrowid for INSERTs
         if query.strip().upper().startswith("INSERT") and "RETURNING id" not in query:
@@ -67,6 +108,14 @@ class PostgresCursor:
         except Exception as e:
             raise e
             
+    def executemany(self, query, params_list):
+        # execute_batch sends many rows per round trip instead of one each
+        psycopg2.extras.execute_batch(self.cursor, query.replace('?', '%s'), params_list)
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
     def fetchone(self):
         return self.cursor.fetchone()
     
@@ -76,35 +125,256 @@ class PostgresCursor:
     def close(self):
         self.cursor.close()
 
-def get_db_connection():
+# Set while a batch sub-request runs on a connection shared with its siblings
+shared_db_connection = contextvars.ContextVar("shared_db_connection", default=None)
+
+class SharedConnection:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def close(self):
+        # The batch that owns the connection closes it once every sub-request is done
+        pass
+
+# ========== Circuit Breaker ==========
+
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", 3))
+DB_CONNECT_ATTEMPTS = int(os.getenv("DB_CONNECT_ATTEMPTS", 2))
+DB_BREAKER_THRESHOLD = int(os.getenv("DB_BREAKER_THRESHOLD", 3))
+DB_BREAKER_RESET = float(os.getenv("DB_BREAKER_RESET", 10))
+
+class DatabaseUnavailable(Exception):
+    pass
+
+class CircuitBreaker:
+    # closed: normal. open: fail fast until reset_timeout passes. half_open: one
+    # probe connection is let through; success closes the breaker, failure reopens it.
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.last_error = None
+
+    def allow(self):
+        if self.state == "open" and time.time() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            self.probe_in_flight = False
+        if self.state == "half_open":
+            if self.probe_in_flight:
+                return False
+            self.probe_in_flight = True
+            return True
+        return self.state == "closed"
+
+    def record_success(self):
+        if self.state != "closed":
+            print("✅ Database reachable again, closing circuit breaker")
+        self.state = "closed"
+        self.failures = 0
+        self.probe_in_flight = False
+
+    def record_failure(self, error):
+        self.failures += 1
+        self.last_error = str(error)
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                print(f"❌ Database unreachable, opening circuit breaker: {error}")
+            self.state = "open"
+            self.opened_at = time.time()
+            self.probe_in_flight = False
+
+    def release_probe(self):
+        # The probe ended without a verdict (another exception, or its greenlet was killed);
+        # the next caller probes instead of the breaker staying half open for good
+        self.probe_in_flight = False
+
+db_breaker = CircuitBreaker(DB_BREAKER_THRESHOLD, DB_BREAKER_RESET)
+
+# Fault injection for outage drills: "down" refuses connections, "slow" delays them
+db_fault = {"mode": os.getenv("DB_FAULT", "off"), "delay": float(os.getenv("DB_FAULT_DELAY", 30))}
+
+def connect_primary():
+    if db_fault["mode"] == "slow":
+        gevent.sleep(min(db_fault["delay"], DB_CONNECT_TIMEOUT))
+        if db_fault["delay"] >= DB_CONNECT_TIMEOUT:
+            raise DatabaseUnavailable("Injected fault: connection timed out")
+    elif db_fault["mode"] == "down":
+        raise DatabaseUnavailable("Injected fault: database unreachable")
+
     if DATABASE_URL:
-        # Try to connect up to 3 times
-        for attempt in range(3):
+        # Add Keepalives to prevent "SSL Closed" errors
+        # For Supabase Transaction Pooler (port 6543), SSL is required but sometimes 'require' is too strict for the pooler handshake
+        # Try 'prefer' or just rely on the URL params if possible.
+        # Also, ensure the URL is the Transaction Pooler URL (port 6543) for IPv4 compatibility if needed, 
+        # OR the Session Pooler (port 5432) if using IPv4 addon.
+        # Hugging Face Spaces are IPv4 only.
+        return psycopg2.connect(
+            DATABASE_URL, 
+            sslmode=DATABASE_SSLMODE, 
+            connect_timeout=DB_CONNECT_TIMEOUT,
+            keepalives=1, 
+            keepalives_idle=5, 
+            keepalives_interval=2, 
+            keepalives_count=2
+        )
+    return sqlite3.connect(DB_PATH)
+
+def get_db_connection(read_only=False):
+    shared = shared_db_connection.get()
+    if shared is not None:
+        return shared
+    if read_only and DATABASE_READ_URLS:
+        conn = replica_router.connect(request_identity())
+        if conn is not None:
+            if has_request_context():
+                # May lag the primary; callers that cache what they read check this
+                g.replica_read = True
+            return conn
+
+    if not db_breaker.allow():
+        if has_request_context():
+            g.db_unavailable = True
+        raise DatabaseUnavailable(f"Database unavailable: {db_breaker.last_error}")
+
+    probing = db_breaker.state == "half_open"
+    try:
+        for attempt in range(DB_CONNECT_ATTEMPTS):
             try:
-                # Add Keepalives to prevent "SSL Closed" errors
-                # For Supabase Transaction Pooler (port 6543), SSL is required but sometimes 'require' is too strict for the pooler handshake
-                # Try 'prefer' or just rely on the URL params if possible.
-                # Also, ensure the URL is the Transaction Pooler URL (port 6543) for IPv4 compatibility if needed, 
-                # OR the Session Pooler (port 5432) if using IPv4 addon.
-                # Hugging Face Spaces are IPv4 only.
-                
-                conn = psycopg2.connect(
-                    DATABASE_URL, 
-                    sslmode='require', 
-                    connect_timeout=10,
-                    keepalives=1, 
-                    keepalives_idle=5, 
-                    keepalives_interval=2, 
-                    keepalives_count=2
-                )
+                conn = connect_primary()
+                db_breaker.record_success()
                 return conn
-            except psycopg2.OperationalError as e:
+            except (psycopg2.OperationalError, sqlite3.OperationalError, DatabaseUnavailable) as e:
                 print(f"Connection attempt {attempt+1} failed: {e}")
-                if attempt == 2: # If it's the last attempt, give up and raise the error
-                    raise e
-                time.sleep(1) # Wait 1 second before retrying
-    else:
-        return sqlite3.connect(DB_PATH)        
+                if attempt == DB_CONNECT_ATTEMPTS - 1 or db_breaker.state == "half_open":
+                    db_breaker.record_failure(e)
+                    if has_request_context():
+                        g.db_unavailable = True
+                    raise DatabaseUnavailable(f"Database unavailable: {e}")
+                gevent.sleep(0.2)
+    finally:
+        if probing:
+            db_breaker.release_probe()
+
+# ========== Read Replicas ==========
+
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", 5))
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", 5))
+READ_YOUR_WRITES_WINDOW = float(os.getenv("READ_YOUR_WRITES_WINDOW", 10))
+READ_YOUR_WRITES_MAX = 100000
+
+def request_identity():
+    if not has_request_context():
+        return None
+    # The token's user first: reads like posts and groups carry no username but should
+    # still show the user what they just wrote
+    return g.get("auth_user") or request.args.get('username') or request.args.get('sender')
+
+def connect_replica(url):
+    if DATABASE_URL:
+        return psycopg2.connect(
+            url,
+            sslmode=os.getenv("DATABASE_READ_SSLMODE", "prefer"),
+            connect_timeout=3,
+            keepalives=1,
+            keepalives_idle=5,
+            keepalives_interval=2,
+            keepalives_count=2
+        )
+    return sqlite3.connect(url[len("sqlite:///"):] if url.startswith("sqlite:///") else url)
+
+class ReplicaRouter:
+    def __init__(self, urls):
+        self.replicas = [{"url": url, "healthy": True, "lag": 0.0} for url in urls]
+        self.recent_writers = OrderedDict()  # username -> last write time, oldest first
+        self.next = 0
+        self.started = False
+
+    def note_write(self, username):
+        if not username or not self.replicas:
+            return
+        self.recent_writers.pop(username, None)
+        self.recent_writers[username] = time.time()
+        if len(self.recent_writers) > READ_YOUR_WRITES_MAX:
+            self.recent_writers.popitem(last=False)
+
+    def wrote_recently(self, username):
+        written = self.recent_writers.get(username) if username else None
+        return written is not None and time.time() - written < READ_YOUR_WRITES_WINDOW
+
+    def connect(self, username):
+        # Returns a replica connection, or None to send the read to the primary
+        self.ensure_started()
+        if self.wrote_recently(username):
+            inc_metric("db_reads_total", target="primary", reason="read_your_writes")
+            return None
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[self.next % len(self.replicas)]
+            self.next += 1
+            if not replica["healthy"]:
+                continue
+            try:
+                conn = connect_replica(replica["url"])
+                inc_metric("db_reads_total", target="replica", reason="routed")
+                return conn
+            except Exception as e:
+                replica["healthy"] = False
+                print(f"⚠️ Replica unavailable, falling back: {e}")
+        inc_metric("db_reads_total", target="primary", reason="no_healthy_replica")
+        return None
+
+    def ensure_started(self):
+        if not self.started:
+            self.started = True
+            socketio.start_background_task(self.run)
+
+    def run(self):
+        while True:
+            for replica in self.replicas:
+                replica["lag"], replica["healthy"] = self.measure(replica["url"])
+            socketio.sleep(REPLICA_CHECK_INTERVAL)
+
+    def measure(self, url):
+        try:
+            conn = connect_replica(url)
+        except Exception:
+            return float("inf"), False
+        try:
+            if not DATABASE_URL:
+                return 0.0, True
+            cursor = conn.cursor()
+            # A replica that has replayed everything it received is current, however old its last commit
+            cursor.execute('''
+                SELECT CASE
+                    WHEN NOT pg_is_in_recovery() THEN 0
+                    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                END
+            ''')
+            lag = float(cursor.fetchone()[0])
+            return lag, lag <= REPLICA_MAX_LAG
+        except Exception:
+            return float("inf"), False
+        finally:
+            conn.close()
+
+replica_router = ReplicaRouter(DATABASE_READ_URLS)
+
+@app.after_request
+def note_session_write(response):
+    # Sessions that just wrote read from the primary for a while so they see their own changes
+    if request.method != 'GET' and response.status_code < 400 and DATABASE_READ_URLS:
+        writer = g.get("auth_user")
+        data = request.get_json(silent=True) or {}
+        if writer is None and isinstance(data, dict):
+            writer = data.get("username") or data.get("sender") or data.get("added_by")
+        replica_router.note_write(writer)
+    return response
 
 def get_cursor(conn):
     if DATABASE_URL:
@@ -112,8 +382,257 @@ def get_cursor(conn):
     else:
         return conn.cursor()
 
+def add_column_if_missing(cursor, table, column, definition):
+    if DATABASE_URL:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {definition}")
+    else:
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+# ========== Message Shards ==========
+
+# Optional: messages, group_messages and message_archive spread across several databases,
+# keyed by conversation (get_room_id / group_conversation). The map is a JSON file
+#   {"shards": {"0": url, "1": url}, "buckets": [0, 1, 0, 1, ...]}
+# where a conversation hashes to a bucket and the bucket names its shard; resharding
+# reassigns buckets (reshard_messages.py). MESSAGE_SHARDS=url,url builds an even map.
+# URLs are Postgres URLs, or SQLite file paths when running on SQLite.
+MESSAGE_SHARD_MAP = os.getenv("MESSAGE_SHARD_MAP")
+MESSAGE_SHARDS = [url.strip() for url in os.getenv("MESSAGE_SHARDS", "").split(",") if url.strip()]
+MESSAGE_SHARD_BUCKETS = 256
+
+# Shard k hands out ids congruent to k, so ids stay unique when a conversation moves
+# between shards; shard numbers are therefore permanent and below the stride
+SHARD_ID_STRIDE = 64
+
+class ShardMap:
+    def __init__(self, shards, buckets):
+        self.shards = {int(shard): url for shard, url in shards.items()}
+        self.buckets = [int(shard) for shard in buckets]
+        if not self.buckets or set(self.buckets) - set(self.shards):
+            raise ValueError("Every bucket must name a configured shard")
+        if any(shard < 0 or shard >= SHARD_ID_STRIDE for shard in self.shards):
+            raise ValueError(f"Shard numbers must be between 0 and {SHARD_ID_STRIDE - 1}")
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["shards"], data["buckets"])
+
+    @classmethod
+    def even(cls, urls, buckets=MESSAGE_SHARD_BUCKETS):
+        return cls(dict(enumerate(urls)), [bucket % len(urls) for bucket in range(buckets)])
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"shards": {str(shard): url for shard, url in self.shards.items()}, "buckets": self.buckets}, f, indent=2)
+
+    def shard_for(self, conversation):
+        # crc32 rather than hash(): it has to agree across processes and restarts
+        return self.buckets[zlib.crc32(conversation.encode("utf-8")) % len(self.buckets)]
+
+def connect_shard_url(url):
+    if DATABASE_URL:
+        return psycopg2.connect(
+            url,
+            sslmode=os.getenv("MESSAGE_SHARD_SSLMODE", "require"),
+            connect_timeout=DB_CONNECT_TIMEOUT,
+            keepalives=1,
+            keepalives_idle=5,
+            keepalives_interval=2,
+            keepalives_count=2
+        )
+    path = url[len("sqlite:///"):] if url.startswith("sqlite:///") else url
+    return sqlite3.connect(os.path.join(BASE_DIR, path))
+
+class MessageShards:
+    def __init__(self, shard_map):
+        self.map = shard_map
+        self.breakers = {shard: CircuitBreaker(DB_BREAKER_THRESHOLD, DB_BREAKER_RESET) for shard in shard_map.shards} if shard_map else {}
+
+    def shard_for(self, conversation):
+        # None is the unsharded layout: message tables live on the primary
+        return self.map.shard_for(conversation) if self.map else None
+
+    def targets(self):
+        return sorted(self.map.shards) if self.map else [None]
+
+    def connect(self, shard, read_only=False):
+        if shard is None:
+            return get_db_connection(read_only=read_only)
+        breaker = self.breakers[shard]
+        if breaker.allow():
+            probing = breaker.state == "half_open"
+            try:
+                conn = connect_shard_url(self.map.shards[shard])
+                breaker.record_success()
+                return conn
+            except (psycopg2.OperationalError, sqlite3.OperationalError) as e:
+                breaker.record_failure(e)
+            finally:
+                if probing:
+                    breaker.release_probe()
+        if has_request_context():
+            g.db_unavailable = True
+        raise DatabaseUnavailable(f"Message shard {shard} unavailable: {breaker.last_error}")
+
+    def connect_for(self, conversation, read_only=False):
+        return self.connect(self.shard_for(conversation), read_only)
+
+    def scatter(self, func, primary=None):
+        # Runs func(cursor, shard) on every shard concurrently, one greenlet and connection
+        # each; the unsharded layout runs inline on the caller's primary connection
+        if not self.map:
+            conn = primary or get_db_connection(read_only=True)
+            try:
+                return {None: func(get_cursor(conn), None)}
+            finally:
+                if primary is None:
+                    conn.close()
+
+        def run(shard):
+            try:
+                conn = self.connect(shard, read_only=True)
+            except DatabaseUnavailable as e:
+                return e
+            try:
+                return func(get_cursor(conn), shard)
+            finally:
+                conn.close()
+
+        greenlets = {shard: gevent.spawn(run, shard) for shard in self.targets()}
+        gevent.joinall(list(greenlets.values()), raise_error=True)
+        results = {shard: greenlet.value for shard, greenlet in greenlets.items()}
+        for result in results.values():
+            if isinstance(result, DatabaseUnavailable):
+                # Raised in another greenlet, so stale_on_outage hasn't seen it yet
+                if has_request_context():
+                    g.db_unavailable = True
+                raise result
+        return results
+
+class ShardSession:
+    # Message-shard connections for one request or job, opened on first use;
+    # unsharded, the caller's own connection is used
+    def __init__(self, primary):
+        self.primary = primary
+        self.conns = {}
+
+    def cursor(self, conversation):
+        shard = message_shards.shard_for(conversation)
+        if shard is None:
+            return get_cursor(self.primary)
+        if shard not in self.conns:
+            self.conns[shard] = message_shards.connect(shard)
+        return get_cursor(self.conns[shard])
+
+    def close(self):
+        for conn in self.conns.values():
+            conn.close()
+
+def next_slot_id(floor, shard):
+    # Smallest id above floor that belongs to this shard
+    return (floor // SHARD_ID_STRIDE + 1) * SHARD_ID_STRIDE + shard
+
+def raise_id_floor(conn, table, shard, floor=0):
+    # Moves the shard's next id for table above floor, keeping it in the shard's slot
+    cursor = get_cursor(conn)
+    if DATABASE_URL:
+        cursor.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+        cursor.execute(f"SELECT pg_get_serial_sequence('{table}', 'id')")
+        sequence = cursor.fetchone()[0]
+        cursor.execute("SELECT last_value, increment_by FROM pg_sequences WHERE schemaname || '.' || sequencename = ?", (sequence,))
+        last_value, increment = cursor.fetchone()
+        last_value = last_value or 0
+        if increment == SHARD_ID_STRIDE and last_value % SHARD_ID_STRIDE == shard and last_value >= floor:
+            return
+        cursor.execute(f"ALTER SEQUENCE {sequence} INCREMENT BY {SHARD_ID_STRIDE}")
+        cursor.execute("SELECT setval(?, ?, false)", (sequence, next_slot_id(max(floor, last_value), shard)))
+    else:
+        # SQLite has no sequence step; insert_chat_message picks the slot id from sqlite_sequence
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,))
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, floor))
+        elif row[0] < floor:
+            cursor.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ?", (floor, table))
+
+try:
+    message_shards = MessageShards(ShardMap.load(MESSAGE_SHARD_MAP) if MESSAGE_SHARD_MAP else ShardMap.even(MESSAGE_SHARDS) if MESSAGE_SHARDS else None)
+except (OSError, ValueError, KeyError) as e:
+    raise SystemExit(f"❌ Invalid message shard map: {e}")
+if message_shards.map:
+    print(f"✅ Sharding messages across {len(message_shards.map.shards)} database(s)")
+
 # ========== Create Tables ==========
 
+MESSAGE_TABLES = ["messages", "group_messages", "message_archive"]
+
+def create_message_tables(cursor, foreign_keys=True):
+    # Messages Table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender TEXT NOT NULL,
+            receiver TEXT NOT NULL,
+            message TEXT NOT NULL,
+            timestamp TEXT NOT NULL
+        )
+    ''')
+
+    # Group Messages Table (shards have no groups table to reference)
+    group_fk = ",\n            FOREIGN KEY (group_id) REFERENCES groups (id)" if foreign_keys else ""
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS group_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id INTEGER NOT NULL,
+            sender TEXT NOT NULL,
+            message TEXT NOT NULL,
+            timestamp TEXT NOT NULL{group_fk}
+        )
+    ''')
+
+    # Message Archive Table (compressed chunks of old messages, one conversation per chunk)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS message_archive (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation TEXT NOT NULL,
+            first_id INTEGER NOT NULL,
+            last_id INTEGER NOT NULL,
+            first_timestamp TEXT NOT NULL,
+            last_timestamp TEXT NOT NULL,
+            message_count INTEGER NOT NULL,
+            payload BLOB NOT NULL
+        )
+    ''')
+
+    # Optional client-generated ids make message sends idempotent
+    add_column_if_missing(cursor, "messages", "client_id", "TEXT")
+    add_column_if_missing(cursor, "group_messages", "client_id", "TEXT")
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_pair ON messages (sender, receiver, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_group_messages_group ON group_messages (group_id, id)')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_client_id ON messages (sender, client_id)')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_group_messages_client_id ON group_messages (sender, client_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_message_archive_conversation ON message_archive (conversation, last_id)')
+
+def create_shard_tables():
+    for shard in message_shards.targets():
+        if shard is None:
+            continue
+        conn = message_shards.connect(shard)
+        cursor = get_cursor(conn)
+        create_message_tables(cursor, foreign_keys=False)
+        raise_id_floor(conn, "messages", shard)
+        raise_id_floor(conn, "group_messages", shard)
+        if DATABASE_URL:
+            for table in MESSAGE_TABLES:
+                cursor.execute(f"ALTER TABLE {table} ENABLE ROW LEVEL SECURITY;")
+        conn.commit()
+        conn.close()
+
 def create_tables():
     conn = get_db_connection()
     cursor = get_cursor(conn)
@@ -130,17 +649,6 @@ def create_tables():
         )
     ''')
 
-    # Messages Table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sender TEXT NOT NULL,
-            receiver TEXT NOT NULL,
-            message TEXT NOT NULL,
-            timestamp TEXT NOT NULL
-        )
-    ''')
-    
     # Groups Table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS groups (
@@ -165,18 +673,6 @@ def create_tables():
         )
     ''')
     
-    # Group Messages Table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS group_messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            group_id INTEGER NOT NULL,
-            sender TEXT NOT NULL,
-            message TEXT NOT NULL,
-            timestamp TEXT NOT NULL,
-            FOREIGN KEY (group_id) REFERENCES groups (id)
-        )
-    ''')
-
     # Posts Table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS posts (
@@ -200,9 +696,92 @@ def create_tables():
         )
     ''')
 
+    # Read State Table (per-user read cursor and unread counter for each conversation)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS read_state (
+            username TEXT NOT NULL,
+            conversation TEXT NOT NULL,
+            last_read_id INTEGER NOT NULL DEFAULT 0,
+            unread_count INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT,
+            PRIMARY KEY (username, conversation)
+        )
+    ''')
+
+    # Notifications Table (one row per aggregated event, e.g. "12 people liked your post")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipient TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            actor TEXT NOT NULL,
+            actor_count INTEGER NOT NULL DEFAULT 1,
+            is_read INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL
+        )
+    ''')
+
+    # Jobs Table (background work that must survive restarts)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            last_error TEXT,
+            run_after DOUBLE PRECISION NOT NULL,
+            heartbeat_at DOUBLE PRECISION,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+    # Epoch seconds need a double; Postgres REAL (float4) only resolves them to ~2 minutes
+    if DATABASE_URL:
+        cursor.execute("SELECT data_type FROM information_schema.columns WHERE table_name = 'jobs' AND column_name = 'run_after'")
+        if cursor.fetchone()[0] == 'real':
+            cursor.execute("ALTER TABLE jobs ALTER COLUMN run_after TYPE DOUBLE PRECISION")
+    add_column_if_missing(cursor, "jobs", "heartbeat_at", "DOUBLE PRECISION")
+
+    # Home Timelines Table (the newest post ids each user should see, filled by fan-out)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS timelines (
+            username TEXT NOT NULL,
+            post_id INTEGER NOT NULL,
+            author TEXT NOT NULL,
+            PRIMARY KEY (username, post_id)
+        )
+    ''')
+
+    # Authors with too large an audience to fan out; their posts are merged in at read time
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS high_fanout_authors (
+            username TEXT PRIMARY KEY,
+            audience_size INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+
+    # Groups are soft-deleted first and purged by a background job
+    add_column_if_missing(cursor, "groups", "deleted_at", "TEXT")
+
+    # Distinct actors behind an aggregated notification (JSON list), so repeats aren't counted twice
+    add_column_if_missing(cursor, "notifications", "actors", "TEXT")
+
+    # Message tables live here unless they are sharded, and stay as the source for resharding
+    create_message_tables(cursor)
+
+    # Indexes for per-conversation lookups
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_notifications_recipient ON notifications (recipient, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, run_after)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_group_members_username ON group_members (username, group_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_posts_username ON posts (username, id)')
+
     # Enable RLS for Postgres to secure tables from public API access
     if DATABASE_URL:
-        tables = ["users", "messages", "groups", "group_members", "group_messages", "posts", "post_likes"]
+        tables = ["users", "messages", "groups", "group_members", "group_messages", "posts", "post_likes", "read_state", "notifications", "jobs", "message_archive", "timelines", "high_fanout_authors"]
         for table in tables:
             try:
                 cursor.execute(f"ALTER TABLE {table} ENABLE ROW LEVEL SECURITY;")
@@ -211,12 +790,734 @@ def create_tables():
 
     conn.commit()
     conn.close()
+    create_shard_tables()
 
 create_tables()
 
+# ========== Metrics ==========
+
+metric_counters = defaultdict(int)  # (name, sorted label items) -> count
+metric_gauges = {}                  # name -> callable returning {label tuple: value}
+
+def inc_metric(name, value=1, **labels):
+    metric_counters[(name, tuple(sorted(labels.items())))] += value
+
+def register_gauge(name, func):
+    metric_gauges[name] = func
+
+def format_metric(name, labels, value):
+    if labels:
+        rendered = ",".join(f'{key}="{val}"' for key, val in labels)
+        return f"{name}{{{rendered}}} {value}"
+    return f"{name} {value}"
+
+@app.route('/metrics')
+def get_metrics():
+    lines = [format_metric(name, labels, value) for (name, labels), value in sorted(metric_counters.items())]
+    for name, func in sorted(metric_gauges.items()):
+        for labels, value in func().items():
+            lines.append(format_metric(name, labels, value))
+    return Response("\n".join(lines) + "\n", mimetype="text/plain")
+
+register_gauge("db_replica_lag_seconds", lambda: {(("replica", str(i)),): r["lag"] for i, r in enumerate(replica_router.replicas)})
+register_gauge("db_replica_healthy", lambda: {(("replica", str(i)),): int(r["healthy"]) for i, r in enumerate(replica_router.replicas)})
+
+# ========== Profiling ==========
+
+# Admin endpoints are off unless ADMIN_TOKEN is set; callers send it as X-Admin-Token
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+PROFILE_MAX_SECONDS = 60
+HUB_BLOCK_THRESHOLD = float(os.getenv("HUB_BLOCK_THRESHOLD", 0))
+
+# Real OS-thread primitives, so the sampler keeps running while the hub is busy
+native_start_thread = monkey.get_original('_thread', 'start_new_thread')
+native_sleep = monkey.get_original('time', 'sleep')
+MAIN_THREAD_ID = monkey.get_original('_thread', 'get_ident')()
+
+def is_admin_request():
+    supplied = request.headers.get("X-Admin-Token", "")
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(supplied, ADMIN_TOKEN)
+
+def admin_only(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not is_admin_request():
+            return jsonify({"error": "Not found"}), 404
+        return func(*args, **kwargs)
+    return wrapper
+
+def collapse_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+class StackSampler:
+    def __init__(self):
+        self.running = False
+
+    def sample(self, seconds, interval):
+        # Samples whatever the worker's thread is running: the active greenlet,
+        # or the hub's loop when every greenlet is waiting
+        counts = defaultdict(int)
+        state = {"done": False}
+        native_start_thread(self.collect, (counts, time.time() + seconds, interval, state))
+        while not state["done"]:
+            gevent.sleep(0.05)
+        return counts
+
+    def collect(self, counts, deadline, interval, state):
+        try:
+            while time.time() < deadline:
+                frame = sys._current_frames().get(MAIN_THREAD_ID)
+                if frame is not None:
+                    counts[collapse_stack(frame)] += 1
+                native_sleep(interval)
+        finally:
+            state["done"] = True
+
+stack_sampler = StackSampler()
+
+def render_flamegraph(counts, width=1200, row_height=16):
+    root = {"children": {}, "value": 0}
+    for stack, count in counts.items():
+        node = root
+        node["value"] += count
+        for name in stack.split(";"):
+            node = node["children"].setdefault(name, {"children": {}, "value": 0})
+            node["value"] += count
+
+    rects = []
+    def layout(node, x, depth):
+        for name, child in sorted(node["children"].items()):
+            w = child["value"] / max(root["value"], 1) * width
+            if w >= 0.5:
+                rects.append((x, depth, w, name, child["value"]))
+                layout(child, x, depth + 1)
+            x += w
+    layout(root, 0, 0)
+
+    depth = max((r[1] for r in rects), default=0) + 1
+    out = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{depth * row_height}" font-family="monospace" font-size="11">']
+    for x, d, w, name, value in rects:
+        label = name.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+        hue = 10 + zlib.crc32(name.encode("utf-8")) % 50
+        out.append(
+            f'<g><title>{label} ({value} samples)</title>'
+            f'<rect x="{x:.1f}" y="{d * row_height}" width="{w:.1f}" height="{row_height - 1}" fill="hsl({hue},80%,60%)"/>'
+            + (f'<text x="{x + 2:.1f}" y="{d * row_height + 12}">{label[:int(w / 7)]}</text>' if w > 30 else '')
+            + '</g>'
+        )
+    out.append('</svg>')
+    return "\n".join(out)
+
+@app.route('/admin/profile/sample', methods=['POST'])
+@admin_only
+def profile_sample():
+    seconds = min(request.args.get('seconds', 10, type=float), PROFILE_MAX_SECONDS)
+    interval = max(request.args.get('interval_ms', 5, type=float), 1) / 1000
+    output = request.args.get('format', 'collapsed')
+
+    if stack_sampler.running:
+        return jsonify({"error": "A profile is already being taken"}), 409
+
+    stack_sampler.running = True
+    try:
+        counts = stack_sampler.sample(seconds, interval)
+    finally:
+        stack_sampler.running = False
+
+    if output == 'svg':
+        return Response(render_flamegraph(counts), mimetype="image/svg+xml")
+    body = "\n".join(f"{stack} {count}" for stack, count in sorted(counts.items(), key=lambda item: -item[1]))
+    return Response(body + "\n", mimetype="text/plain")
+
+# Hub-blocking detector: gevent's monitor thread reports greenlets that hold the loop too long
+blocked_events = deque(maxlen=50)
+
+def record_blocked_loop(event):
+    if not isinstance(event, gevent.events.EventLoopBlocked):
+        return
+    stack = "".join(event.info)
+    print(f"⚠️ Event loop blocked for {event.blocking_time:.3f}s by {event.greenlet}")
+    blocked_events.append({
+        "greenlet": repr(event.greenlet),
+        "blocking_time": event.blocking_time,
+        "stack": stack,
+        "detected_at": datetime.now().isoformat()
+    })
+    inc_metric("hub_blocked_total")
+
+if HUB_BLOCK_THRESHOLD > 0:
+    gevent.config.monitor_thread = True
+    gevent.config.max_blocking_time = HUB_BLOCK_THRESHOLD
+    zope.event.subscribers.append(record_blocked_loop)
+    gevent.get_hub().start_periodic_monitoring_thread()
+
+@app.route('/admin/profile/blocked', methods=['GET'])
+@admin_only
+def profile_blocked():
+    return jsonify({"threshold": HUB_BLOCK_THRESHOLD, "events": list(blocked_events)}), 200
+
+# Per-request cProfile: send X-Profile: 1 with the admin token, then fetch the
+# report named in the X-Profile-Id response header. Greenlets that run while the
+# request is waiting on I/O show up in its profile too.
+request_profiles = OrderedDict()
+REQUEST_PROFILES_MAX = 20
+# The profiler hook is per thread, so all greenlets share it: a second cProfile
+# would silently replace the first (only Python 3.12+ raises). One at a time.
+request_profile_active = {"profiler": None}
+
+@app.before_request
+def start_request_profile():
+    if request.headers.get("X-Profile") and is_admin_request():
+        if request_profile_active["profiler"] is not None:
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        request_profile_active["profiler"] = g.profiler = profiler
+
+def stop_request_profile(profiler):
+    profiler.disable()
+    if request_profile_active["profiler"] is profiler:
+        request_profile_active["profiler"] = None
+
+@app.teardown_request
+def release_request_profile(error=None):
+    # after_request is skipped when the view raises; don't leave the slot taken
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        stop_request_profile(profiler)
+
+@app.after_request
+def finish_request_profile(response):
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        stop_request_profile(profiler)
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(40)
+        profile_id = f"{int(time.time() * 1000)}-{len(request_profiles)}"
+        request_profiles[profile_id] = f"{request.method} {request.full_path}\n\n{report.getvalue()}"
+        while len(request_profiles) > REQUEST_PROFILES_MAX:
+            request_profiles.popitem(last=False)
+        response.headers["X-Profile-Id"] = profile_id
+    return response
+
+@app.route('/admin/profile/requests/<profile_id>', methods=['GET'])
+@admin_only
+def profile_request(profile_id):
+    report = request_profiles.get(profile_id)
+    if report is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return Response(report, mimetype="text/plain")
+
+# ========== Rate Limiting ==========
+
+# name -> (tokens per second, burst); override with RATE_LIMITS="send_message=5:20,like_post=2:10"
+RATE_LIMITS = {
+    "send_message": (5, 20),
+    "send_group_message": (5, 20),
+    "group_message_post": (5, 20),
+    "like_post": (2, 10),
+    "create_post": (0.1, 5),
+    "signup": (0.05, 3)
+}
+for rule in filter(None, os.getenv("RATE_LIMITS", "").split(",")):
+    name, limit = rule.split("=")
+    rate, burst = limit.split(":")
+    RATE_LIMITS[name.strip()] = (float(rate), float(burst))
+
+RATE_LIMIT_IDLE_TTL = float(os.getenv("RATE_LIMIT_IDLE_TTL", 300))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000))
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL")
+
+class MemoryRateLimitStore:
+    EVICT_SCAN = 64
+
+    def __init__(self, idle_ttl, max_keys):
+        self.idle_ttl = idle_ttl
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()  # key -> [tokens, updated_at, rate, burst], least recently used first
+
+    def take(self, key, rate, burst, now):
+        bucket = self.buckets.pop(key, None)
+        tokens = burst if bucket is None else min(burst, bucket[0] + (now - bucket[1]) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self.buckets[key] = [tokens, now, rate, burst]
+
+        # Idle buckets have refilled anyway, so dropping them loses nothing
+        while self.buckets:
+            oldest_key, oldest = next(iter(self.buckets.items()))
+            if now - oldest[1] < self.idle_ttl:
+                break
+            del self.buckets[oldest_key]
+        if len(self.buckets) > self.max_keys:
+            self.evict(now)
+        return allowed
+
+    def evict(self, now):
+        # Over the cap: drop a bucket that has refilled among the least recently used,
+        # and only reset a draining one when there is none
+        for key, (tokens, updated_at, rate, burst) in islice(self.buckets.items(), self.EVICT_SCAN):
+            if tokens + (now - updated_at) * rate >= burst:
+                del self.buckets[key]
+                return
+        self.buckets.popitem(last=False)
+
+class RedisRateLimitStore:
+    # Same bucket as the memory store, evaluated atomically in Redis so limits hold across workers
+    SCRIPT = """
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+        local rate = tonumber(ARGV[1])
+        local burst = tonumber(ARGV[2])
+        local now = tonumber(ARGV[3])
+        local tokens = tonumber(bucket[1]) or burst
+        local ts = tonumber(bucket[2]) or now
+        tokens = math.min(burst, tokens + (now - ts) * rate)
+        local allowed = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+            allowed = 1
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+        return allowed
+    """
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(self.SCRIPT)
+
+    def take(self, key, rate, burst, now):
+        return bool(self.script(keys=[f"ratelimit:{key}"], args=[rate, burst, now]))
+
+if RATE_LIMIT_REDIS_URL:
+    rate_limit_store = RedisRateLimitStore(RATE_LIMIT_REDIS_URL)
+else:
+    rate_limit_store = MemoryRateLimitStore(RATE_LIMIT_IDLE_TTL, RATE_LIMIT_MAX_KEYS)
+
+def rate_limit_exceeded(name, identity):
+    limit = RATE_LIMITS.get(name)
+    if not limit:
+        return False
+    # Callers we can't tell apart share one bucket rather than going unlimited
+    identity = identity or "anonymous"
+    try:
+        allowed = rate_limit_store.take(f"{name}:{identity}", limit[0], limit[1], time.time())
+    except Exception as e:
+        # Fail open: an unreachable limiter store must not take chat down with it
+        print(f"⚠️ Rate limit store error: {e}")
+        return False
+    if not allowed:
+        inc_metric("rate_limited_total", limit=name)
+    return not allowed
+
+def rate_limited_route(name, by_ip=False):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # Never a field from the body: a client could pick a fresh one per call
+            if by_ip:
+                identity = request.remote_addr
+            else:
+                identity = g.get("auth_user") or request.remote_addr
+            if rate_limit_exceeded(name, identity):
+                return jsonify({"error": "Too many requests. Please slow down."}), 429
+            return func(*args, **kwargs)
+        wrapper.rate_limit = name
+        return wrapper
+    return decorator
+
+def rate_limited_event(name):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(data, *args, **kwargs):
+            identity = presence.sid_users.get(request.sid) or (data or {}).get("sender") or request.sid
+            if rate_limit_exceeded(name, identity):
+                error = {"event": name, "error": "Too many messages. Please slow down."}
+                emit('rate_limited', error)
+                return error
+            return func(data, *args, **kwargs)
+        return wrapper
+    return decorator
+
+# ========== Degraded Mode ==========
+
+STALE_CACHE_MAX = int(os.getenv("STALE_CACHE_MAX", 5000))
+STALE_CACHE_MAX_BODY = 256 * 1024
+CHAT_SPOOL_DIR = os.getenv("CHAT_SPOOL_DIR", os.path.join(BASE_DIR, "spool"))
+CHAT_SPOOL_REPLAY_INTERVAL = float(os.getenv("CHAT_SPOOL_REPLAY_INTERVAL", 5))
+CHAT_SPOOL_STALE_CLAIM = 300  # a .replaying file this old belongs to a worker that died mid-replay
+
+class StaleCache:
+    # Last good body per GET URL, served when the database is unreachable
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # full path -> (body, mimetype, stored_at)
+
+    def put(self, key, body, mimetype):
+        if len(body) > STALE_CACHE_MAX_BODY:
+            return
+        self.entries[key] = (body, mimetype, time.time())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get(self, key):
+        return self.entries.get(key)
+
+stale_cache = StaleCache(STALE_CACHE_MAX)
+
+def stale_on_outage(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        response = app.make_response(func(*args, **kwargs))
+        if request.method != 'GET':
+            return response
+        key = request.full_path
+        if response.status_code == 200:
+            stale_cache.put(key, response.get_data(), response.mimetype)
+        elif g.get("db_unavailable"):
+            cached = stale_cache.get(key)
+            if not cached:
+                return jsonify({"error": "Service temporarily unavailable", "details": "Database unreachable"}), 503
+            body, mimetype, stored_at = cached
+            inc_metric("stale_responses_total")
+            stale = Response(body, status=200, mimetype=mimetype)
+            stale.headers["X-Stale"] = "1"
+            stale.headers["X-Stale-Age"] = str(int(time.time() - stored_at))
+            stale.headers["Warning"] = '110 - "Response is Stale"'
+            return stale
+        return response
+    return wrapper
+
+class ChatSpool:
+    # Append-only JSON-lines files (one per worker) holding chat sends made while the
+    # database was down. A replayer claims a file by renaming it, so workers never
+    # replay the same file twice; client_id makes a repeated replay harmless.
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self.started = False
+
+    def path(self):
+        return os.path.join(self.directory, f"chat_spool.{os.getpid()}.jsonl")
+
+    def append(self, table, row):
+        os.makedirs(self.directory, exist_ok=True)
+        line = (json.dumps({"table": table, "row": row}) + "\n").encode("utf-8")
+        while True:
+            path = self.path()
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                # The file may have been claimed for replay between open and lock
+                try:
+                    current = os.stat(path).st_ino == os.fstat(fd).st_ino
+                except FileNotFoundError:
+                    current = False
+                if current:
+                    os.write(fd, line)
+                    os.fsync(fd)
+                    break
+            finally:
+                os.close(fd)
+        inc_metric("chat_spooled_total", table=table)
+        self.ensure_started()
+
+    def files(self):
+        return sorted(glob.glob(os.path.join(self.directory, "chat_spool.*.jsonl")))
+
+    def pending(self):
+        count = 0
+        for path in self.files():
+            try:
+                with open(path, "rb") as f:
+                    count += sum(1 for _ in f)
+            except FileNotFoundError:
+                pass
+        return count
+
+    def ensure_started(self):
+        if not self.started:
+            self.started = True
+            socketio.start_background_task(self.run)
+
+    def run(self):
+        while True:
+            try:
+                self.recover_abandoned()
+                for path in self.files():
+                    self.replay(path)
+            except DatabaseUnavailable:
+                pass
+            except Exception as e:
+                print(f"❌ Chat spool replay failed: {e}")
+            gevent.sleep(self.interval)
+
+    def requeue(self, claimed):
+        # Under a fresh name: append() may already have started a new file at the old path
+        os.rename(claimed, os.path.join(self.directory, f"chat_spool.recovered-{uuid.uuid4().hex}.jsonl"))
+
+    def recover_abandoned(self):
+        for path in glob.glob(os.path.join(self.directory, "*.replaying")):
+            try:
+                if time.time() - os.path.getmtime(path) > CHAT_SPOOL_STALE_CLAIM:
+                    self.requeue(path)
+            except FileNotFoundError:
+                pass
+
+    def replay(self, path):
+        claimed = f"{path}.{os.getpid()}.replaying"
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return
+
+        try:
+            with open(claimed, "rb") as f:
+                # Waits out an append that opened the file before the rename
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                records = [json.loads(line) for line in f if line.strip()]
+
+            for record in records:
+                store_chat_message(record["table"], record["row"])
+        except Exception:
+            # Back for the next pass; whatever was already stored is skipped by client_id
+            self.requeue(claimed)
+            raise
+
+        os.remove(claimed)
+        inc_metric("chat_spool_replayed_total", len(records))
+        print(f"✅ Replayed {len(records)} spooled chat message(s)")
+
+chat_spool = ChatSpool(CHAT_SPOOL_DIR, CHAT_SPOOL_REPLAY_INTERVAL)
+
+@app.before_request
+def start_chat_spool():
+    if not chat_spool.started and chat_spool.files():
+        chat_spool.ensure_started()
+
+def spool_chat_message(table, row):
+    # Replay needs a client_id to stay idempotent, so spooled sends always get one
+    row = dict(row, client_id=row.get("client_id") or f"spool-{uuid.uuid4().hex}")
+    chat_spool.append(table, row)
+    return row
+
+register_gauge("db_breaker_open", lambda: {(): int(db_breaker.state != "closed")})
+register_gauge("chat_spool_pending", lambda: {(): chat_spool.pending()})
+register_gauge("message_shard_breaker_open", lambda: {(("shard", str(k)),): int(b.state != "closed") for k, b in message_shards.breakers.items()})
+
+@app.route('/api/health', methods=['GET'])
+def health():
+    # Always 200 so a load balancer keeps routing here: degraded still serves
+    # stale reads and spools sends
+    shards = {str(shard): breaker.state for shard, breaker in message_shards.breakers.items()}
+    healthy = db_breaker.state == "closed" and all(state == "closed" for state in shards.values())
+    return jsonify({
+        "status": "ok" if healthy else "degraded",
+        "database": {
+            "breaker": db_breaker.state,
+            "failures": db_breaker.failures,
+            "opened_at": datetime.fromtimestamp(db_breaker.opened_at).isoformat() if db_breaker.opened_at else None,
+            "last_error": db_breaker.last_error,
+            "fault": db_fault["mode"]
+        },
+        "message_shards": shards,
+        "spool": {"pending": chat_spool.pending(), "files": len(chat_spool.files())},
+        "stale_cache": {"entries": len(stale_cache.entries)}
+    }), 200
+
+@app.route('/admin/db-fault', methods=['POST'])
+@admin_only
+def set_db_fault():
+    data = request.json or {}
+    mode = data.get("mode", "off")
+    if mode not in ("off", "down", "slow"):
+        return jsonify({"error": "mode must be off, down or slow"}), 400
+    db_fault["mode"] = mode
+    db_fault["delay"] = float(data.get("delay", db_fault["delay"]))
+    print(f"⚠️ Database fault injection: {mode}")
+    return jsonify(db_fault), 200
+
+# ========== Session Tokens ==========
+
+AUTH_TOKEN_TTL = int(os.getenv("AUTH_TOKEN_TTL", 7 * 86400))
+# Off: a token is checked when sent, but requests without one still go through.
+# On: every endpoint that acts as a user needs a token for that user.
+AUTH_REQUIRED = os.getenv("AUTH_REQUIRED") == "1"
+AUTH_REVOCATION_MAX = 100000
+
+# Endpoint -> where it names the user it acts as. A tuple of fields means the user
+# must be one of them (a conversation read by either side)
+AUTH_ACTING_USER = {
+    "update_bio": ("json", "username"),
+    "create_post": ("json", "username"),
+    "like_post": ("json", "username"),
+    "create_group": ("json", "username"),
+    "add_group_member": ("json", "added_by"),
+    "bulk_group_members": ("json", "added_by"),
+    "leave_group": ("json", "username"),
+    "handle_group_messages": ("json", "sender"),
+    "mark_notifications_read": ("json", "username"),
+    "get_notifications": ("args", "username"),
+    "get_messages": ("args", ("sender", "receiver")),
+    "get_user_groups": ("args", "username"),
+    "get_chat_history": ("args", "username"),
+    "get_timeline": ("args", "username"),
+}
+
+# Group reads that need a token for a member of the group, whatever AUTH_REQUIRED says.
+# Checked before the view runs, so an outage can't serve them from the stale cache either
+AUTH_GROUP_READERS = {"handle_group_messages", "get_group_details"}
+
+def b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def load_signing_keys():
+    # AUTH_SIGNING_KEYS="k2:newsecret,k1:oldsecret": the first key signs, every key verifies.
+    # To rotate, put the new key first and drop the old one after AUTH_TOKEN_TTL.
+    keys = OrderedDict()
+    for entry in os.getenv("AUTH_SIGNING_KEYS", "").split(","):
+        kid, _, secret = entry.strip().partition(":")
+        if kid and secret:
+            keys[kid] = secret.encode("utf-8")
+    if not keys:
+        if AUTH_REQUIRED:
+            raise SystemExit("❌ AUTH_REQUIRED=1 needs AUTH_SIGNING_KEYS; refusing to start with a random signing key")
+        print("⚠️ " + "=" * 70)
+        print("⚠️ AUTH_SIGNING_KEYS not set; using a random key, so tokens end at restart and only work on this worker.")
+        print("⚠️ Set AUTH_SIGNING_KEYS before running more than one worker or turning on AUTH_REQUIRED.")
+        print("⚠️ " + "=" * 70)
+        keys["dev"] = os.urandom(32)
+    return keys
+
+class TokenSigner:
+    # Tokens are "<kid>.<claims>.<signature>", with HMAC-SHA256 over "<kid>.<claims>"
+    def __init__(self, keys, ttl):
+        self.keys = keys
+        self.active_kid = next(iter(keys))
+        self.ttl = ttl
+        self.revoked = OrderedDict()  # jti -> exp
+        self.revoked_before = {}      # username -> tokens issued before this are void
+
+    def signature(self, kid, signing_input):
+        return b64encode(hmac.new(self.keys[kid], signing_input.encode("ascii"), hashlib.sha256).digest())
+
+    def issue(self, username):
+        now = int(time.time())
+        claims = {"sub": username, "iat": now, "exp": now + self.ttl, "jti": uuid.uuid4().hex[:16]}
+        signing_input = f"{self.active_kid}.{b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))}"
+        return f"{signing_input}.{self.signature(self.active_kid, signing_input)}", claims["exp"]
+
+    def verify(self, token):
+        # Claims for a valid token, else None
+        try:
+            kid, payload, signature = token.split(".")
+            if kid not in self.keys or not hmac.compare_digest(signature, self.signature(kid, f"{kid}.{payload}")):
+                return None
+            claims = json.loads(b64decode(payload))
+        except (ValueError, TypeError):
+            return None
+        if claims["exp"] < time.time() or claims["jti"] in self.revoked:
+            return None
+        if claims["iat"] < self.revoked_before.get(claims["sub"], 0):
+            return None
+        return claims
+
+    def revoke(self, claims):
+        self.revoked[claims["jti"]] = claims["exp"]
+        now = time.time()
+        while self.revoked and (next(iter(self.revoked.values())) < now or len(self.revoked) > AUTH_REVOCATION_MAX):
+            self.revoked.popitem(last=False)
+
+    def revoke_user(self, username):
+        self.revoked_before[username] = time.time()
+
+# Revocations live in this worker's memory only; keep AUTH_TOKEN_TTL short enough to live with that
+token_signer = TokenSigner(load_signing_keys(), AUTH_TOKEN_TTL)
+
+def issue_token_response(username):
+    token, expires_at = token_signer.issue(username)
+    return {"token": token, "expires_at": expires_at}
+
+@app.before_request
+def authenticate_request():
+    g.auth_user = None
+    g.auth_claims = None
+    header = request.headers.get("Authorization", "")
+    if header.startswith("Bearer "):
+        claims = token_signer.verify(header[7:])
+        if claims is not None:
+            g.auth_user = claims["sub"]
+            g.auth_claims = claims
+        elif AUTH_REQUIRED:
+            return jsonify({"error": "Invalid or expired token"}), 401
+        # Otherwise the request carries on as anonymous, like one without a token
+
+    if request.method == "GET" and request.endpoint in AUTH_GROUP_READERS:
+        if g.auth_user is None:
+            return jsonify({"error": "Authentication required"}), 401
+        if not membership_index.is_member(request.view_args["group_id"], g.auth_user):
+            return jsonify({"error": "User is not a member of this group"}), 403
+        return None
+
+    acting = AUTH_ACTING_USER.get(request.endpoint)
+    if acting is None or (request.method == "GET" and acting[0] == "json"):
+        return None
+    if g.auth_user is None:
+        if AUTH_REQUIRED:
+            return jsonify({"error": "Authentication required"}), 401
+        return None
+
+    source, fields = acting
+    values = request.args if source == "args" else (request.get_json(silent=True) or {})
+    claimed = [values.get(field) for field in (fields if isinstance(fields, tuple) else (fields,))]
+    claimed = [value for value in claimed if value is not None]
+    if claimed and g.auth_user not in claimed:
+        return jsonify({"error": "Token does not match the acting user"}), 403
+    return None
+
+socket_users = {}  # sid -> username verified from the token at connect
+
+def socket_identity_error(event, claimed):
+    verified = socket_users.get(request.sid)
+    if verified is None and not AUTH_REQUIRED:
+        return None
+    if claimed == verified:
+        return None
+    error = {"event": event, "error": "Not allowed to act as this user"}
+    emit('auth_error', error)
+    return error
+
+@app.route('/api/logout', methods=['POST'])
+def logout():
+    claims = g.get("auth_claims")
+    if claims:
+        token_signer.revoke(claims)
+    return jsonify({"message": "Logged out"}), 200
+
+@app.route('/admin/auth/revoke', methods=['POST'])
+@admin_only
+def revoke_user_tokens():
+    username = (request.json or {}).get("username")
+    if not username:
+        return jsonify({"error": "Username is required"}), 400
+    token_signer.revoke_user(username)
+    return jsonify({"message": f"Revoked tokens for {username} on this worker"}), 200
+
 # ========== Signup ==========
 
 @app.route('/api/signup', methods=['POST'])
+@rate_limited_route("signup", by_ip=True)
 def signup():
     data = request.json
     full_name = data.get("fullName")
@@ -239,7 +1540,7 @@ def signup():
         ''', (full_name, username, email, hashed_password, date_of_joining))
         conn.commit()
         conn.close()
-        return jsonify({"message": "Sign-up successful!"}), 201
+        return jsonify({"message": "Sign-up successful!", **issue_token_response(username)}), 201
     except Exception as e:
         # Check for integrity error in a DB-agnostic way or catch specific exceptions
         if "unique constraint" in str(e).lower() or "already exists" in str(e).lower():
@@ -269,7 +1570,8 @@ def login():
                 "username": user[2],
                 "email": user[3],
                 "date_of_joining": user[5]
-            }
+            },
+            **issue_token_response(user[2])
         }), 200
     else:
         return jsonify({"error": "Invalid username or password"}), 401
@@ -277,9 +1579,10 @@ def login():
 # ========== Get Users ==========
 
 @app.route('/api/users', methods=['GET'])
+@stale_on_outage
 def get_users():
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(read_only=True)
         cursor = get_cursor(conn)
         cursor.execute('SELECT id, full_name, username, email, date_of_joining FROM users')
         users = cursor.fetchall()
@@ -299,29 +1602,152 @@ def get_users():
     except Exception as e:
         return jsonify({"error": "Failed to fetch users", "details": str(e)}), 500
 
+# ========== Recent Messages ==========
+
+RECENT_MESSAGES_PER_ROOM = int(os.getenv("RECENT_MESSAGES_PER_ROOM", 100))
+RECENT_MESSAGES_MAX_BYTES = int(os.getenv("RECENT_MESSAGES_MAX_BYTES", 64 * 1024 * 1024))
+RECENT_MESSAGES_TTL = float(os.getenv("RECENT_MESSAGES_TTL", 300))
+
+def row_size(row):
+    return sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+
+class RoomBuffer:
+    __slots__ = ("rows", "complete", "loaded_at", "size")
+
+    def __init__(self, loaded_at):
+        self.rows = deque()      # newest messages as (id, ..., message, timestamp) row tuples, oldest first
+        self.complete = False    # True when nothing older than rows[0] exists
+        self.loaded_at = loaded_at
+        self.size = 0
+
+class RecentMessages:
+    # The newest messages of each room this worker has served or sent, so opening a chat
+    # skips the database. Rooms are evicted least recently used past the byte cap, and
+    # reloaded after the TTL in case another worker wrote to them.
+    def __init__(self, per_room, max_bytes, ttl):
+        self.per_room = per_room
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.rooms = OrderedDict()  # conversation -> RoomBuffer, least recently used first
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def page(self, conversation, limit):
+        # Newest `limit` rows (all of them for None) oldest first, or None to read the database
+        room = self.rooms.get(conversation)
+        if room is not None and time.time() - room.loaded_at > self.ttl:
+            self.drop(conversation)
+            room = None
+        if room is None or not ((limit and len(room.rows) >= limit) or room.complete):
+            self.misses += 1
+            inc_metric("recent_messages_lookups_total", result="miss")
+            return None
+        self.rooms.move_to_end(conversation)
+        self.hits += 1
+        inc_metric("recent_messages_lookups_total", result="hit")
+        rows = list(room.rows)
+        return rows[-limit:] if limit else rows
+
+    def fill(self, conversation, rows, complete):
+        # rows: the newest page read from the database
+        rows = sorted(rows, key=lambda row: row[0])
+        room = self.rooms.get(conversation)
+        newer = [row for row in room.rows if not rows or row[0] > rows[-1][0]] if room else []
+        self.drop(conversation)
+        room = RoomBuffer(time.time())
+        room.complete = complete and len(rows) <= self.per_room
+        self.rooms[conversation] = room
+        # Only the columns the history endpoints return
+        for row in [tuple(row[:5]) for row in rows[-self.per_room:]] + newer:
+            self.append(room, row)
+        self.evict()
+
+    def add(self, conversation, row):
+        # A message this worker just stored; ids from concurrent sends can land out of order
+        room = self.rooms.get(conversation)
+        if room is None:
+            room = self.rooms[conversation] = RoomBuffer(time.time())
+        self.rooms.move_to_end(conversation)
+        self.append(room, row)
+        self.evict()
+
+    def append(self, room, row):
+        position = len(room.rows)
+        while position and room.rows[position - 1][0] > row[0]:
+            position -= 1
+        if position and room.rows[position - 1][0] == row[0]:
+            return
+        room.rows.insert(position, row)
+        size = row_size(row)
+        room.size += size
+        self.bytes += size
+        while len(room.rows) > self.per_room:
+            size = row_size(room.rows.popleft())
+            room.size -= size
+            self.bytes -= size
+            room.complete = False
+
+    def evict(self):
+        while self.bytes > self.max_bytes and self.rooms:
+            _, room = self.rooms.popitem(last=False)
+            self.bytes -= room.size
+            inc_metric("recent_messages_evictions_total")
+
+    def drop(self, conversation):
+        room = self.rooms.pop(conversation, None)
+        if room is not None:
+            self.bytes -= room.size
+
+recent_messages = RecentMessages(RECENT_MESSAGES_PER_ROOM, RECENT_MESSAGES_MAX_BYTES, RECENT_MESSAGES_TTL)
+register_gauge("recent_messages_rooms", lambda: {(): len(recent_messages.rooms)})
+register_gauge("recent_messages_bytes", lambda: {(): recent_messages.bytes})
+register_gauge("recent_messages_hit_ratio", lambda: {(): round(recent_messages.hits / max(recent_messages.hits + recent_messages.misses, 1), 4)})
+
 # ========== Get Messages ==========
 
 @app.route('/api/messages', methods=['GET'])
+@stale_on_outage
 def get_messages():
     try:
         sender = request.args.get('sender')
         receiver = request.args.get('receiver')
+        before = request.args.get('before', type=int)
+        limit = request.args.get('limit', type=int)
 
         if not sender or not receiver:
             return jsonify({"error": "Sender and receiver are required"}), 400
 
-        conn = get_db_connection()
-        cursor = get_cursor(conn)
-        
-        # Get messages where current user is either sender or receiver
-        cursor.execute('''
-            SELECT * FROM messages 
-            WHERE (sender = ? AND receiver = ?) OR (sender = ? AND receiver = ?)
-            ORDER BY timestamp ASC
-        ''', (sender, receiver, receiver, sender))
-        
-        messages = cursor.fetchall()
-        conn.close()
+        conversation = get_room_id(sender, receiver)
+        limit = min(limit, 500) if limit else None
+
+        # The latest page usually comes straight from memory
+        messages = None if before else recent_messages.page(conversation, limit)
+        if messages is None:
+            conn = message_shards.connect_for(conversation, read_only=True)
+            cursor = get_cursor(conn)
+
+            if limit:
+                # One page of history ending before the given id
+                messages = load_history_page(cursor, conversation, '''
+                    SELECT * FROM messages
+                    WHERE ((sender = ? AND receiver = ?) OR (sender = ? AND receiver = ?)) AND id < ?
+                    ORDER BY id DESC LIMIT ?
+                ''', (sender, receiver, receiver, sender), before, limit)
+            else:
+                # Get messages where current user is either sender or receiver
+                cursor.execute('''
+                    SELECT * FROM messages 
+                    WHERE (sender = ? AND receiver = ?) OR (sender = ? AND receiver = ?)
+                    ORDER BY timestamp ASC
+                ''', (sender, receiver, receiver, sender))
+                hot_messages = cursor.fetchall()
+                messages = read_whole_archive(cursor, conversation) + hot_messages
+
+            conn.close()
+            # A lagging replica's page would sit in the buffer until the TTL; only cache primary reads
+            if not before and not g.get("replica_read"):
+                recent_messages.fill(conversation, messages, complete=not limit or len(messages) < limit)
 
         message_list = []
         for msg in messages:
@@ -337,9 +1763,66 @@ def get_messages():
     except Exception as e:
         return jsonify({"error": "Failed to fetch messages", "details": str(e)}), 500
 
-# ========== Get Chat History ==========
+# ========== Get Chat History ==========
+
+def last_messages(cursor, username, group_ids, read_ids):
+    # Last message of each of the user's direct chats, and of the given groups along with
+    # how many of theirs are unread past the user's read cursor, on one shard
+    cursor.execute('''
+        SELECT DISTINCT 
+            CASE 
+                WHEN sender = ? THEN receiver 
+                ELSE sender 
+            END as participant
+        FROM messages
+        WHERE sender = ? OR receiver = ?
+    ''', (username, username, username))
+    
+    direct = {}
+    for participant in cursor.fetchall():
+        participant_username = participant[0]
+        
+        # Get the last message exchanged with this participant
+        cursor.execute('''
+            SELECT * FROM messages 
+            WHERE (sender = ? AND receiver = ?) OR (sender = ? AND receiver = ?)
+            ORDER BY timestamp DESC
+            LIMIT 1
+        ''', (username, participant_username, participant_username, username))
+        
+        last_message = cursor.fetchone()
+        if last_message:
+            direct[participant_username] = last_message
+
+    group = {}
+    for group_id in group_ids:
+        # Get the last message in this group
+        cursor.execute('''
+            SELECT * FROM group_messages 
+            WHERE group_id = ?
+            ORDER BY timestamp DESC
+            LIMIT 1
+        ''', (group_id,))
+        
+        last_message = cursor.fetchone()
+        if not last_message:
+            continue
+        unread = 0
+        read_id = read_ids.get(group_conversation(group_id), 0)
+        if last_message[0] > read_id:
+            cursor.execute('''
+                SELECT COUNT(*) FROM (
+                    SELECT 1 FROM group_messages
+                    WHERE group_id = ? AND id > ? AND sender != ?
+                    LIMIT ?
+                ) unread
+            ''', (group_id, read_id, username, GROUP_UNREAD_CAP))
+            unread = cursor.fetchone()[0]
+        group[group_id] = (last_message, unread)
+    return direct, group
 
 @app.route('/api/chat-history', methods=['GET'])
+@stale_on_outage
 def get_chat_history():
     try:
         username = request.args.get('username')
@@ -347,43 +1830,12 @@ def get_chat_history():
         if not username:
             return jsonify({"error": "Username parameter is required"}), 400
         
-        conn = get_db_connection()
+        # Write out any read cursors this user has buffered so the counts are current
+        read_cursors.flush(username=username)
+
+        conn = get_db_connection(read_only=True)
         cursor = get_cursor(conn)
-        
-        # Find all unique conversations involving this user
-        cursor.execute('''
-            SELECT DISTINCT 
-                CASE 
-                    WHEN sender = ? THEN receiver 
-                    ELSE sender 
-                END as participant
-            FROM messages
-            WHERE sender = ? OR receiver = ?
-        ''', (username, username, username))
-        
-        participants = cursor.fetchall()
-        chat_history = []
-        
-        for participant in participants:
-            participant_username = participant[0]
-            
-            # Get the last message exchanged with this participant
-            cursor.execute('''
-                SELECT * FROM messages 
-                WHERE (sender = ? AND receiver = ?) OR (sender = ? AND receiver = ?)
-                ORDER BY timestamp DESC
-                LIMIT 1
-            ''', (username, participant_username, participant_username, username))
-            
-            last_message = cursor.fetchone()
-            
-            if last_message:
-                chat_history.append({
-                    "participants": [username, participant_username],
-                    "lastMessage": last_message[3],  # message content
-                    "timestamp": last_message[4],    # timestamp
-                    "type": "direct"
-                })
+        unread, read_ids = get_unread_counts(cursor, username)
         
         # Get all groups the user is a member of
         cursor.execute('''
@@ -394,20 +1846,41 @@ def get_chat_history():
         ''', (username,))
         
         groups = cursor.fetchall()
+
+        # Each shard holds some of this user's conversations; ask them all at once
+        groups_by_shard = defaultdict(list)
+        for group in groups:
+            groups_by_shard[message_shards.shard_for(group_conversation(group[0]))].append(group[0])
+        try:
+            found = message_shards.scatter(
+                lambda shard_cursor, shard: last_messages(shard_cursor, username, groups_by_shard[shard], read_ids),
+                primary=conn
+            )
+        finally:
+            conn.close()
+
+        # A conversation being resharded can briefly be on two shards; the newest copy wins
+        last_direct, last_group = {}, {}
+        for direct, group in found.values():
+            for participant, last_message in direct.items():
+                if participant not in last_direct or last_message[4] > last_direct[participant][4]:
+                    last_direct[participant] = last_message
+            last_group.update(group)
+
+        chat_history = []
+        for participant_username, last_message in last_direct.items():
+            chat_history.append({
+                "participants": [username, participant_username],
+                "lastMessage": last_message[3],  # message content
+                "timestamp": last_message[4],    # timestamp
+                "type": "direct",
+                "unread": unread.get(get_room_id(username, participant_username), 0)
+            })
         
         for group in groups:
             group_id = group[0]
             group_name = group[1]
-            
-            # Get the last message in this group
-            cursor.execute('''
-                SELECT * FROM group_messages 
-                WHERE group_id = ?
-                ORDER BY timestamp DESC
-                LIMIT 1
-            ''', (group_id,))
-            
-            last_message = cursor.fetchone()
+            last_message, group_unread = last_group.get(group_id, (None, 0))
             
             if last_message:
                 chat_history.append({
@@ -416,7 +1889,8 @@ def get_chat_history():
                     "lastMessage": last_message[3],  # message content
                     "sender": last_message[2],       # sender
                     "timestamp": last_message[4],    # timestamp
-                    "type": "group"
+                    "type": "group",
+                    "unread": group_unread
                 })
             else:
                 chat_history.append({
@@ -425,81 +1899,904 @@ def get_chat_history():
                     "lastMessage": "No messages yet",
                     "sender": "",
                     "timestamp": group[3],  # created_at
-                    "type": "group"
+                    "type": "group",
+                    "unread": 0
                 })
         
-        conn.close()
         return jsonify(chat_history), 200
     except Exception as e:
         return jsonify({"error": "Failed to fetch chat history", "details": str(e)}), 500
 
+# ========== Presence ==========
+
+PRESENCE_MAX_SESSIONS = int(os.getenv("PRESENCE_MAX_SESSIONS", 5))
+PRESENCE_HEARTBEAT_INTERVAL = float(os.getenv("PRESENCE_HEARTBEAT_INTERVAL", 30))
+PRESENCE_LAST_SEEN_MAX = int(os.getenv("PRESENCE_LAST_SEEN_MAX", 100000))
+
+class PresenceEntry:
+    __slots__ = ("sids", "last_seen")
+
+    def __init__(self, now):
+        self.sids = []
+        self.last_seen = now
+
+class PresenceRegistry:
+    def __init__(self, max_sessions, heartbeat_interval, last_seen_max):
+        self.max_sessions = max_sessions
+        self.heartbeat_interval = heartbeat_interval
+        self.last_seen_max = last_seen_max
+        self.online = {}              # username -> PresenceEntry
+        self.sid_users = {}           # sid -> username
+        self.last_seen = OrderedDict()  # username -> last seen, offline users only (LRU capped)
+
+    def connect(self, username, sid):
+        now = time.time()
+        entry = self.online.get(username)
+        if entry is None:
+            entry = self.online[username] = PresenceEntry(now)
+            self.last_seen.pop(username, None)
+        entry.sids.append(sid)
+        entry.last_seen = now
+        self.sid_users[sid] = username
+
+        # Cap sessions per user; the oldest ones are handed back to be disconnected
+        evicted = entry.sids[:-self.max_sessions]
+        if evicted:
+            entry.sids = entry.sids[-self.max_sessions:]
+            for old_sid in evicted:
+                self.sid_users.pop(old_sid, None)
+        return evicted
+
+    def disconnect(self, sid):
+        username = self.sid_users.pop(sid, None)
+        if username is None:
+            return None
+        entry = self.online.get(username)
+        if entry and sid in entry.sids:
+            entry.sids.remove(sid)
+            if not entry.sids:
+                del self.online[username]
+                self.last_seen[username] = time.time()
+                if len(self.last_seen) > self.last_seen_max:
+                    self.last_seen.popitem(last=False)
+        return username
+
+    def heartbeat(self, sid):
+        username = self.sid_users.get(sid)
+        entry = self.online.get(username) if username else None
+        if entry is None:
+            return
+        # Heartbeats from every tab collapse into one update per interval
+        now = time.time()
+        if now - entry.last_seen >= self.heartbeat_interval:
+            entry.last_seen = now
+
+    def status(self, usernames=None):
+        if usernames is None:
+            usernames = list(self.online)
+        result = {}
+        for username in usernames:
+            entry = self.online.get(username)
+            if entry:
+                result[username] = {
+                    "online": True,
+                    "sessions": len(entry.sids),
+                    "last_seen": datetime.fromtimestamp(entry.last_seen).isoformat()
+                }
+            else:
+                seen = self.last_seen.get(username)
+                result[username] = {
+                    "online": False,
+                    "sessions": 0,
+                    "last_seen": datetime.fromtimestamp(seen).isoformat() if seen else None
+                }
+        return result
+
+presence = PresenceRegistry(PRESENCE_MAX_SESSIONS, PRESENCE_HEARTBEAT_INTERVAL, PRESENCE_LAST_SEEN_MAX)
+
+def user_room(username):
+    return f"user:{username}"
+
+@socketio.on('connect')
+def handle_connect(auth=None):
+    auth = auth or {}
+    # The token is checked once here; events trust socket_users for this sid afterwards
+    token = auth.get('token') or request.args.get('token')
+    claims = token_signer.verify(token) if token else None
+    if claims is not None:
+        username = claims["sub"]
+        socket_users[request.sid] = username
+    elif AUTH_REQUIRED:
+        raise ConnectionRefusedError("invalid_token" if token else "authentication_required")
+    else:
+        # A stale token from an old session connects as anonymous while auth is optional
+        username = auth.get('username') or request.args.get('username')
+
+    socket_variants[request.sid] = negotiate_variant(auth)
+    if not username:
+        return
+    join_room(user_room(username))
+    for stale_sid in presence.connect(username, request.sid):
+        disconnect(sid=stale_sid, namespace='/')
+    print(f"{username} connected to room {user_room(username)}")
+
+@socketio.on('disconnect')
+def handle_disconnect(reason=None):
+    presence.disconnect(request.sid)
+    membership_index.leave_socket(request.sid)
+    socket_variants.pop(request.sid, None)
+    socket_users.pop(request.sid, None)
+
+@socketio.on('heartbeat')
+def handle_heartbeat(data=None):
+    presence.heartbeat(request.sid)
+
+@socketio.on('who_online')
+def handle_who_online(data=None):
+    usernames = (data or {}).get('usernames')
+    return presence.status(usernames)
+
+@app.route('/api/presence', methods=['GET', 'POST'])
+def get_presence():
+    if request.method == 'POST':
+        usernames = (request.json or {}).get('usernames')
+    else:
+        param = request.args.get('usernames')
+        usernames = [u for u in param.split(',') if u] if param else None
+    return jsonify({"users": presence.status(usernames)}), 200
+
+# ========== Read State ==========
+
+READ_FLUSH_INTERVAL = float(os.getenv("READ_FLUSH_INTERVAL", 2))
+# Group unread counts are counted from the reader's cursor when chat history loads,
+# so a send never writes a row per member; the count stops at this cap
+GROUP_UNREAD_CAP = int(os.getenv("GROUP_UNREAD_CAP", 99))
+
+def group_conversation(group_id):
+    return f"group_{group_id}"
+
+def bump_unread_direct(cursor, sender, receiver):
+    cursor.execute('''
+        INSERT INTO read_state (username, conversation, last_read_id, unread_count, updated_at)
+        VALUES (?, ?, 0, 1, ?)
+        ON CONFLICT (username, conversation) DO UPDATE SET unread_count = read_state.unread_count + 1
+    ''', (receiver, get_room_id(sender, receiver), datetime.now().isoformat()))
+
+class ReadCursorBuffer:
+    def __init__(self, interval):
+        self.interval = interval
+        self.pending = {}  # (username, conversation) -> (last_read_id, kind, target)
+        self.started = False
+
+    def mark(self, username, kind, target, last_read_id):
+        conversation = get_room_id(username, target) if kind == "direct" else group_conversation(target)
+        key = (username, conversation)
+        current = self.pending.get(key)
+        # Repeated marks for the same conversation coalesce into the highest id
+        if current is None or last_read_id > current[0]:
+            self.pending[key] = (last_read_id, kind, target)
+        if not self.started:
+            self.started = True
+            socketio.start_background_task(self.run)
+
+    def run(self):
+        while True:
+            socketio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ Read cursor flush failed: {e}")
+
+    def flush(self, username=None):
+        if username is None:
+            batch, self.pending = self.pending, {}
+        else:
+            batch = {key: value for key, value in self.pending.items() if key[0] == username}
+            for key in batch:
+                del self.pending[key]
+        if not batch:
+            return
+
+        conn = get_db_connection()
+        shards = ShardSession(conn)
+        try:
+            cursor = get_cursor(conn)
+            now = datetime.now().isoformat()
+            receipts = []
+            for (reader, conversation), (last_read_id, kind, target) in batch.items():
+                cursor.execute('SELECT last_read_id FROM read_state WHERE username = ? AND conversation = ?', (reader, conversation))
+                row = cursor.fetchone()
+                last_read_id = max(last_read_id, row[0] if row else 0)
+
+                # Recount from the cursor so messages that arrived after it stay unread;
+                # groups only keep the cursor and are counted when chat history loads
+                unread_count = 0
+                if kind == "direct":
+                    shard_cursor = shards.cursor(conversation)
+                    shard_cursor.execute('SELECT COUNT(*) FROM messages WHERE sender = ? AND receiver = ? AND id > ?', (target, reader, last_read_id))
+                    unread_count = shard_cursor.fetchone()[0]
+
+                cursor.execute('''
+                    INSERT INTO read_state (username, conversation, last_read_id, unread_count, updated_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (username, conversation) DO UPDATE SET
+                        last_read_id = excluded.last_read_id,
+                        unread_count = excluded.unread_count,
+                        updated_at = excluded.updated_at
+                ''', (reader, conversation, last_read_id, unread_count, now))
+                receipts.append((reader, kind, target, last_read_id))
+            conn.commit()
+        except Exception:
+            # Put the cursors back so the next flush retries them
+            for key, value in batch.items():
+                if key not in self.pending or value[0] > self.pending[key][0]:
+                    self.pending[key] = value
+            raise
+        finally:
+            shards.close()
+            conn.close()
+
+        # One receipt per conversation per flush interval, however many marks came in
+        for reader, kind, target, last_read_id in receipts:
+            replica_router.note_write(reader)
+            if kind == "direct":
+                socketio.emit('read_receipt', {"reader": reader, "last_read_id": last_read_id}, room=user_room(target))
+            else:
+                socketio.emit('read_receipt', {"reader": reader, "group_id": target, "last_read_id": last_read_id}, room=group_conversation(target))
+
+read_cursors = ReadCursorBuffer(READ_FLUSH_INTERVAL)
+
+@socketio.on('mark_read')
+def handle_mark_read(data):
+    username = socket_users.get(request.sid) or presence.sid_users.get(request.sid) or data.get('username')
+    last_read_id = data.get('last_read_id')
+    if not username or last_read_id is None:
+        return
+    if data.get('group_id') is not None:
+        read_cursors.mark(username, "group", data['group_id'], int(last_read_id))
+    elif data.get('receiver'):
+        read_cursors.mark(username, "direct", data['receiver'], int(last_read_id))
+
+def get_unread_counts(cursor, username):
+    # (direct unread counts, read cursors) by conversation
+    cursor.execute('SELECT conversation, unread_count, last_read_id FROM read_state WHERE username = ?', (username,))
+    rows = cursor.fetchall()
+    return {row[0]: row[1] for row in rows}, {row[0]: row[2] for row in rows}
+
+# ========== Notifications ==========
+
+NOTIFY_FLUSH_INTERVAL = float(os.getenv("NOTIFY_FLUSH_INTERVAL", 2))
+NOTIFY_MAX_ACTORS = 1000
+NOTIFY_PAGE_SIZE = 20
+# Kinds that count every event rather than distinct actors
+NOTIFY_COUNT_EVENTS = {"message"}
+
+class NotificationBuffer:
+    def __init__(self, interval):
+        self.interval = interval
+        # (recipient, kind, subject) -> [count, last_actor, actors]. Count events (messages) only
+        # use count; the others collect distinct actors, counting any past NOTIFY_MAX_ACTORS
+        self.pending = {}
+        self.started = False
+
+    def merge(self, key, count, actors):
+        entry = self.pending.setdefault(key, [0, None, set()])
+        entry[0] += count
+        for actor in actors - entry[2]:
+            if len(entry[2]) < NOTIFY_MAX_ACTORS:
+                entry[2].add(actor)
+            else:
+                entry[0] += 1
+        return entry
+
+    def add(self, recipient, kind, subject, actor):
+        if not recipient or recipient == actor:
+            return
+        # A burst of events on one subject collapses into a single entry
+        if kind in NOTIFY_COUNT_EVENTS:
+            entry = self.merge((recipient, kind, str(subject)), 1, set())
+        else:
+            entry = self.merge((recipient, kind, str(subject)), 0, {actor})
+        entry[1] = actor
+        if not self.started:
+            self.started = True
+            socketio.start_background_task(self.run)
+
+    def run(self):
+        while True:
+            socketio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ Notification flush failed: {e}")
+
+    def flush(self):
+        batch, self.pending = self.pending, {}
+        if not batch:
+            return
+
+        conn = get_db_connection()
+        try:
+            cursor = get_cursor(conn)
+            now = datetime.now().isoformat()
+            rows, replaced = [], []
+            for (recipient, kind, subject), (actor_count, actor, actors) in batch.items():
+                # Fold into the recipient's unread notification for the same subject,
+                # re-inserting it so it moves back to the top of the feed
+                cursor.execute('''
+                    SELECT id, actor_count, actors FROM notifications
+                    WHERE recipient = ? AND kind = ? AND subject = ? AND is_read = 0
+                    ORDER BY id DESC LIMIT 1
+                ''', (recipient, kind, subject))
+                existing = cursor.fetchone()
+                seen = set(json.loads(existing[2])) if existing and existing[2] else set()
+                if existing:
+                    replaced.append((existing[0],))
+                    # Whatever the stored actor list doesn't cover was counted past the cap
+                    actor_count += existing[1] - len(seen)
+
+                stored = None
+                if kind not in NOTIFY_COUNT_EVENTS:
+                    for name in actors - seen:
+                        if len(seen) < NOTIFY_MAX_ACTORS:
+                            seen.add(name)
+                        else:
+                            actor_count += 1
+                    actor_count += len(seen)
+                    stored = json.dumps(sorted(seen))
+                rows.append((recipient, kind, subject, actor, actor_count, stored, now))
+
+            if replaced:
+                cursor.executemany('DELETE FROM notifications WHERE id = ?', replaced)
+            cursor.executemany('''
+                INSERT INTO notifications (recipient, kind, subject, actor, actor_count, actors, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+
+            # Read back the new ids so the live push matches what the API returns
+            created = []
+            for recipient, kind, subject, _, _, _, _ in rows:
+                cursor.execute('''
+                    SELECT * FROM notifications
+                    WHERE recipient = ? AND kind = ? AND subject = ?
+                    ORDER BY id DESC LIMIT 1
+                ''', (recipient, kind, subject))
+                created.append(cursor.fetchone())
+            conn.commit()
+        except Exception:
+            # Put the batch back under anything queued since, keeping the newer last actor
+            for key, (count, actor, actors) in batch.items():
+                entry = self.merge(key, count, actors)
+                entry[1] = entry[1] or actor
+            raise
+        finally:
+            conn.close()
+
+        for row in created:
+            socketio.emit('notification', serialize_notification(row), room=user_room(row[1]))
+
+notification_buffer = NotificationBuffer(NOTIFY_FLUSH_INTERVAL)
+
+def describe_notification(kind, actor, actor_count):
+    others = actor_count - 1
+    who = actor if others == 0 else f"{actor} and {others} other{'s' if others > 1 else ''}"
+    if kind == "like":
+        return f"{who} liked your post"
+    if kind == "group_add":
+        return f"{actor} added you to a group"
+    if kind == "message":
+        return f"{actor} sent you {actor_count} new message{'s' if actor_count > 1 else ''}"
+    return f"{who} interacted with you"
+
+def serialize_notification(row):
+    notification = {
+        "id": row[0],
+        "recipient": row[1],
+        "type": row[2],
+        "sender": row[4],
+        "count": row[5],
+        "read": bool(row[6]),
+        "timestamp": row[7],
+        "message": describe_notification(row[2], row[4], row[5])
+    }
+    if row[2] == "like":
+        notification["postId"] = int(row[3])
+    elif row[2] == "group_add":
+        notification["groupId"] = int(row[3])
+    return notification
+
+@app.route('/api/notifications', methods=['GET'])
+def get_notifications():
+    try:
+        username = request.args.get('username')
+        before = request.args.get('before', type=int)
+        limit = min(request.args.get('limit', NOTIFY_PAGE_SIZE, type=int), 100)
+
+        if not username:
+            return jsonify({"error": "Username parameter is required"}), 400
+
+        conn = get_db_connection()
+        cursor = get_cursor(conn)
+
+        # Keyset pagination on (recipient, id)
+        if before:
+            cursor.execute('''
+                SELECT * FROM notifications
+                WHERE recipient = ? AND id < ?
+                ORDER BY id DESC LIMIT ?
+            ''', (username, before, limit))
+        else:
+            cursor.execute('''
+                SELECT * FROM notifications
+                WHERE recipient = ?
+                ORDER BY id DESC LIMIT ?
+            ''', (username, limit))
+
+        rows = cursor.fetchall()
+        conn.close()
+
+        return jsonify({
+            "notifications": [serialize_notification(row) for row in rows],
+            "next_before": rows[-1][0] if len(rows) == limit else None
+        }), 200
+    except Exception as e:
+        return jsonify({"error": "Failed to fetch notifications", "details": str(e)}), 500
+
+@app.route('/api/notifications/read', methods=['POST'])
+def mark_notifications_read():
+    try:
+        data = request.json
+        username = data.get("username")
+        notification_id = data.get("id")
+
+        if not username:
+            return jsonify({"error": "Username is required"}), 400
+
+        conn = get_db_connection()
+        cursor = get_cursor(conn)
+
+        if notification_id:
+            cursor.execute('UPDATE notifications SET is_read = 1 WHERE recipient = ? AND id = ?', (username, notification_id))
+        else:
+            cursor.execute('UPDATE notifications SET is_read = 1 WHERE recipient = ? AND is_read = 0', (username,))
+
+        conn.commit()
+        conn.close()
+
+        return jsonify({"message": "Notifications marked as read"}), 200
+    except Exception as e:
+        return jsonify({"error": "Failed to update notifications", "details": str(e)}), 500
+
+# ========== Idempotent Sends ==========
+
+SEND_DEDUPE_TTL = float(os.getenv("SEND_DEDUPE_TTL", 120))
+SEND_DEDUPE_MAX = int(os.getenv("SEND_DEDUPE_MAX", 50000))
+
+class RecentSends:
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (table, sender, client_id) -> (id, timestamp, stored_at), oldest first
+
+    def expire(self, now):
+        while self.entries:
+            key, value = next(iter(self.entries.items()))
+            if now - value[2] < self.ttl and len(self.entries) <= self.max_entries:
+                break
+            del self.entries[key]
+
+    def get(self, key):
+        if not key[2]:
+            return None
+        self.expire(time.time())
+        return self.entries.get(key)
+
+    def add(self, key, value):
+        if not key[2]:
+            return
+        self.entries.pop(key, None)
+        self.entries[key] = value + (time.time(),)
+        self.expire(time.time())
+
+recent_sends = RecentSends(SEND_DEDUPE_TTL, SEND_DEDUPE_MAX)
+
+def send_ack(message_id, timestamp, client_id, duplicate):
+    if duplicate:
+        inc_metric("duplicate_sends_total")
+    return {"id": message_id, "timestamp": timestamp, "client_id": client_id, "duplicate": duplicate}
+
+def insert_chat_message(conn, table, row, shard=None):
+    # Returns (id, timestamp, inserted); a row that already exists for this
+    # sender and client_id is returned as-is instead of being inserted again
+    columns = ", ".join(row)
+    values = tuple(row.values())
+    cursor = conn.cursor()
+    if shard is not None and not DATABASE_URL:
+        # SQLite sequences have no step, so take the next id in this shard's slot explicitly
+        columns = "id, " + columns
+        slot_id = f"(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = '{table}'), 0) / {SHARD_ID_STRIDE} + 1) * {SHARD_ID_STRIDE} + {shard}"
+        cursor.execute(f'''
+            INSERT INTO {table} ({columns}) VALUES ({slot_id}, {", ".join(["?"] * len(row))})
+            ON CONFLICT (sender, client_id) DO NOTHING
+        ''', values)
+        if cursor.rowcount == 1:
+            return cursor.lastrowid, row["timestamp"], True
+    elif DATABASE_URL:
+        placeholders = ", ".join(["%s"] * len(row))
+        cursor.execute(f'''
+            INSERT INTO {table} ({columns}) VALUES ({placeholders})
+            ON CONFLICT (sender, client_id) DO NOTHING RETURNING id
+        ''', values)
+        inserted = cursor.fetchone()
+        if inserted:
+            return inserted[0], row["timestamp"], True
+    else:
+        placeholders = ", ".join(["?"] * len(row))
+        cursor.execute(f'''
+            INSERT INTO {table} ({columns}) VALUES ({placeholders})
+            ON CONFLICT (sender, client_id) DO NOTHING
+        ''', values)
+        if cursor.rowcount == 1:
+            return cursor.lastrowid, row["timestamp"], True
+
+    existing = get_cursor(conn)
+    existing.execute(f'SELECT id, timestamp FROM {table} WHERE sender = ? AND client_id = ?', (row["sender"], row["client_id"]))
+    found = existing.fetchone()
+    return found[0], found[1], False
+
+def chat_conversation(table, row):
+    return get_room_id(row["sender"], row["receiver"]) if table == "messages" else group_conversation(row["group_id"])
+
+def chat_row(table, message_id, timestamp, row):
+    # The row as the history endpoints read it back
+    if table == "messages":
+        return (message_id, row["sender"], row["receiver"], row["message"], timestamp)
+    return (message_id, row["group_id"], row["sender"], row["message"], timestamp)
+
+def store_chat_message(table, row):
+    # Stores the message on its conversation's shard and bumps the direct unread count on
+    # the primary. Raises DatabaseUnavailable only if the message itself wasn't stored.
+    conversation = chat_conversation(table, row)
+    shard = message_shards.shard_for(conversation)
+    conn = message_shards.connect(shard)
+    try:
+        message_id, timestamp, inserted = insert_chat_message(conn, table, row, shard)
+        if inserted and shard is None and table == "messages":
+            # Unsharded, the message and its unread count commit together
+            bump_unread_direct(get_cursor(conn), row["sender"], row["receiver"])
+        conn.commit()
+    finally:
+        conn.close()
+
+    if inserted:
+        recent_messages.add(conversation, chat_row(table, message_id, timestamp, row))
+    if inserted and shard is not None and table == "messages":
+        try:
+            conn = get_db_connection()
+        except DatabaseUnavailable as e:
+            # Counts are recomputed from the shard at the reader's next mark_read
+            print(f"⚠️ Unread counts not bumped for {table} message {message_id}: {e}")
+            return message_id, timestamp, inserted
+        try:
+            bump_unread_direct(get_cursor(conn), row["sender"], row["receiver"])
+            conn.commit()
+        finally:
+            conn.close()
+    return message_id, timestamp, inserted
+
+# ========== Group Broadcast ==========
+
+# Clients opt in at connect with auth {"coalesce": true}, optionally with "encoding": "msgpack".
+# msgpack is only sent as coalesced frames: per message it cost more CPU and frames
+# than JSON (bench_group_broadcast.py). Plain JSON clients keep receiving one
+# receive_group_message event per message.
+GROUP_COALESCE_WINDOW = float(os.getenv("GROUP_COALESCE_WINDOW", 0.05))
+GROUP_MESSAGE_FIELDS = ["id", "group_id", "sender", "message", "timestamp", "client_id"]
+
+GROUP_VARIANTS = ("json", "json:batch", "msgpack:batch")
+socket_variants = {}  # sid -> one of GROUP_VARIANTS
+
+def negotiate_variant(auth):
+    auth = auth or {}
+    if auth.get("encoding") == "msgpack" and msgpack:
+        return "msgpack:batch"
+    return "json:batch" if auth.get("coalesce") else "json"
+
+def group_variant_room(group_id, variant):
+    return f"group_{group_id}:{variant}"
+
+def group_rooms(group_id):
+    return [f"group_{group_id}"] + [group_variant_room(group_id, variant) for variant in GROUP_VARIANTS]
+
+def pack_group_messages(group_id, messages):
+    # Field names are sent once per frame instead of once per message
+    return {"group_id": group_id, "fields": GROUP_MESSAGE_FIELDS, "rows": [[m.get(f) for f in GROUP_MESSAGE_FIELDS] for m in messages]}
+
+class GroupCoalescer:
+    def __init__(self, window):
+        self.window = window
+        self.pending = {}  # group_id -> messages waiting for the next frame
+
+    def add(self, group_id, message):
+        if group_id not in self.pending:
+            self.pending[group_id] = []
+            socketio.start_background_task(self.flush_later, group_id)
+        self.pending[group_id].append(message)
+
+    def flush_later(self, group_id):
+        socketio.sleep(self.window)
+        self.flush(group_id)
+
+    def flush(self, group_id):
+        messages = self.pending.pop(group_id, None)
+        if not messages:
+            return
+        frame = pack_group_messages(group_id, messages)
+        if membership_index.has_sockets(group_id, "json:batch"):
+            socketio.emit('receive_group_messages', frame, room=group_variant_room(group_id, "json:batch"))
+        if membership_index.has_sockets(group_id, "msgpack:batch"):
+            socketio.emit('receive_group_messages_packed', msgpack.packb(frame), room=group_variant_room(group_id, "msgpack:batch"))
+
+group_coalescer = GroupCoalescer(GROUP_COALESCE_WINDOW)
+
+def broadcast_group_message(group_id, message):
+    socketio.emit('receive_group_message', message, room=group_variant_room(group_id, "json"))
+
+    # Batched frames are only built when a socket in the group asked for them
+    if membership_index.has_sockets(group_id, "json:batch") or membership_index.has_sockets(group_id, "msgpack:batch"):
+        group_coalescer.add(group_id, message)
+
 # ========== Real-Time Chat ==========
 
 @socketio.on('join')
 def handle_join(data):
+    if socket_identity_error("join", data['sender']):
+        return
     room = get_room_id(data['sender'], data['receiver'])
     join_room(room)
     print(f"{data['sender']} joined room {room}")
 
 @socketio.on('join_group')
 def handle_join_group(data):
+    username = socket_users.get(request.sid) or presence.sid_users.get(request.sid) or data.get('username')
+    if not membership_index.is_member(data['group_id'], username):
+        error = {"event": "join_group", "group_id": data['group_id'], "error": "Not a member of this group"}
+        emit('group_forbidden', error)
+        return error
     room = f"group_{data['group_id']}"
     join_room(room)
+    # Group messages go out per encoding variant; the plain room carries everything else
+    variant = socket_variants.get(request.sid, "json")
+    join_room(group_variant_room(data['group_id'], variant))
+    membership_index.join_socket(data['group_id'], request.sid, variant)
     print(f"{data['username']} joined group room {room}")
 
 @socketio.on('send_message')
+@rate_limited_event("send_message")
 def handle_send_message(data):
+    error = socket_identity_error("send_message", data['sender'])
+    if error:
+        return error
     room = get_room_id(data['sender'], data['receiver'])
+    client_id = data.get("client_id")
+
+    # A resend of something we already stored just gets the original ack back
+    seen = recent_sends.get(("messages", data["sender"], client_id))
+    if seen:
+        return send_ack(seen[0], seen[1], client_id, True)
+
     message = {
         "sender": data["sender"],
         "receiver": data["receiver"],
         "message": data["message"],
         "timestamp": datetime.now().isoformat()
     }
+    if client_id:
+        message["client_id"] = client_id
 
-    # Save to SQLite
-    conn = get_db_connection()
-    cursor = get_cursor(conn)
-    cursor.execute('''
-        INSERT INTO messages (sender, receiver, message, timestamp)
-        VALUES (?, ?, ?, ?)
-    ''', (message["sender"], message["receiver"], message["message"], message["timestamp"]))
-    conn.commit()
-    conn.close()
+    row = {
+        "sender": message["sender"],
+        "receiver": message["receiver"],
+        "message": message["message"],
+        "timestamp": message["timestamp"],
+        "client_id": client_id
+    }
+    try:
+        message["id"], message["timestamp"], inserted = store_chat_message("messages", row)
+    except DatabaseUnavailable:
+        # Deliver live now; the spool stores it once the database is back
+        message["client_id"] = client_id = spool_chat_message("messages", row)["client_id"]
+        message["id"] = None
+        message["spooled"] = True
+        emit('receive_message', message, room=[room, user_room(message["sender"]), user_room(message["receiver"])])
+        return dict(send_ack(None, message["timestamp"], client_id, False), spooled=True)
+
+    recent_sends.add(("messages", message["sender"], client_id), (message["id"], message["timestamp"]))
+    replica_router.note_write(message["sender"])
+    if not inserted:
+        return send_ack(message["id"], message["timestamp"], client_id, True)
 
-    emit('receive_message', message, room=room)
+    # Fan out to both users' rooms; the pair room still serves clients that emit 'join'
+    emit('receive_message', message, room=[room, user_room(message["sender"]), user_room(message["receiver"])])
+    notification_buffer.add(message["receiver"], "message", message["sender"], message["sender"])
     print(f"Message from {message['sender']} to {message['receiver']} in room {room}")
+    return send_ack(message["id"], message["timestamp"], client_id, False)
 
 @socketio.on('send_group_message')
+@rate_limited_event("send_group_message")
 def handle_send_group_message(data):
+    error = socket_identity_error("send_group_message", data['sender'])
+    if error:
+        return error
     group_id = data['group_id']
     room = f"group_{group_id}"
+    client_id = data.get("client_id")
+
+    if not membership_index.is_member(group_id, data["sender"]):
+        error = {"event": "send_group_message", "group_id": group_id, "error": "Not a member of this group"}
+        emit('group_forbidden', error)
+        return error
+
+    seen = recent_sends.get(("group_messages", data["sender"], client_id))
+    if seen:
+        return send_ack(seen[0], seen[1], client_id, True)
+
     message = {
         "group_id": group_id,
         "sender": data["sender"],
         "message": data["message"],
         "timestamp": datetime.now().isoformat()
     }
+    if client_id:
+        message["client_id"] = client_id
 
-    # Save to SQLite
-    conn = get_db_connection()
-    cursor = get_cursor(conn)
-    cursor.execute('''
-        INSERT INTO group_messages (group_id, sender, message, timestamp)
-        VALUES (?, ?, ?, ?)
-    ''', (message["group_id"], message["sender"], message["message"], message["timestamp"]))
-    conn.commit()
-    conn.close()
+    row = {
+        "group_id": message["group_id"],
+        "sender": message["sender"],
+        "message": message["message"],
+        "timestamp": message["timestamp"],
+        "client_id": client_id
+    }
+    try:
+        message["id"], message["timestamp"], inserted = store_chat_message("group_messages", row)
+    except DatabaseUnavailable:
+        message["client_id"] = client_id = spool_chat_message("group_messages", row)["client_id"]
+        message["id"] = None
+        message["spooled"] = True
+        broadcast_group_message(group_id, message)
+        return dict(send_ack(None, message["timestamp"], client_id, False), spooled=True)
 
-    emit('receive_group_message', message, room=room)
+    recent_sends.add(("group_messages", message["sender"], client_id), (message["id"], message["timestamp"]))
+    replica_router.note_write(message["sender"])
+    if not inserted:
+        return send_ack(message["id"], message["timestamp"], client_id, True)
+
+    broadcast_group_message(group_id, message)
     print(f"Group message from {message['sender']} in group {group_id} room {room}")
+    return send_ack(message["id"], message["timestamp"], client_id, False)
 
 def get_room_id(user1, user2):
     return "-".join(sorted([user1, user2]))
 
 # ========== Group Management ==========
 
+MEMBERSHIP_MAX_GROUPS = int(os.getenv("MEMBERSHIP_MAX_GROUPS", 10000))
+MEMBERSHIP_TTL = float(os.getenv("MEMBERSHIP_TTL", 60))
+MEMBERSHIP_RECHECK = float(os.getenv("MEMBERSHIP_RECHECK", 5))
+GROUP_BULK_MAX = int(os.getenv("GROUP_BULK_MAX", 500))
+GROUP_INSERT_CHUNK = 200  # rows per multi-row INSERT, inside SQLite's bound-parameter limit
+
+class MembershipIndex:
+    # group id -> member usernames, loaded on first use. Writes in this worker update it
+    # directly; TTL and the recheck on a miss cover changes made by other workers.
+    def __init__(self, max_groups, ttl, recheck):
+        self.max_groups = max_groups
+        self.ttl = ttl
+        self.recheck = recheck
+        self.groups = OrderedDict()  # group_id -> [members, loaded_at]
+        # This worker's sockets in each group's variant rooms, so broadcasts know which
+        # encodings to build without reading the Socket.IO manager's private room table
+        self.sockets = defaultdict(set)       # (group_id, variant) -> sids
+        self.socket_rooms = defaultdict(set)  # sid -> (group_id, variant) keys
+
+    def load(self, group_id):
+        conn = get_db_connection()
+        cursor = get_cursor(conn)
+        cursor.execute('''
+            SELECT gm.username FROM group_members gm
+            JOIN groups g ON g.id = gm.group_id AND g.deleted_at IS NULL
+            WHERE gm.group_id = ?
+        ''', (group_id,))
+        members = {row[0] for row in cursor.fetchall()}
+        conn.close()
+
+        self.groups[group_id] = [members, time.time()]
+        self.groups.move_to_end(group_id)
+        while len(self.groups) > self.max_groups:
+            self.groups.popitem(last=False)
+        inc_metric("membership_index_loads_total")
+        return members
+
+    def is_member(self, group_id, username):
+        try:
+            group_id = int(group_id)
+        except (TypeError, ValueError):
+            return False
+        if not username:
+            return False
+
+        entry = self.groups.get(group_id)
+        now = time.time()
+        try:
+            if entry is None or now - entry[1] > self.ttl:
+                return username in self.load(group_id)
+            self.groups.move_to_end(group_id)
+            if username in entry[0]:
+                return True
+            # They may have joined through another worker since we loaded the group
+            if now - entry[1] > self.recheck:
+                return username in self.load(group_id)
+            return False
+        except DatabaseUnavailable:
+            # Keep authorizing from what we last knew until the database is back
+            return entry is not None and username in entry[0]
+
+    def add(self, group_id, usernames):
+        entry = self.groups.get(int(group_id))
+        if entry:
+            entry[0].update(usernames)
+
+    def remove(self, group_id, usernames):
+        entry = self.groups.get(int(group_id))
+        if entry:
+            entry[0].difference_update(usernames)
+
+    def drop(self, group_id):
+        self.groups.pop(int(group_id), None)
+
+    def join_socket(self, group_id, sid, variant):
+        key = (int(group_id), variant)
+        self.sockets[key].add(sid)
+        self.socket_rooms[sid].add(key)
+
+    def leave_socket(self, sid, group_id=None):
+        for key in list(self.socket_rooms.get(sid, ())):
+            if group_id is not None and key[0] != int(group_id):
+                continue
+            self.socket_rooms[sid].discard(key)
+            self.sockets[key].discard(sid)
+            if not self.sockets[key]:
+                del self.sockets[key]
+        if not self.socket_rooms.get(sid):
+            self.socket_rooms.pop(sid, None)
+
+    def has_sockets(self, group_id, variant):
+        return bool(self.sockets.get((int(group_id), variant)))
+
+    def group_sockets(self, group_id):
+        return {sid for variant in GROUP_VARIANTS for sid in self.sockets.get((int(group_id), variant), ())}
+
+membership_index = MembershipIndex(MEMBERSHIP_MAX_GROUPS, MEMBERSHIP_TTL, MEMBERSHIP_RECHECK)
+register_gauge("membership_index_groups", lambda: {(): len(membership_index.groups)})
+
+def leave_group_rooms(group_id, usernames):
+    # Removed members' open sockets (their presence sessions) stop receiving the group
+    rooms = group_rooms(group_id)
+    for username in usernames:
+        entry = presence.online.get(username)
+        for sid in list(entry.sids if entry else ()):
+            for room in rooms:
+                leave_room(room, sid=sid, namespace='/')
+            membership_index.leave_socket(sid, group_id)
+
+def close_group_rooms(group_id):
+    for sid in membership_index.group_sockets(group_id):
+        membership_index.leave_socket(sid, group_id)
+    for room in group_rooms(group_id):
+        close_room(room, namespace='/')
+
 @app.route('/api/groups', methods=['GET'])
+@stale_on_outage
 def get_user_groups():
     try:
         username = request.args.get('username')
@@ -537,11 +2834,12 @@ def get_user_groups():
         return jsonify({"error": "Failed to fetch groups", "details": str(e)}), 500
 
 @app.route('/api/all-groups', methods=['GET'])
+@stale_on_outage
 def get_all_groups():
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(read_only=True)
         cursor = get_cursor(conn)
-        cursor.execute('SELECT id, name, description, created_by, created_at FROM groups')
+        cursor.execute('SELECT id, name, description, created_by, created_at FROM groups WHERE deleted_at IS NULL')
         groups = cursor.fetchall()
         
         group_list = []
@@ -618,13 +2916,14 @@ def create_group():
         return jsonify({"error": "Failed to create group", "details": str(e)}), 500
 
 @app.route('/api/groups/<int:group_id>', methods=['GET'])
+@stale_on_outage
 def get_group_details(group_id):
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(read_only=True)
         cursor = get_cursor(conn)
         
         # Get group details
-        cursor.execute('SELECT * FROM groups WHERE id = ?', (group_id,))
+        cursor.execute('SELECT * FROM groups WHERE id = ? AND deleted_at IS NULL', (group_id,))
         group = cursor.fetchone()
         
         if not group:
@@ -675,6 +2974,10 @@ def add_group_member(group_id):
         
         conn = get_db_connection()
         cursor = get_cursor(conn)
+
+        cursor.execute('SELECT id FROM groups WHERE id = ? AND deleted_at IS NULL', (group_id,))
+        if not cursor.fetchone():
+            return jsonify({"error": "Group not found"}), 404
         
         # Allow self-join or admin-add
         if username != added_by:
@@ -699,21 +3002,122 @@ def add_group_member(group_id):
         # Add user to group
         joined_at = datetime.now().isoformat()
         cursor.execute('''
-            INSERT INTO group_members (group_id, username, joined_at, is_admin)
-            VALUES (?, ?, ?, ?)
-        ''', (group_id, username, joined_at, 0))
-        
+            INSERT INTO group_members (group_id, username, joined_at, is_admin)
+            VALUES (?, ?, ?, ?)
+        ''', (group_id, username, joined_at, 0))
+        
+        conn.commit()
+        membership_index.add(group_id, [username])
+        notification_buffer.add(username, "group_add", group_id, added_by)
+        return jsonify({"message": "Member added successfully"}), 200
+    except Exception as e:
+        if "unique constraint" in str(e).lower() or "already exists" in str(e).lower():
+             return jsonify({"error": "User is already a member of this group"}), 409
+        return jsonify({"error": "Failed to add member", "details": str(e)}), 500
+    finally:
+        if conn:
+            conn.close()
+
+@app.route('/api/groups/<int:group_id>/members/bulk', methods=['POST'])
+def bulk_group_members(group_id):
+    conn = None
+    try:
+        data = request.json or {}
+        added_by = data.get("added_by")
+        to_add = list(dict.fromkeys(u for u in data.get("add") or [] if u))
+        to_remove = list(dict.fromkeys(u for u in data.get("remove") or [] if u))
+
+        if not added_by:
+            return jsonify({"error": "added_by is required"}), 400
+        if not to_add and not to_remove:
+            return jsonify({"error": "Nothing to add or remove"}), 400
+        if len(to_add) + len(to_remove) > GROUP_BULK_MAX:
+            return jsonify({"error": f"At most {GROUP_BULK_MAX} usernames per request"}), 400
+
+        conn = get_db_connection()
+        cursor = get_cursor(conn)
+
+        # Group existence and the caller's admin flag in one query
+        cursor.execute('''
+            SELECT g.id, gm.is_admin FROM groups g
+            LEFT JOIN group_members gm ON gm.group_id = g.id AND gm.username = ?
+            WHERE g.id = ? AND g.deleted_at IS NULL
+        ''', (added_by, group_id))
+        group = cursor.fetchone()
+        if not group:
+            return jsonify({"error": "Group not found"}), 404
+        if not group[1]:
+            return jsonify({"error": "Only group admins can manage members"}), 403
+
+        # Which usernames exist and their current membership, in one query
+        usernames = to_add + to_remove
+        placeholders = ", ".join(["?"] * len(usernames))
+        cursor.execute(f'''
+            SELECT u.username, gm.username, gm.is_admin FROM users u
+            LEFT JOIN group_members gm ON gm.group_id = ? AND gm.username = u.username
+            WHERE u.username IN ({placeholders})
+        ''', (group_id, *usernames))
+        known = {row[0]: (row[1] is not None, bool(row[2])) for row in cursor.fetchall()}
+
+        results = {}
+        adding, removing = [], []
+        for username in to_add:
+            if username not in known:
+                results[username] = "not_found"
+            elif known[username][0]:
+                results[username] = "already_member"
+            else:
+                adding.append(username)
+        for username in to_remove:
+            if username not in known:
+                results[username] = "not_found"
+            elif not known[username][0]:
+                results[username] = "not_member"
+            elif known[username][1]:
+                results[username] = "is_admin"
+            else:
+                removing.append(username)
+
+        joined_at = datetime.now().isoformat()
+        for start in range(0, len(adding), GROUP_INSERT_CHUNK):
+            chunk = adding[start:start + GROUP_INSERT_CHUNK]
+            values = ", ".join(["(?, ?, ?, 0)"] * len(chunk))
+            params = [value for username in chunk for value in (group_id, username, joined_at)]
+            cursor.execute(f'''
+                INSERT INTO group_members (group_id, username, joined_at, is_admin)
+                VALUES {values}
+                ON CONFLICT (group_id, username) DO NOTHING
+            ''', params)
+        if removing:
+            placeholders = ", ".join(["?"] * len(removing))
+            cursor.execute(f'''
+                DELETE FROM group_members
+                WHERE group_id = ? AND is_admin = 0 AND username IN ({placeholders})
+            ''', (group_id, *removing))
+
         conn.commit()
-        return jsonify({"message": "Member added successfully"}), 200
+
+        membership_index.add(group_id, adding)
+        membership_index.remove(group_id, removing)
+        leave_group_rooms(group_id, removing)
+        for username in adding:
+            results[username] = "added"
+            notification_buffer.add(username, "group_add", group_id, added_by)
+        for username in removing:
+            results[username] = "removed"
+
+        return jsonify({
+            "message": f"Added {len(adding)}, removed {len(removing)}",
+            "results": results
+        }), 200
     except Exception as e:
-        if "unique constraint" in str(e).lower() or "already exists" in str(e).lower():
-             return jsonify({"error": "User is already a member of this group"}), 409
-        return jsonify({"error": "Failed to add member", "details": str(e)}), 500
+        return jsonify({"error": "Failed to update members", "details": str(e)}), 500
     finally:
         if conn:
             conn.close()
 
 @app.route('/api/groups/<int:group_id>/messages', methods=['GET', 'POST'])
+@stale_on_outage
 def handle_group_messages(group_id):
     if request.method == 'POST':
         try:
@@ -724,25 +3128,33 @@ def handle_group_messages(group_id):
             
             if not sender or not message_text:
                 return jsonify({"error": "Sender and message are required"}), 400
+
+            if rate_limit_exceeded("group_message_post", sender):
+                return jsonify({"error": "Too many requests. Please slow down."}), 429
+
+            if not membership_index.is_member(group_id, sender):
+                return jsonify({"error": "User is not a member of this group"}), 403
             
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            if DATABASE_URL:
-                cursor.execute('''
-                    INSERT INTO group_messages (group_id, sender, message, timestamp)
-                    VALUES (%s, %s, %s, %s) RETURNING id
-                ''', (group_id, sender, message_text, timestamp))
-                message_id = cursor.fetchone()[0]
+            client_id = data.get("client_id")
+            row = {
+                "group_id": group_id,
+                "sender": sender,
+                "message": message_text,
+                "timestamp": timestamp,
+                "client_id": client_id
+            }
+            seen = recent_sends.get(("group_messages", sender, client_id))
+            if seen:
+                message_id, timestamp, inserted = seen[0], seen[1], False
             else:
-                cursor.execute('''
-                    INSERT INTO group_messages (group_id, sender, message, timestamp)
-                    VALUES (?, ?, ?, ?)
-                ''', (group_id, sender, message_text, timestamp))
-                message_id = cursor.lastrowid
-            
-            conn.commit()
-            conn.close()
+                try:
+                    message_id, timestamp, inserted = store_chat_message("group_messages", row)
+                except DatabaseUnavailable:
+                    row = spool_chat_message("group_messages", row)
+                    spooled_message = dict(row, id=None, spooled=True)
+                    broadcast_group_message(group_id, spooled_message)
+                    return jsonify(spooled_message), 202
+                recent_sends.add(("group_messages", sender, client_id), (message_id, timestamp))
             
             new_message = {
                 "id": message_id,
@@ -751,9 +3163,16 @@ def handle_group_messages(group_id):
                 "message": message_text,
                 "timestamp": timestamp
             }
+            if client_id:
+                new_message["client_id"] = client_id
+
+            # A retried POST gets the stored message back without a second broadcast
+            if not inserted:
+                send_ack(message_id, timestamp, client_id, True)
+                return jsonify(new_message), 200
             
             # Also emit via socketio for real-time updates
-            socketio.emit('receive_group_message', new_message, room=f"group_{group_id}")
+            broadcast_group_message(group_id, new_message)
             
             return jsonify(new_message), 201
         except Exception as e:
@@ -761,17 +3180,38 @@ def handle_group_messages(group_id):
 
     # GET method
     try:
-        conn = get_db_connection()
-        cursor = get_cursor(conn)
-        
-        # Get group messages
-        cursor.execute('''
-            SELECT * FROM group_messages 
-            WHERE group_id = ?
-            ORDER BY timestamp ASC
-        ''', (group_id,))
-        
-        messages = cursor.fetchall()
+        before = request.args.get('before', type=int)
+        limit = request.args.get('limit', type=int)
+        limit = min(limit, 500) if limit else None
+
+        conversation = group_conversation(group_id)
+        messages = None if before else recent_messages.page(conversation, limit)
+        if messages is None:
+            conn = message_shards.connect_for(conversation)
+            cursor = get_cursor(conn)
+
+            if limit:
+                # One page of history ending before the given id
+                messages = load_history_page(cursor, conversation, '''
+                    SELECT * FROM group_messages
+                    WHERE group_id = ? AND id < ?
+                    ORDER BY id DESC LIMIT ?
+                ''', (group_id,), before, limit)
+            else:
+                # Get group messages
+                cursor.execute('''
+                    SELECT * FROM group_messages 
+                    WHERE group_id = ?
+                    ORDER BY timestamp ASC
+                ''', (group_id,))
+                hot_messages = cursor.fetchall()
+                messages = read_whole_archive(cursor, conversation) + hot_messages
+
+            conn.close()
+            # A lagging replica's page would sit in the buffer until the TTL; only cache primary reads
+            if not before and not g.get("replica_read"):
+                recent_messages.fill(conversation, messages, complete=not limit or len(messages) < limit)
+
         message_list = []
         
         for msg in messages:
@@ -783,8 +3223,6 @@ def handle_group_messages(group_id):
                 "timestamp": msg[4]
             })
         
-        conn.close()
-        
         return jsonify(message_list), 200
     except Exception as e:
         return jsonify({"error": "Failed to fetch group messages", "details": str(e)}), 500
@@ -846,29 +3284,409 @@ def leave_group(group_id):
         
         remaining_members = cursor.fetchone()[0]
         
+        job_id = None
         if remaining_members == 0:
-            # Delete all group messages
-            cursor.execute('DELETE FROM group_messages WHERE group_id = ?', (group_id,))
-            # Delete the group
-            cursor.execute('DELETE FROM groups WHERE id = ?', (group_id,))
+            # Hide the group now; its messages are purged in batches in the background
+            cursor.execute('UPDATE groups SET deleted_at = ? WHERE id = ?', (datetime.now().isoformat(), group_id))
+            job_id = job_runner.enqueue(conn, "delete_group", {"group_id": group_id})
         
         conn.commit()
         conn.close()
+        membership_index.remove(group_id, [username])
+        leave_group_rooms(group_id, [username])
+        if job_id:
+            close_group_rooms(group_id)
+        job_runner.wake()
         
-        return jsonify({"message": "Left group successfully"}), 200
+        response = {"message": "Left group successfully"}
+        if job_id:
+            response["job_id"] = job_id
+        return jsonify(response), 200
     except Exception as e:
         return jsonify({"error": "Failed to leave group", "details": str(e)}), 500
 
+# ========== Background Jobs ==========
+
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 5))
+JOB_DELETE_BATCH = int(os.getenv("JOB_DELETE_BATCH", 500))
+JOB_BATCH_PAUSE = float(os.getenv("JOB_BATCH_PAUSE", 0.2))
+JOB_RETRY_BASE = float(os.getenv("JOB_RETRY_BASE", 10))
+# Running jobs heartbeat; one silent for JOB_LEASE_TIMEOUT lost its worker and runs again
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", 15))
+JOB_LEASE_TIMEOUT = float(os.getenv("JOB_LEASE_TIMEOUT", 120))
+# Finished and failed jobs are kept this long for inspection, then pruned
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", 7))
+JOB_PRUNE_INTERVAL = float(os.getenv("JOB_PRUNE_INTERVAL", 3600))
+
+class JobRunner:
+    def __init__(self, poll_interval):
+        self.poll_interval = poll_interval
+        self.handlers = {}
+        self.schedules = {}  # kind -> [interval, next_due]
+        self.started = False
+        self.wakeup = gevent.event.Event()
+
+    def register(self, kind):
+        def decorator(func):
+            self.handlers[kind] = func
+            return func
+        return decorator
+
+    def every(self, kind, interval):
+        self.schedules[kind] = [interval, time.time() + interval]
+
+    def enqueue(self, conn, kind, payload, max_attempts=5):
+        # Runs on the caller's connection so the job commits with the caller's changes
+        now = time.time()
+        row = (kind, json.dumps(payload), max_attempts, now, datetime.now().isoformat(), datetime.now().isoformat())
+        cursor = conn.cursor()
+        if DATABASE_URL:
+            cursor.execute('''
+                INSERT INTO jobs (kind, payload, max_attempts, run_after, created_at, updated_at)
+                VALUES (%s, %s, %s, %s, %s, %s) RETURNING id
+            ''', row)
+            return cursor.fetchone()[0]
+        cursor.execute('''
+            INSERT INTO jobs (kind, payload, max_attempts, run_after, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', row)
+        return cursor.lastrowid
+
+    def wake(self):
+        self.ensure_started()
+        self.wakeup.set()
+
+    def ensure_started(self):
+        if not self.started:
+            self.started = True
+            socketio.start_background_task(self.run)
+
+    def run(self):
+        while True:
+            try:
+                self.recover()
+                self.enqueue_scheduled()
+                while self.run_next():
+                    pass
+            except Exception as e:
+                print(f"⚠️ Job runner error: {e}")
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+
+    def enqueue_scheduled(self):
+        now = time.time()
+        for kind, schedule in self.schedules.items():
+            if now < schedule[1]:
+                continue
+            schedule[1] = now + schedule[0]
+
+            # Skip if the previous run is still queued or in progress
+            conn = get_db_connection()
+            cursor = get_cursor(conn)
+            cursor.execute("SELECT id FROM jobs WHERE kind = ? AND status IN ('pending', 'running')", (kind,))
+            if not cursor.fetchone():
+                self.enqueue(conn, kind, {})
+                conn.commit()
+            conn.close()
+
+    def recover(self):
+        # Jobs whose worker stopped heartbeating died with it; run them again.
+        # Jobs other live workers are running keep their lease
+        try:
+            conn = get_db_connection()
+            cursor = get_cursor(conn)
+            cursor.execute('''
+                UPDATE jobs SET status = 'pending', updated_at = ?
+                WHERE status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)
+            ''', (datetime.now().isoformat(), time.time() - JOB_LEASE_TIMEOUT))
+            if cursor.rowcount:
+                print(f"⚠️ Re-queued {cursor.rowcount} job(s) abandoned by a stopped worker")
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            print(f"⚠️ Could not recover jobs: {e}")
+
+    def heartbeat(self, job_id):
+        while True:
+            gevent.sleep(JOB_HEARTBEAT_INTERVAL)
+            try:
+                conn = get_db_connection()
+                get_cursor(conn).execute(
+                    "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running'", (time.time(), job_id))
+                conn.commit()
+                conn.close()
+            except Exception as e:
+                print(f"⚠️ Job {job_id} heartbeat failed: {e}")
+
+    def run_next(self):
+        conn = get_db_connection()
+        try:
+            cursor = get_cursor(conn)
+            cursor.execute('''
+                SELECT id, kind, payload, attempts, max_attempts FROM jobs
+                WHERE status = 'pending' AND run_after <= ?
+                ORDER BY id LIMIT 1
+            ''', (time.time(),))
+            job = cursor.fetchone()
+            if not job:
+                return False
+
+            # Claim it; another worker may have got there first
+            cursor.execute('''
+                UPDATE jobs SET status = 'running', attempts = attempts + 1, heartbeat_at = ?, updated_at = ?
+                WHERE id = ? AND status = 'pending'
+            ''', (time.time(), datetime.now().isoformat(), job[0]))
+            conn.commit()
+            if cursor.rowcount != 1:
+                return True
+        finally:
+            conn.close()
+
+        job_id, kind, payload, attempts = job[0], job[1], json.loads(job[2]), job[3] + 1
+        beat = gevent.spawn(self.heartbeat, job_id)
+        try:
+            handler = self.handlers.get(kind)
+            if handler is None:
+                raise ValueError(f"No handler registered for job kind '{kind}'")
+            handler(payload)
+            self.finish(job_id, "done", None, time.time())
+        except Exception as e:
+            print(f"⚠️ Job {job_id} ({kind}) failed on attempt {attempts}: {e}")
+            if attempts < job[4]:
+                self.finish(job_id, "pending", str(e), time.time() + JOB_RETRY_BASE * 2 ** (attempts - 1))
+            else:
+                self.finish(job_id, "failed", str(e), time.time())
+        finally:
+            beat.kill()
+        return True
+
+    def finish(self, job_id, status, error, run_after):
+        conn = get_db_connection()
+        cursor = get_cursor(conn)
+        cursor.execute('''
+            UPDATE jobs SET status = ?, last_error = ?, run_after = ?, updated_at = ?
+            WHERE id = ?
+        ''', (status, error, run_after, datetime.now().isoformat(), job_id))
+        conn.commit()
+        conn.close()
+
+job_runner = JobRunner(JOB_POLL_INTERVAL)
+
+@app.before_request
+def start_job_runner():
+    job_runner.ensure_started()
+
+def delete_in_batches(query, params, connect=get_db_connection):
+    # Short transactions with pauses so concurrent chat inserts are never stalled for long
+    while True:
+        conn = connect()
+        cursor = get_cursor(conn)
+        cursor.execute(query, params + (JOB_DELETE_BATCH,))
+        deleted = cursor.rowcount
+        conn.commit()
+        conn.close()
+        if deleted < JOB_DELETE_BATCH:
+            return
+        gevent.sleep(JOB_BATCH_PAUSE)
+
+@job_runner.register("prune_jobs")
+def prune_jobs(payload):
+    # run_after holds the finish time of done and failed jobs, and idx_jobs_status covers it
+    delete_in_batches('''
+        DELETE FROM jobs WHERE id IN (
+            SELECT id FROM jobs WHERE status IN ('done', 'failed') AND run_after < ? LIMIT ?
+        )
+    ''', (time.time() - JOB_RETENTION_DAYS * 86400,))
+
+job_runner.every("prune_jobs", JOB_PRUNE_INTERVAL)
+
+@job_runner.register("delete_group")
+def purge_group(payload):
+    group_id = payload["group_id"]
+    conversation = group_conversation(group_id)
+    delete_in_batches('''
+        DELETE FROM group_messages WHERE id IN (
+            SELECT id FROM group_messages WHERE group_id = ? LIMIT ?
+        )
+    ''', (group_id,), connect=lambda: message_shards.connect_for(conversation))
+
+    conn = message_shards.connect_for(conversation)
+    get_cursor(conn).execute('DELETE FROM message_archive WHERE conversation = ?', (conversation,))
+    conn.commit()
+    conn.close()
+    recent_messages.drop(conversation)
+
+    conn = get_db_connection()
+    cursor = get_cursor(conn)
+    cursor.execute('DELETE FROM read_state WHERE conversation = ?', (conversation,))
+    cursor.execute('DELETE FROM group_members WHERE group_id = ?', (group_id,))
+    cursor.execute('DELETE FROM groups WHERE id = ? AND deleted_at IS NOT NULL', (group_id,))
+    conn.commit()
+    conn.close()
+    membership_index.drop(group_id)
+
+# ========== Message Archive ==========
+
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", 180))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", 3600))
+ARCHIVE_CHUNK_SIZE = int(os.getenv("ARCHIVE_CHUNK_SIZE", 500))
+ARCHIVE_SCAN_BATCH = int(os.getenv("ARCHIVE_SCAN_BATCH", 5000))
+
+# Each conversation keeps its newest message hot so chat-history still finds it
+ARCHIVE_SOURCES = {
+    "direct": (
+        "messages",
+        '''
+            SELECT * FROM messages m
+            WHERE m.timestamp < ? AND m.id < (
+                SELECT MAX(id) FROM messages m2
+                WHERE (m2.sender = m.sender AND m2.receiver = m.receiver)
+                   OR (m2.sender = m.receiver AND m2.receiver = m.sender)
+            )
+            ORDER BY m.id LIMIT ?
+        ''',
+        lambda row: get_room_id(row[1], row[2])
+    ),
+    "group": (
+        "group_messages",
+        '''
+            SELECT * FROM group_messages g
+            WHERE g.timestamp < ? AND g.id < (
+                SELECT MAX(id) FROM group_messages g2 WHERE g2.group_id = g.group_id
+            )
+            ORDER BY g.id LIMIT ?
+        ''',
+        lambda row: group_conversation(row[1])
+    )
+}
+
+def archive_batch(kind, cutoff, shard=None):
+    table, query, conversation_of = ARCHIVE_SOURCES[kind]
+    conn = message_shards.connect(shard)
+    try:
+        cursor = get_cursor(conn)
+        cursor.execute(query, (cutoff, ARCHIVE_SCAN_BATCH))
+        rows = cursor.fetchall()
+        if not rows:
+            return 0
+
+        by_conversation = {}
+        for row in rows:
+            by_conversation.setdefault(conversation_of(row), []).append(list(row))
+
+        chunks = []
+        for conversation, messages in by_conversation.items():
+            for start in range(0, len(messages), ARCHIVE_CHUNK_SIZE):
+                chunk = messages[start:start + ARCHIVE_CHUNK_SIZE]
+                chunks.append((
+                    conversation, chunk[0][0], chunk[-1][0], chunk[0][4], chunk[-1][4], len(chunk),
+                    zlib.compress(json.dumps(chunk, separators=(",", ":")).encode("utf-8"))
+                ))
+
+        # Archive and delete in one transaction so a message is always in exactly one place
+        cursor.executemany('''
+            INSERT INTO message_archive (conversation, first_id, last_id, first_timestamp, last_timestamp, message_count, payload)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', chunks)
+        cursor.executemany(f'DELETE FROM {table} WHERE id = ?', [(row[0],) for row in rows])
+        conn.commit()
+        return len(rows)
+    finally:
+        conn.close()
+
+@job_runner.register("archive_messages")
+def archive_messages(payload):
+    cutoff = (datetime.now() - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat()
+    for shard in message_shards.targets():
+        for kind in ARCHIVE_SOURCES:
+            while archive_batch(kind, cutoff, shard):
+                gevent.sleep(JOB_BATCH_PAUSE)
+
+if ARCHIVE_AFTER_DAYS > 0:
+    job_runner.every("archive_messages", ARCHIVE_INTERVAL)
+
+def decode_archive_chunk(payload):
+    return [tuple(row) for row in json.loads(zlib.decompress(payload))]
+
+def read_archive(cursor, conversation, before_id, limit):
+    # Walks chunks newest-first, decompressing only as many as the page needs
+    rows = []
+    upper = before_id
+    while len(rows) < limit:
+        cursor.execute('''
+            SELECT first_id, payload FROM message_archive
+            WHERE conversation = ? AND first_id < ?
+            ORDER BY last_id DESC LIMIT 1
+        ''', (conversation, upper))
+        chunk = cursor.fetchone()
+        if not chunk:
+            break
+        for row in reversed(decode_archive_chunk(chunk[1])):
+            if row[0] < upper and len(rows) < limit:
+                rows.append(row)
+        upper = chunk[0]
+    return rows
+
+def read_whole_archive(cursor, conversation):
+    cursor.execute('SELECT payload FROM message_archive WHERE conversation = ? ORDER BY last_id ASC', (conversation,))
+    rows = []
+    for chunk in cursor.fetchall():
+        rows.extend(decode_archive_chunk(chunk[0]))
+    return rows
+
+def load_history_page(cursor, conversation, hot_query, params, before, limit):
+    # Newest page first from the hot table, falling through to the archive past the hot window
+    before = before or 2 ** 62
+    cursor.execute(hot_query, params + (before, limit))
+    rows = list(cursor.fetchall())
+    if len(rows) < limit:
+        oldest = rows[-1][0] if rows else before
+        rows.extend(read_archive(cursor, conversation, oldest, limit - len(rows)))
+    rows.reverse()
+    return rows
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    try:
+        conn = get_db_connection()
+        cursor = get_cursor(conn)
+        cursor.execute('''
+            SELECT id, kind, payload, status, attempts, max_attempts, last_error, created_at, updated_at
+            FROM jobs WHERE id = ?
+        ''', (job_id,))
+        job = cursor.fetchone()
+        conn.close()
+
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+
+        return jsonify({
+            "id": job[0],
+            "kind": job[1],
+            "payload": json.loads(job[2]),
+            "status": job[3],
+            "attempts": job[4],
+            "max_attempts": job[5],
+            "last_error": job[6],
+            "created_at": job[7],
+            "updated_at": job[8]
+        }), 200
+    except Exception as e:
+        return jsonify({"error": "Failed to fetch job", "details": str(e)}), 500
+
 # ========== Test DB Route ==========
 
 @app.route("/test-db")
 def test_db():
-    conn = get_db_connection()
-    cursor = get_cursor(conn)
-    cursor.execute('''
-        INSERT INTO messages (sender, receiver, message, timestamp)
-        VALUES (?, ?, ?, ?)
-    ''', ("test_user", "test_receiver", "Hello from Flask (SQLite/Postgres)", datetime.now().isoformat()))
+    shard = message_shards.shard_for(get_room_id("test_user", "test_receiver"))
+    conn = message_shards.connect(shard)
+    insert_chat_message(conn, "messages", {
+        "sender": "test_user",
+        "receiver": "test_receiver",
+        "message": "Hello from Flask (SQLite/Postgres)",
+        "timestamp": datetime.now().isoformat(),
+        "client_id": None
+    }, shard)
     conn.commit()
     conn.close()
     return "Inserted test message into DB!"
@@ -876,6 +3694,7 @@ def test_db():
 # ========== User Profile ==========
 
 @app.route('/api/user-profile', methods=['GET'])
+@stale_on_outage
 def get_user_profile():
     try:
         username = request.args.get('username')
@@ -980,9 +3799,10 @@ def update_bio():
 # ========== Posts ==========
 
 @app.route('/api/posts', methods=['GET'])
+@stale_on_outage
 def get_posts():
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(read_only=True)
         cursor = get_cursor(conn)
         cursor.execute('SELECT * FROM posts ORDER BY timestamp DESC')
         posts = cursor.fetchall()
@@ -1008,6 +3828,7 @@ def get_posts():
         return jsonify({"error": "Failed to fetch posts", "details": str(e)}), 500
 
 @app.route('/api/posts/create', methods=['POST'])
+@rate_limited_route("create_post")
 def create_post():
     try:
         data = request.json
@@ -1035,10 +3856,15 @@ def create_post():
                 VALUES (?, ?, ?, ?)
             ''', (username, caption, image_url, timestamp))
             post_id = cursor.lastrowid
-            
+
+        # The author sees the post right away; everyone else gets it from the fan-out job
+        add_to_timelines(get_cursor(conn), [(username, post_id, username)])
+        job_runner.enqueue(conn, "fanout_post", {"post_id": post_id, "author": username})
+
         conn.commit()
         conn.close()
-        
+        job_runner.wake()
+
         return jsonify({
             "message": "Post created successfully",
             "post": {
@@ -1054,6 +3880,7 @@ def create_post():
         return jsonify({"error": "Failed to create post", "details": str(e)}), 500
 
 @app.route('/api/posts/<int:post_id>/like', methods=['POST'])
+@rate_limited_route("like_post")
 def like_post(post_id):
     try:
         data = request.json
@@ -1081,8 +3908,14 @@ def like_post(post_id):
             else:
                 cursor.execute('INSERT INTO post_likes (post_id, username, timestamp) VALUES (?, ?, ?)', (post_id, username, timestamp))
             action = "liked"
+
+            cursor.execute('SELECT username FROM posts WHERE id = ?', (post_id,))
+            owner = cursor.fetchone()
             
         conn.commit()
+
+        if action == "liked" and owner:
+            notification_buffer.add(owner[0], "like", post_id, username)
         
         # Get updated likes list
         cursor.execute('SELECT username FROM post_likes WHERE post_id = ?', (post_id,))
@@ -1097,6 +3930,322 @@ def like_post(post_id):
     except Exception as e:
         return jsonify({"error": "Failed to like/unlike post", "details": str(e)}), 500
 
+# ========== Home Timelines ==========
+
+TIMELINE_MAX_POSTS = int(os.getenv("TIMELINE_MAX_POSTS", 800))
+TIMELINE_FANOUT_LIMIT = int(os.getenv("TIMELINE_FANOUT_LIMIT", 5000))
+TIMELINE_FANOUT_BATCH = int(os.getenv("TIMELINE_FANOUT_BATCH", 1000))
+TIMELINE_PAGE_SIZE = 20
+TIMELINE_FANOUT_REFRESH = float(os.getenv("TIMELINE_FANOUT_REFRESH", 3600))
+TIMELINE_EMPTY_TTL = float(os.getenv("TIMELINE_EMPTY_TTL", 60))
+TIMELINE_EMPTY_MAX = int(os.getenv("TIMELINE_EMPTY_MAX", 50000))
+
+# A user's audience is everyone who shares a live group with them (including themselves)
+AUDIENCE_QUERY = '''
+    SELECT DISTINCT peer.username FROM group_members me
+    JOIN groups g ON g.id = me.group_id AND g.deleted_at IS NULL
+    JOIN group_members peer ON peer.group_id = me.group_id
+    WHERE me.username = ?
+'''
+
+def add_to_timelines(cursor, entries):
+    # entries: (username, post_id, author); each touched timeline is trimmed to its newest ids
+    cursor.executemany('''
+        INSERT INTO timelines (username, post_id, author) VALUES (?, ?, ?)
+        ON CONFLICT (username, post_id) DO NOTHING
+    ''', entries)
+    usernames = sorted({entry[0] for entry in entries})
+    cursor.executemany('''
+        DELETE FROM timelines WHERE username = ? AND post_id <= (
+            SELECT post_id FROM timelines WHERE username = ?
+            ORDER BY post_id DESC LIMIT 1 OFFSET ?
+        )
+    ''', [(username, username, TIMELINE_MAX_POSTS) for username in usernames])
+
+@job_runner.register("fanout_post")
+def fanout_post(payload):
+    post_id, author = payload["post_id"], payload["author"]
+
+    conn = get_db_connection()
+    cursor = get_cursor(conn)
+    cursor.execute(AUDIENCE_QUERY, (author,))
+    audience = [row[0] for row in cursor.fetchall() if row[0] != author]
+
+    if len(audience) > TIMELINE_FANOUT_LIMIT:
+        # Too many timelines to write; readers pull this author's posts instead
+        cursor.execute('''
+            INSERT INTO high_fanout_authors (username, audience_size, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (username) DO UPDATE SET audience_size = excluded.audience_size, updated_at = excluded.updated_at
+        ''', (author, len(audience), datetime.now().isoformat()))
+        conn.commit()
+        conn.close()
+        inc_metric("timeline_fanout_skipped_total")
+        return
+
+    post_ids = [post_id]
+    cursor.execute("DELETE FROM high_fanout_authors WHERE username = ?", (author,))
+    if cursor.rowcount:
+        # Back under the limit: readers stop pulling this author, so push their recent posts
+        cursor.execute('''
+            SELECT id FROM posts WHERE username = ?
+            ORDER BY id DESC LIMIT ?
+        ''', (author, TIMELINE_PAGE_SIZE))
+        post_ids = sorted({post_id} | {row[0] for row in cursor.fetchall()})
+    conn.commit()
+    conn.close()
+
+    for start in range(0, len(audience), TIMELINE_FANOUT_BATCH):
+        batch = audience[start:start + TIMELINE_FANOUT_BATCH]
+        conn = get_db_connection()
+        cursor = get_cursor(conn)
+        add_to_timelines(cursor, [(username, pid, author) for username in batch for pid in post_ids])
+        conn.commit()
+        conn.close()
+        inc_metric("timeline_fanout_writes_total", len(batch) * len(post_ids))
+        if start + TIMELINE_FANOUT_BATCH < len(audience):
+            gevent.sleep(JOB_BATCH_PAUSE)
+
+@job_runner.register("refresh_high_fanout_authors")
+def refresh_high_fanout_authors(payload):
+    # Audiences shrink as members leave; authors back under the limit go through
+    # fanout_post again, which drops their row and backfills their recent posts
+    conn = get_db_connection()
+    cursor = get_cursor(conn)
+    cursor.execute("SELECT username FROM high_fanout_authors")
+    for (author,) in cursor.fetchall():
+        cursor.execute(f"SELECT COUNT(*) FROM ({AUDIENCE_QUERY}) audience", (author,))
+        audience_size = cursor.fetchone()[0] - 1
+        if audience_size > TIMELINE_FANOUT_LIMIT:
+            cursor.execute('''
+                UPDATE high_fanout_authors SET audience_size = ?, updated_at = ? WHERE username = ?
+            ''', (audience_size, datetime.now().isoformat(), author))
+            continue
+        cursor.execute("SELECT MAX(id) FROM posts WHERE username = ?", (author,))
+        latest = cursor.fetchone()[0]
+        if latest is None:
+            cursor.execute("DELETE FROM high_fanout_authors WHERE username = ?", (author,))
+        else:
+            job_runner.enqueue(conn, "fanout_post", {"post_id": latest, "author": author})
+    conn.commit()
+    conn.close()
+
+job_runner.every("refresh_high_fanout_authors", TIMELINE_FANOUT_REFRESH)
+
+# Users whose warm-up found nothing, so reads don't rescan their audience's posts each time
+empty_timelines = OrderedDict()  # username -> checked_at, oldest first
+
+def timeline_known_empty(username):
+    now = time.time()
+    while empty_timelines:
+        name, checked_at = next(iter(empty_timelines.items()))
+        if now - checked_at < TIMELINE_EMPTY_TTL and len(empty_timelines) <= TIMELINE_EMPTY_MAX:
+            break
+        del empty_timelines[name]
+    return username in empty_timelines
+
+def has_audience(cursor, username):
+    cursor.execute('''
+        SELECT 1 FROM group_members me
+        JOIN group_members peer ON peer.group_id = me.group_id AND peer.username <> me.username
+        WHERE me.username = ? LIMIT 1
+    ''', (username,))
+    return cursor.fetchone() is not None
+
+def warm_timeline(username, cursor):
+    # First read of an empty timeline (new user, or posts older than the fan-out job):
+    # build it once from the audience's posts and store it
+    if timeline_known_empty(username):
+        return []
+    cursor.execute(f'''
+        SELECT id, username FROM posts
+        WHERE username IN ({AUDIENCE_QUERY})
+        ORDER BY id DESC LIMIT ?
+    ''', (username, TIMELINE_MAX_POSTS))
+    entries = [(username, row[0], row[1]) for row in cursor.fetchall()]
+    if entries:
+        conn = get_db_connection()
+        add_to_timelines(get_cursor(conn), entries)
+        conn.commit()
+        conn.close()
+    else:
+        empty_timelines[username] = time.time()
+    return [entry[1] for entry in entries]
+
+def load_timeline_ids(cursor, username, before, limit):
+    before = before or 2 ** 62
+    cursor.execute('''
+        SELECT post_id FROM timelines
+        WHERE username = ? AND post_id < ?
+        ORDER BY post_id DESC LIMIT ?
+    ''', (username, before, limit))
+    ids = [row[0] for row in cursor.fetchall()]
+
+    if not ids and before == 2 ** 62:
+        ids = warm_timeline(username, cursor)[:limit]
+
+    # Fan-out-on-read for high-fanout authors in this user's audience
+    cursor.execute(f'''
+        SELECT p.id FROM posts p
+        JOIN high_fanout_authors h ON h.username = p.username
+        WHERE p.username IN ({AUDIENCE_QUERY}) AND p.id < ?
+        ORDER BY p.id DESC LIMIT ?
+    ''', (username, before, limit))
+    pulled = [row[0] for row in cursor.fetchall()]
+
+    return sorted(set(ids) | set(pulled), reverse=True)[:limit]
+
+def hydrate_posts(cursor, post_ids, viewer):
+    # Bodies and like counts for a page of ids in one query, returned in the given order
+    if not post_ids:
+        return []
+    placeholders = ", ".join(["?"] * len(post_ids))
+    cursor.execute(f'''
+        SELECT p.id, p.username, p.caption, p.image_url, p.timestamp,
+               COUNT(l.id), COALESCE(SUM(CASE WHEN l.username = ? THEN 1 ELSE 0 END), 0)
+        FROM posts p
+        LEFT JOIN post_likes l ON l.post_id = p.id
+        WHERE p.id IN ({placeholders})
+        GROUP BY p.id, p.username, p.caption, p.image_url, p.timestamp
+    ''', (viewer, *post_ids))
+    rows = {row[0]: row for row in cursor.fetchall()}
+
+    return [{
+        "id": row[0],
+        "username": row[1],
+        "caption": row[2],
+        "image_url": row[3],
+        "timestamp": row[4],
+        "likes_count": row[5],
+        "liked": bool(row[6])
+    } for row in (rows.get(post_id) for post_id in post_ids) if row]
+
+@app.route('/api/timeline', methods=['GET'])
+@stale_on_outage
+def get_timeline():
+    try:
+        username = request.args.get('username')
+        before = request.args.get('before', type=int)
+        limit = min(request.args.get('limit', TIMELINE_PAGE_SIZE, type=int), 100)
+
+        if not username:
+            return jsonify({"error": "Username parameter is required"}), 400
+
+        conn = get_db_connection(read_only=True)
+        cursor = get_cursor(conn)
+
+        if has_audience(cursor, username):
+            source = "timeline"
+            post_ids = load_timeline_ids(cursor, username, before, limit)
+        else:
+            # Nobody to follow yet, so show what's new across campus
+            source = "global"
+            cursor.execute('''
+                SELECT id FROM posts WHERE id < ?
+                ORDER BY id DESC LIMIT ?
+            ''', (before or 2 ** 62, limit))
+            post_ids = [row[0] for row in cursor.fetchall()]
+
+        posts = hydrate_posts(cursor, post_ids, username)
+        conn.close()
+
+        return jsonify({
+            "posts": posts,
+            "source": source,
+            "next_before": post_ids[-1] if len(post_ids) == limit else None
+        }), 200
+    except Exception as e:
+        return jsonify({"error": "Failed to fetch timeline", "details": str(e)}), 500
+
+# ========== Batch Requests ==========
+
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", 10))
+BATCH_TIMEOUT = float(os.getenv("BATCH_TIMEOUT", 30))
+# Sub-requests to one rate-limited endpoint per batch; each still draws from the caller's bucket
+BATCH_MAX_PER_LIMIT = int(os.getenv("BATCH_MAX_PER_LIMIT", 2))
+
+def sub_request_limit(sub):
+    # The rate limit name of the route a sub-request would hit, if it has one
+    path = (sub.get("path") or "").split("?")[0]
+    try:
+        endpoint, _ = app.url_map.bind("localhost").match(path, method=(sub.get("method") or "GET").upper())
+    except HTTPException:
+        return None
+    return getattr(app.view_functions[endpoint], "rate_limit", None)
+
+def run_sub_request(sub, shared_conn):
+    method = (sub.get("method") or "GET").upper()
+    path = sub.get("path") or ""
+
+    if not path.startswith("/api/") or path.startswith("/api/batch"):
+        return {"status": 400, "body": {"error": "Sub-request path must be an /api/ route other than /api/batch"}}
+
+    # Reads share the batch's connection; writes keep their own transaction
+    if shared_conn is not None and method == "GET":
+        shared_db_connection.set(shared_conn)
+
+    headers = dict(sub.get("_headers") or {})
+    # The caller's address, so per-IP rate limits apply inside the batch too
+    environ = {"REMOTE_ADDR": sub["_remote_addr"]} if sub.get("_remote_addr") else {}
+
+    try:
+        with app.test_request_context(path, method=method, json=sub.get("body"), headers=headers, environ_base=environ):
+            response = app.make_response(app.full_dispatch_request())
+        body = response.get_json(silent=True)
+        return {
+            "status": response.status_code,
+            "body": body if body is not None else response.get_data(as_text=True)
+        }
+    except Exception as e:
+        return {"status": 500, "body": {"error": "Sub-request failed", "details": str(e)}}
+
+@app.route('/api/batch', methods=['POST'])
+def batch():
+    data = request.json or {}
+    sub_requests = data.get("requests")
+
+    if not isinstance(sub_requests, list) or not sub_requests:
+        return jsonify({"error": "A non-empty requests list is required"}), 400
+    if len(sub_requests) > BATCH_MAX_REQUESTS:
+        return jsonify({"error": f"At most {BATCH_MAX_REQUESTS} sub-requests are allowed per batch"}), 400
+
+    # Pass the caller's credentials through to every sub-request
+    forwarded = {}
+    if request.headers.get("Authorization"):
+        forwarded["Authorization"] = request.headers["Authorization"]
+    subs = [dict(sub, _headers=forwarded, _remote_addr=request.remote_addr) if isinstance(sub, dict) else {} for sub in sub_requests]
+
+    limited = defaultdict(int)
+    for sub in subs:
+        name = sub_request_limit(sub)
+        if name:
+            limited[name] += 1
+    over = sorted(name for name, count in limited.items() if count > BATCH_MAX_PER_LIMIT)
+    if over:
+        return jsonify({"error": f"At most {BATCH_MAX_PER_LIMIT} sub-requests per rate-limited endpoint ({', '.join(over)})"}), 400
+
+    # SQLite calls never yield to the hub, so greenlets can safely share one
+    # connection; a psycopg2 connection can only run one query at a time
+    shared_conn = None
+    if not DATABASE_URL and any((sub.get("method") or "GET").upper() == "GET" for sub in subs):
+        shared_conn = SharedConnection(get_db_connection())
+
+    try:
+        jobs = [gevent.spawn(run_sub_request, sub, shared_conn) for sub in subs]
+        gevent.joinall(jobs, timeout=BATCH_TIMEOUT)
+    finally:
+        if shared_conn is not None:
+            shared_conn.conn.close()
+
+    results = []
+    for job in jobs:
+        if job.ready():
+            results.append(job.value)
+        else:
+            job.kill(block=False)
+            results.append({"status": 504, "body": {"error": "Sub-request timed out"}})
+
+    return jsonify({"responses": results}), 200
+
 # ========== Run ==========
 
 if __name__ == '__main__':
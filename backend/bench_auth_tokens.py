@@ -0,0 +1,70 @@
+"""Benchmark what authenticating a request costs with signed session tokens.
+
+Compares token verification against the alternatives it replaces (a bcrypt
+password check or a users-table lookup per request), then measures the
+end-to-end overhead the before_request hook adds to a real route.
+
+    python bench_auth_tokens.py --iterations 20000
+"""
+import argparse
+import time
+import timeit
+
+import bcrypt
+
+import app
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure per-request auth overhead.")
+    parser.add_argument("--iterations", type=int, default=20000, help="token verifications / requests to time")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12, help="bcrypt cost, as used by signup")
+    return parser.parse_args()
+
+
+def per_call_us(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    args = parse_args()
+    token, _ = app.token_signer.issue("bench_user")
+    password_hash = bcrypt.hashpw(b"password123", bcrypt.gensalt(args.bcrypt_rounds))
+
+    conn = app.get_db_connection()
+    cursor = app.get_cursor(conn)
+
+    rows = [
+        ("issue token", per_call_us(lambda: app.token_signer.issue("bench_user"), args.iterations)),
+        ("verify token", per_call_us(lambda: app.token_signer.verify(token), args.iterations)),
+        ("users lookup", per_call_us(lambda: (cursor.execute("SELECT * FROM users WHERE username = ?", ("bench_user",)), cursor.fetchone()), args.iterations // 10)),
+        ("bcrypt check", per_call_us(lambda: bcrypt.checkpw(b"password123", password_hash), 3)),
+    ]
+    conn.close()
+
+    print(f"{'operation':<16}{'us/call':>14}")
+    for name, us in rows:
+        print(f"{name:<16}{us:>14.2f}")
+
+    # End to end through Flask: the same request with and without a bearer token
+    client = app.app.test_client()
+    headers = {"Authorization": f"Bearer {token}"}
+    path = "/api/presence?usernames=bench_user"
+    requests = max(args.iterations // 10, 100)
+
+    def timed(extra):
+        started = time.perf_counter()
+        for _ in range(requests):
+            client.get(path, headers=extra)
+        return (time.perf_counter() - started) / requests * 1e6
+
+    timed({})  # warm up
+    plain = min(timed({}) for _ in range(3))
+    signed = min(timed(headers) for _ in range(3))
+    print(f"\n{requests} requests to {path}")
+    print(f"  without token {plain:>10.1f} us/request")
+    print(f"  with token    {signed:>10.1f} us/request  (+{signed - plain:.1f} us)")
+
+
+if __name__ == "__main__":
+    main()
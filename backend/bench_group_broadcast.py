@@ -0,0 +1,97 @@
+"""Benchmark CPU per delivered group message for each Socket.IO encoding variant.
+
+Fills one group room with fake participants and drives broadcast_group_message()
+from app.py. The transport is replaced with a stub that still encodes every
+Engine.IO packet, so the numbers cover everything the server does per frame
+except the socket write itself.
+
+    python bench_group_broadcast.py --sockets 500 --messages 200
+"""
+import argparse
+import time
+
+import app
+
+VARIANTS = list(app.GROUP_VARIANTS)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure group broadcast cost per delivered message.")
+    parser.add_argument("--sockets", type=int, default=500, help="participants in the group room")
+    parser.add_argument("--messages", type=int, default=200, help="messages sent per variant")
+    parser.add_argument("--batch", type=int, default=20, help="messages per coalesced frame")
+    return parser.parse_args()
+
+
+class StubTransport:
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+
+    def send(self, eio_sid, pkt):
+        encoded = pkt.encode()
+        self.frames += 1
+        self.bytes += len(encoded)
+
+
+def run_variant(variant, args, group_id):
+    server = app.socketio.server
+    manager = server.manager
+    transport = StubTransport()
+    server._send_eio_packet = transport.send
+
+    sids = []
+    for i in range(args.sockets):
+        sid = manager.connect(f"bench-{variant}-{i}", "/")
+        manager.enter_room(sid, "/", f"group_{group_id}")
+        manager.enter_room(sid, "/", app.group_variant_room(group_id, variant))
+        app.membership_index.join_socket(group_id, sid, variant)
+        sids.append(sid)
+
+    messages = [{
+        "id": i,
+        "group_id": group_id,
+        "sender": f"student_{i % 37}",
+        "message": "anyone has the notes for tomorrow's quiz? slot B2, module 4",
+        "timestamp": "2025-11-20T21:14:05.123456",
+        "client_id": None
+    } for i in range(args.messages)]
+
+    started = time.process_time()
+    for i, message in enumerate(messages):
+        app.broadcast_group_message(group_id, message)
+        # Flush coalesced frames by hand instead of waiting for the timer
+        if (i + 1) % args.batch == 0:
+            app.group_coalescer.flush(group_id)
+    app.group_coalescer.flush(group_id)
+    elapsed = time.process_time() - started
+
+    for sid in sids:
+        app.membership_index.leave_socket(sid)
+        manager.disconnect(sid, "/")
+
+    delivered = args.sockets * args.messages
+    return {
+        "variant": variant,
+        "cpu_us_per_delivery": elapsed / delivered * 1e6,
+        "frames": transport.frames,
+        "bytes_per_delivery": transport.bytes / delivered
+    }
+
+
+def main():
+    args = parse_args()
+    if app.msgpack is None:
+        print("⚠️ msgpack is not installed; msgpack variants fall back to JSON and are skipped")
+
+    print(f"{args.sockets} sockets, {args.messages} messages, batches of {args.batch}")
+    print(f"{'variant':<15}{'cpu us/delivery':>18}{'frames':>12}{'bytes/delivery':>17}")
+    for group_id, variant in enumerate(VARIANTS, start=1):
+        if variant.startswith("msgpack") and app.msgpack is None:
+            continue
+        result = run_variant(variant, args, group_id)
+        print(f"{result['variant']:<15}{result['cpu_us_per_delivery']:>18.2f}{result['frames']:>12,}{result['bytes_per_delivery']:>17.1f}")
+
+
+if __name__ == "__main__":
+    main()
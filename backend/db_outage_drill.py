@@ -0,0 +1,109 @@
+"""Fault-injection drill for the database circuit breaker.
+
+Runs app.py against a throwaway SQLite file, warms a few read endpoints,
+takes the database "down" with the same fault switch /admin/db-fault uses,
+and checks that:
+
+- requests fail fast once the breaker opens
+- read endpoints serve their last good response (X-Stale: 1)
+- chat sends are spooled and delivered live
+- the spool replays into the database once the fault is cleared
+
+    python db_outage_drill.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+workdir = tempfile.mkdtemp(prefix="connectvit-drill-")
+os.environ.pop("DATABASE_URL", None)
+os.environ.pop("DATABASE_READ_URL", None)
+# app creates its tables on import, so point it at the throwaway file first
+os.environ["SQLITE_PATH"] = os.path.join(workdir, "drill.db")
+os.environ.setdefault("CHAT_SPOOL_DIR", os.path.join(workdir, "spool"))
+os.environ.setdefault("CHAT_SPOOL_REPLAY_INTERVAL", "0.5")
+os.environ.setdefault("DB_BREAKER_RESET", "1")
+os.environ.setdefault("RATE_LIMITS", "signup=1000:1000")
+
+import gevent  # noqa: E402
+
+import app  # noqa: E402
+
+failures = 0
+
+
+def check(label, ok, detail=""):
+    global failures
+    print(f"{'✅' if ok else '❌'} {label}{f' ({detail})' if detail else ''}")
+    if not ok:
+        failures += 1
+
+
+def main():
+    client = app.app.test_client()
+
+    tokens = {}
+    for username in ("drill_a", "drill_b"):
+        tokens[username] = client.post("/api/signup", json={
+            "fullName": username, "username": username,
+            "email": f"{username}@vitstudent.ac.in", "password": "drill-password"
+        }).json["token"]
+    group_id = client.post("/api/groups/create", json={"name": "Drill", "username": "drill_a"}).json["group_id"]
+    client.post(f"/api/groups/{group_id}/members", json={"username": "drill_b", "added_by": "drill_a"})
+
+    warm = ["/api/groups?username=drill_a", "/api/chat-history?username=drill_a", "/api/user-profile?username=drill_a"]
+    for path in warm:
+        client.get(path)
+
+    socket = app.socketio.test_client(app.app, flask_test_client=client, auth={"username": "drill_a"})
+    socket.emit("join_group", {"group_id": group_id, "username": "drill_a"}, callback=True)
+
+    # ---------- Outage ----------
+    app.db_fault["mode"] = "down"
+
+    for path in warm:
+        response = client.get(path)
+        check(f"stale read {path}", response.status_code == 200 and response.headers.get("X-Stale") == "1",
+              f"status {response.status_code}")
+
+    check("breaker open", app.db_breaker.state == "open", app.db_breaker.state)
+
+    started = time.time()
+    for _ in range(20):
+        client.get("/api/groups?username=drill_a")
+    elapsed = time.time() - started
+    check("fails fast while open", elapsed < 1, f"20 reads in {elapsed:.3f}s")
+
+    check("uncached read is 503", client.get("/api/users").status_code == 503)
+
+    ack = socket.emit("send_message", {"sender": "drill_a", "receiver": "drill_b", "message": "during outage"}, callback=True)
+    check("direct send spooled", bool(ack and ack.get("spooled")), str(ack))
+    ack = socket.emit("send_group_message", {"group_id": group_id, "sender": "drill_a", "message": "group outage"}, callback=True)
+    check("group send spooled", bool(ack and ack.get("spooled")), str(ack))
+    received = [packet["name"] for packet in socket.get_received()]
+    check("spooled sends delivered live", "receive_message" in received and "receive_group_message" in received)
+
+    health = client.get("/api/health").json
+    check("health reports degraded", health["status"] == "degraded" and health["spool"]["pending"] == 2, str(health["spool"]))
+
+    # ---------- Recovery ----------
+    app.db_fault["mode"] = "off"
+    deadline = time.time() + 10
+    while time.time() < deadline and (app.chat_spool.pending() or app.db_breaker.state != "closed"):
+        client.get("/api/users")
+        gevent.sleep(0.2)
+
+    check("breaker closed", app.db_breaker.state == "closed", app.db_breaker.state)
+    check("spool drained", app.chat_spool.pending() == 0)
+    direct = client.get("/api/messages?sender=drill_a&receiver=drill_b").json
+    check("direct message replayed", any(m["message"] == "during outage" for m in direct))
+    group = client.get(f"/api/groups/{group_id}/messages", headers={"Authorization": f"Bearer {tokens['drill_a']}"}).json
+    check("group message replayed", any(m["message"] == "group outage" for m in group))
+
+    print(f"{'✅ Drill passed' if not failures else f'❌ {failures} check(s) failed'} (workdir {workdir})")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,411 @@
+"""Stream a live SQLite deployment into Postgres with a short cutover.
+
+Copies every table from ``create_tables()`` plus ``user_bio`` from connect.db
+into the Postgres database at ``--postgres``, in id-ordered chunks loaded with
+``COPY``. Memory stays at one chunk whatever the table size.
+
+    # 1. initial copy while the app keeps running on SQLite
+    python migrate_to_postgres.py snapshot --postgres postgresql://...
+    # 2. copy what arrived since (repeat until it is quick)
+    python migrate_to_postgres.py catchup --postgres postgresql://... --reconcile
+    # 3. stop writes, final catch-up, verify, point DATABASE_URL at Postgres
+    python migrate_to_postgres.py catchup --postgres postgresql://...
+    python migrate_to_postgres.py verify --postgres postgresql://...
+
+Tables with an ``id`` column are caught up by id watermark; ``--reconcile``
+also compares checksums range by range and repairs rows that were updated or
+deleted after they were copied. Tables keyed by name (user_bio, read_state,
+timelines, high_fanout_authors) have no id, so each keeps a change cursor
+(``updated_at``, or SQLite's rowid for insert-only timelines) and catch-up
+upserts only rows past it. Deletions there are picked up by ``--reconcile``,
+which re-copies such a table only when its checksum differs.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+import time
+import uuid
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Parents before children so foreign keys hold while loading
+TABLES = [
+    "users", "user_bio", "groups", "group_members", "messages", "group_messages",
+    "posts", "post_likes", "read_state", "notifications", "jobs", "message_archive",
+    "timelines", "high_fanout_authors",
+]
+
+# Tables without ids: (primary key, change cursor column)
+KEYED_TABLES = {
+    "user_bio": (("username",), "updated_at"),
+    "read_state": (("username", "conversation"), "updated_at"),
+    "timelines": (("username", "post_id"), "rowid"),
+    "high_fanout_authors": (("username",), "updated_at"),
+}
+
+USER_BIO_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS user_bio (
+        username TEXT PRIMARY KEY,
+        bio TEXT,
+        updated_at TEXT
+    )
+'''
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Migrate ConnectVit from SQLite to Postgres without a long outage.")
+    parser.add_argument("mode", choices=["snapshot", "catchup", "verify"])
+    parser.add_argument("--postgres", default=os.getenv("DATABASE_URL"), help="target database URL (default: DATABASE_URL)")
+    parser.add_argument("--sqlite", default=os.path.join(BASE_DIR, "connect.db"), help="source SQLite file")
+    parser.add_argument("--state", help="watermark file (default: next to the SQLite file)")
+    parser.add_argument("--chunk-size", type=int, default=20000, help="rows per COPY / checksum range")
+    parser.add_argument("--tables", help="comma-separated subset of tables")
+    parser.add_argument("--truncate", action="store_true", help="snapshot: empty the target tables first")
+    parser.add_argument("--reconcile", action="store_true", help="catchup: also repair updated or deleted rows")
+    parser.add_argument("--target-sslmode", default=os.getenv("PGSSLMODE"),
+                        help="sslmode for the Postgres connection (default: PGSSLMODE, else require)")
+    return parser.parse_args()
+
+
+# ---------- Values ----------
+
+def canonical(value, pg_type):
+    # One text form per value on both sides, so checksums agree across drivers
+    if value is None:
+        return "\\N"
+    if isinstance(value, (bytes, memoryview)):
+        return "\\x" + bytes(value).hex()
+    if pg_type == "real":
+        # Postgres REAL is float4; round the SQLite double the same way
+        return repr(struct.unpack("f", struct.pack("f", float(value)))[0])
+    if pg_type == "double precision":
+        return repr(float(value))
+    if pg_type in ("integer", "bigint", "smallint"):
+        return str(int(value))
+    return str(value)
+
+
+def copy_value(value):
+    if isinstance(value, (bytes, memoryview)):
+        return "\\x" + bytes(value).hex()
+    return value
+
+
+def digest(rows, types):
+    # Order-independent (count, sum of row hashes), so collation differences don't matter
+    count, total = 0, 0
+    for row in rows:
+        line = "\x1f".join(canonical(value, pg_type) for value, pg_type in zip(row, types))
+        total = (total + int.from_bytes(hashlib.blake2b(line.encode("utf-8"), digest_size=16).digest(), "big")) % (1 << 128)
+        count += 1
+    return count, total
+
+
+# ---------- Migrator ----------
+
+class Migrator:
+    def __init__(self, args, app):
+        self.args = args
+        self.chunk = args.chunk_size
+        self.src = sqlite3.connect(f"file:{args.sqlite}?mode=ro", uri=True)
+        self.dst = app.get_db_connection()
+        self.state_path = args.state or os.path.splitext(args.sqlite)[0] + ".migrate-state.json"
+        self.state = self.load_state()
+
+        cursor = self.dst.cursor()
+        cursor.execute(USER_BIO_SCHEMA)
+        self.dst.commit()
+
+        wanted = args.tables.split(",") if args.tables else TABLES
+        self.tables = []
+        for table in [t for t in TABLES if t in wanted]:
+            columns, types = self.common_columns(table)
+            if columns:
+                self.tables.append((table, columns, types))
+            else:
+                print(f"⚠️ Skipping {table}: not in the SQLite database")
+
+    def load_state(self):
+        # watermarks: last id copied per table; replaced: tables without ids copied whole;
+        # cursors: change cursor per table without ids, taken just before its last copy
+        state = {"watermarks": {}, "replaced": [], "cursors": {}}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                state.update(json.load(f))
+        return state
+
+    def save_state(self):
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp, self.state_path)
+
+    def common_columns(self, table):
+        source = [row[1] for row in self.src.execute(f"PRAGMA table_info({table})")]
+        cursor = self.dst.cursor()
+        cursor.execute('''
+            SELECT column_name, data_type FROM information_schema.columns
+            WHERE table_name = %s AND table_schema = current_schema()
+            ORDER BY ordinal_position
+        ''', (table,))
+        target = cursor.fetchall()
+        pairs = [(name, pg_type) for name, pg_type in target if name in source]
+        return [name for name, _ in pairs], [pg_type for _, pg_type in pairs]
+
+    # ----- reading -----
+
+    def source_rows(self, table, columns, where="", params=()):
+        return self.src.execute(f"SELECT {', '.join(columns)} FROM {table} {where}", params)
+
+    def target_rows(self, table, columns, where="", params=()):
+        # Server-side cursor so large tables stream instead of loading at once
+        cursor = self.dst.cursor(name=f"migrate_{uuid.uuid4().hex[:8]}")
+        cursor.itersize = self.chunk
+        cursor.execute(f"SELECT {', '.join(columns)} FROM {table} {where}", params)
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
+
+    # ----- writing -----
+
+    def copy_rows(self, table, columns, rows):
+        from seed_data import RowStream
+        stream = RowStream(tuple(copy_value(v) for v in row) for row in rows)
+        self.dst.cursor().copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", stream)
+        return stream.count
+
+    def copy_id_range(self, table, columns, after, upto=None):
+        # Copies (after, upto] in chunks, committing each; returns (rows, last id)
+        id_index = columns.index("id")
+        copied, last = 0, after
+        while True:
+            where = "WHERE id > ?" + (" AND id <= ?" if upto is not None else "") + " ORDER BY id LIMIT ?"
+            params = (last, upto, self.chunk) if upto is not None else (last, self.chunk)
+            rows = self.source_rows(table, columns, where, params).fetchall()
+            if not rows:
+                return copied, last
+            copied += self.copy_rows(table, columns, rows)
+            last = rows[-1][id_index]
+            self.dst.commit()
+            if upto is None:
+                self.state["watermarks"][table] = last
+                self.save_state()
+
+    def replace_table(self, table, columns):
+        since = self.change_cursor(table)
+        cursor = self.dst.cursor()
+        cursor.execute(f"DELETE FROM {table}")
+        count = self.copy_rows(table, columns, self.source_rows(table, columns))
+        self.dst.commit()
+        self.state["cursors"][table] = since
+        self.save_state()
+        return count
+
+    def upsert_rows(self, table, columns, keys, rows):
+        # Loads rows into a staging table, then inserts or updates them by primary key
+        cursor = self.dst.cursor()
+        staging = f"migrate_{table}"
+        cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table} INCLUDING DEFAULTS)")
+        cursor.execute(f"TRUNCATE {staging}")
+        count = self.copy_rows(staging, columns, rows)
+        updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns if column not in keys)
+        cursor.execute(f'''
+            INSERT INTO {table} ({', '.join(columns)})
+            SELECT {', '.join(columns)} FROM {staging}
+            ON CONFLICT ({', '.join(keys)}) {f"DO UPDATE SET {updates}" if updates else "DO NOTHING"}
+        ''')
+        self.dst.commit()
+        return count
+
+    def change_cursor(self, table):
+        _, column = KEYED_TABLES[table]
+        return self.src.execute(f"SELECT MAX({column}) FROM {table}").fetchone()[0]
+
+    def copy_changes(self, table, columns):
+        # Rows written since the table's cursor. Equal timestamps are copied again,
+        # since a write may have landed in the same microsecond after the last pass
+        keys, column = KEYED_TABLES[table]
+        since, upto = self.state["cursors"][table], self.change_cursor(table)
+        op = ">" if column == "rowid" else ">="
+        rows = self.source_rows(table, columns, f"WHERE {column} {op} ? AND {column} <= ?", (since, upto))
+        count = self.upsert_rows(table, columns, keys, rows)
+        self.state["cursors"][table] = upto
+        self.save_state()
+        return count
+
+    def resync_sequences(self):
+        cursor = self.dst.cursor()
+        for table, columns, _ in self.tables:
+            if "id" in columns:
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM {table}"
+                )
+        self.dst.commit()
+
+    # ----- checksums -----
+
+    def id_ranges(self, table, upto):
+        # Range bounds taken from the source so each range holds about one chunk
+        start = -1
+        while start < upto:
+            row = self.src.execute(
+                f"SELECT id FROM {table} WHERE id > ? AND id <= ? ORDER BY id LIMIT 1 OFFSET ?",
+                (start, upto, self.chunk - 1)
+            ).fetchone()
+            end = row[0] if row else upto
+            yield start, end
+            start = end
+
+    def range_digests(self, table, columns, types, start, end):
+        source = digest(self.source_rows(table, columns, "WHERE id > ? AND id <= ?", (start, end)), types)
+        target = digest(self.target_rows(table, columns, "WHERE id > %s AND id <= %s", (start, end)), types)
+        return source, target
+
+    def table_digests(self, table, columns, types):
+        return digest(self.source_rows(table, columns), types), digest(self.target_rows(table, columns), types)
+
+    def max_id(self, table):
+        source = self.src.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+        cursor = self.dst.cursor()
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+        return max(source, cursor.fetchone()[0])
+
+    def mismatched_ranges(self, table, columns, types, upto):
+        mismatched, source_total, target_total = [], [0, 0], [0, 0]
+        for start, end in self.id_ranges(table, upto):
+            source, target = self.range_digests(table, columns, types, start, end)
+            source_total = [source_total[0] + source[0], (source_total[1] + source[1]) % (1 << 128)]
+            target_total = [target_total[0] + target[0], (target_total[1] + target[1]) % (1 << 128)]
+            if source != target:
+                mismatched.append((start, end))
+        return mismatched, source_total, target_total
+
+    def repair_range(self, table, columns, start, end):
+        # Upsert the source rows of one range; extra target rows are deleted later, children first
+        self.upsert_rows(table, columns, ("id",),
+                         self.source_rows(table, columns, "WHERE id > ? AND id <= ?", (start, end)))
+
+    def delete_extra(self, table, start, end):
+        ids = [row[0] for row in self.src.execute(f"SELECT id FROM {table} WHERE id > ? AND id <= ?", (start, end))]
+        cursor = self.dst.cursor()
+        cursor.execute(f"DELETE FROM {table} WHERE id > %s AND id <= %s AND NOT (id = ANY(%s))", (start, end, ids))
+        deleted = cursor.rowcount
+        self.dst.commit()
+        return deleted
+
+    # ----- modes -----
+
+    def snapshot(self):
+        cursor = self.dst.cursor()
+        if self.args.truncate:
+            cursor.execute(f"TRUNCATE {', '.join(t for t, _, _ in reversed(self.tables))} RESTART IDENTITY")
+            self.dst.commit()
+            self.state = {"watermarks": {}, "replaced": [], "cursors": {}}
+        for table, _, _ in self.tables:
+            cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {table})")
+            ours = table in self.state["watermarks"] or table in self.state["replaced"]
+            if cursor.fetchone()[0] and not ours:
+                raise SystemExit(f"❌ {table} already has rows in Postgres; rerun with --truncate to start over")
+
+        counts = {}
+        for table, columns, _ in self.tables:
+            if "id" in columns:
+                # Resumes from the watermark if a previous snapshot was interrupted
+                counts[table], _ = self.copy_id_range(table, columns, self.state["watermarks"].get(table, 0))
+            else:
+                # Replaced in one transaction, so copying it again on resume is safe.
+                # Recorded first: the precheck above already found it empty or ours
+                if table not in self.state["replaced"]:
+                    self.state["replaced"].append(table)
+                    self.save_state()
+                counts[table] = self.replace_table(table, columns)
+            print(f"  {table:<20} {counts[table]:>12,}")
+        self.resync_sequences()
+        return counts
+
+    def catchup(self):
+        counts = {}
+        repairs = []
+        for table, columns, types in self.tables:
+            if "id" not in columns:
+                if self.state["cursors"].get(table) is None:
+                    # Snapshot taken before cursors were kept, or the table was empty then
+                    counts[table] = self.replace_table(table, columns)
+                else:
+                    counts[table] = self.copy_changes(table, columns)
+                    if self.args.reconcile:
+                        source, target = self.table_digests(table, columns, types)
+                        if source != target:
+                            # Only deletions are left to find, and these tables have no ranges to narrow them
+                            counts[table] += self.replace_table(table, columns)
+                print(f"  {table:<20} {counts[table]:>12,} changed")
+                continue
+            watermark = self.state["watermarks"].get(table, 0)
+            counts[table], _ = self.copy_id_range(table, columns, watermark)
+            if self.args.reconcile:
+                mismatched, _, _ = self.mismatched_ranges(table, columns, types, self.state["watermarks"].get(table, watermark))
+                for start, end in mismatched:
+                    self.repair_range(table, columns, start, end)
+                repairs.append((table, mismatched))
+            print(f"  {table:<20} {counts[table]:>12,} new")
+
+        for table, mismatched in reversed(repairs):
+            deleted = sum(self.delete_extra(table, start, end) for start, end in mismatched)
+            if mismatched:
+                print(f"  {table:<20} {len(mismatched):>6} range(s) repaired, {deleted:,} row(s) deleted")
+        self.resync_sequences()
+        return counts
+
+    def verify(self):
+        ok = True
+        print(f"  {'table':<20}{'sqlite':>12}{'postgres':>12}  checksum")
+        for table, columns, types in self.tables:
+            if "id" in columns:
+                mismatched, source, target = self.mismatched_ranges(table, columns, types, self.max_id(table))
+            else:
+                source, target = self.table_digests(table, columns, types)
+                mismatched = [] if source == target else [None]
+            match = source == target and not mismatched
+            ok = ok and match
+            detail = "ok" if match else f"MISMATCH ({len(mismatched)} range(s))"
+            print(f"  {table:<20}{source[0]:>12,}{target[0]:>12,}  {detail}")
+        return ok
+
+
+def main():
+    args = parse_args()
+    if not args.postgres:
+        raise SystemExit("❌ Pass --postgres or set DATABASE_URL")
+    if not os.path.exists(args.sqlite):
+        raise SystemExit(f"❌ {args.sqlite} not found")
+
+    # app.py picks its database at import time, so point it at the target first;
+    # importing it also runs create_tables() there
+    os.environ["DATABASE_URL"] = args.postgres
+    if args.target_sslmode:
+        os.environ["DATABASE_SSLMODE"] = args.target_sslmode
+    import app
+
+    migrator = Migrator(args, app)
+    started = time.time()
+    try:
+        if args.mode == "verify":
+            ok = migrator.verify()
+            print(f"{'✅ SQLite and Postgres match' if ok else '❌ Differences found'} ({time.time() - started:.1f}s)")
+            raise SystemExit(0 if ok else 1)
+
+        counts = migrator.snapshot() if args.mode == "snapshot" else migrator.catchup()
+        total = sum(counts.values())
+        elapsed = time.time() - started
+        print(f"✅ {args.mode} copied {total:,} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f} rows/s)")
+    finally:
+        migrator.src.close()
+        migrator.dst.close()
+
+
+if __name__ == "__main__":
+    main()
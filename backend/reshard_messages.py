@@ -0,0 +1,249 @@
+"""Build message shard maps and move conversations between shards.
+
+A shard map (see "Message Shards" in app.py) assigns hash buckets to databases.
+Resharding means writing a new map and moving the conversations whose bucket
+changed database. Message ids are preserved, so read cursors and history
+paging keep working.
+
+    # 1. write the new map: keeps existing shard numbers, moves as few buckets as possible
+    python reshard_messages.py map --shards shards/m0.db,shards/m1.db,shards/m2.db --out shard_map.new.json
+    # 2. see what would move, then copy it while the app keeps running on the old map
+    python reshard_messages.py plan --to shard_map.new.json
+    python reshard_messages.py copy --to shard_map.new.json
+    # 3. restart every process with MESSAGE_SHARD_MAP=shard_map.new.json, then copy the
+    #    stragglers written in between and delete the moved rows from their old shard
+    python reshard_messages.py finish --to shard_map.new.json
+
+The current layout comes from --from, else MESSAGE_SHARD_MAP / MESSAGE_SHARDS,
+else the unsharded primary (--from primary), which is how an existing
+deployment is split for the first time.
+"""
+import argparse
+import time
+from collections import Counter, defaultdict
+
+import app
+
+COLUMNS = {
+    "messages": ["id", "sender", "receiver", "message", "timestamp", "client_id"],
+    "group_messages": ["id", "group_id", "sender", "message", "timestamp", "client_id"],
+    # Archive chunk ids are local to a shard; (conversation, first_id) identifies a chunk
+    "message_archive": ["id", "conversation", "first_id", "last_id", "first_timestamp", "last_timestamp", "message_count", "payload"],
+}
+
+CONVERSATION_OF = {
+    "messages": lambda row: app.get_room_id(row[1], row[2]),
+    "group_messages": lambda row: app.group_conversation(row[1]),
+    "message_archive": lambda row: row[1],
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Reshard ConnectVit message tables.")
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    build = sub.add_parser("map", help="write a shard map for a new set of shards")
+    build.add_argument("--shards", required=True, help="comma-separated shard URLs, existing and new")
+    build.add_argument("--out", required=True, help="where to write the new map")
+    build.add_argument("--buckets", type=int, default=app.MESSAGE_SHARD_BUCKETS, help="bucket count for a first map")
+
+    for mode in ("plan", "copy", "finish"):
+        move = sub.add_parser(mode)
+        move.add_argument("--to", required=True, help="the new shard map")
+        move.add_argument("--chunk-size", type=int, default=2000, help="rows per read / write batch")
+        move.add_argument("--id-gap", type=int, default=1_000_000,
+                          help="when splitting the primary: headroom between its ids and the first id shards hand out")
+
+    for action in sub.choices.values():
+        action.add_argument("--from", dest="source", help="current shard map, or 'primary' (default: from the environment)")
+    return parser.parse_args()
+
+
+def current_map(source):
+    if source == "primary":
+        return None
+    if source:
+        return app.ShardMap.load(source)
+    return app.message_shards.map
+
+
+def rebalance(base, urls, bucket_count):
+    # Existing URLs keep their shard number; new ones get numbers never used before,
+    # since moved rows still carry ids from retired shards' slots
+    numbers = {url: shard for shard, url in (base.shards.items() if base else [])}
+    used = set(base.shards) if base else set()
+    shards = {}
+    for url in urls:
+        if url in numbers:
+            shards[numbers[url]] = url
+        else:
+            free = min(set(range(app.SHARD_ID_STRIDE)) - used)
+            used.add(free)
+            shards[free] = url
+
+    buckets = list(base.buckets) if base else [None] * bucket_count
+    order = sorted(shards)
+    quota = {shard: len(buckets) // len(order) + (1 if i < len(buckets) % len(order) else 0) for i, shard in enumerate(order)}
+    kept, moved = Counter(), []
+    for bucket, shard in enumerate(buckets):
+        if shard in quota and kept[shard] < quota[shard]:
+            kept[shard] += 1
+        else:
+            moved.append(bucket)
+    for bucket in moved:
+        shard = next(shard for shard in order if kept[shard] < quota[shard])
+        buckets[bucket] = shard
+        kept[shard] += 1
+    return app.ShardMap(shards, buckets), len(moved)
+
+
+class Mover:
+    def __init__(self, args):
+        self.args = args
+        self.chunk = args.chunk_size
+        self.source = app.MessageShards(current_map(args.source))
+        self.target = app.MessageShards(app.ShardMap.load(args.to))
+
+    @staticmethod
+    def url(layout, shard):
+        return "primary" if shard is None else layout.map.shards[shard]
+
+    def destination(self, source_shard, conversation):
+        # The target shard for a conversation that changes database, else None
+        shard = self.target.shard_for(conversation)
+        return shard if self.url(self.target, shard) != self.url(self.source, source_shard) else None
+
+    def scan(self, conn, table, after):
+        cursor = app.get_cursor(conn)
+        cursor.execute(f"SELECT {', '.join(COLUMNS[table])} FROM {table} WHERE id > ? ORDER BY id LIMIT ?", (after, self.chunk))
+        return cursor.fetchall()
+
+    def plan(self):
+        moves = defaultdict(set)
+        for source_shard in self.source.targets():
+            conn = self.source.connect(source_shard)
+            try:
+                for table in COLUMNS:
+                    after = 0
+                    while True:
+                        rows = self.scan(conn, table, after)
+                        if not rows:
+                            break
+                        for row in rows:
+                            conversation = CONVERSATION_OF[table](row)
+                            shard = self.destination(source_shard, conversation)
+                            if shard is not None:
+                                moves[(table, source_shard, shard)].add(conversation)
+                        after = rows[-1][0]
+            finally:
+                conn.close()
+
+        if not moves:
+            print("✅ Nothing to move")
+        for (table, source_shard, shard), conversations in sorted(moves.items(), key=str):
+            print(f"  {table:<16} {self.url(self.source, source_shard)} -> {self.url(self.target, shard)}: {len(conversations):,} conversation(s)")
+
+    def insert(self, conn, table, rows):
+        cursor = app.get_cursor(conn)
+        if table == "message_archive":
+            columns = COLUMNS[table][1:]
+            cursor.executemany(f'''
+                INSERT INTO message_archive ({', '.join(columns)})
+                SELECT {', '.join(['?'] * len(columns))}
+                WHERE NOT EXISTS (SELECT 1 FROM message_archive WHERE conversation = ? AND first_id = ?)
+            ''', [tuple(row[1:-1]) + (bytes(row[-1]), row[1], row[2]) for row in rows])
+        else:
+            columns = COLUMNS[table]
+            cursor.executemany(f'''
+                INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})
+                ON CONFLICT DO NOTHING
+            ''', rows)
+
+    def move(self, delete):
+        targets = {shard: self.target.connect(shard) for shard in self.target.targets()}
+        copied, deleted, highest = Counter(), Counter(), Counter()
+        try:
+            for source_shard in self.source.targets():
+                conn = self.source.connect(source_shard)
+                try:
+                    for table in COLUMNS:
+                        after = 0
+                        while True:
+                            rows = self.scan(conn, table, after)
+                            if not rows:
+                                break
+                            after = rows[-1][0]
+                            if table != "message_archive":
+                                highest[table] = max(highest[table], after)
+
+                            batches = defaultdict(list)
+                            for row in rows:
+                                shard = self.destination(source_shard, CONVERSATION_OF[table](row))
+                                if shard is not None:
+                                    batches[shard].append(row)
+                            for shard, batch in batches.items():
+                                self.insert(targets[shard], table, batch)
+                                targets[shard].commit()
+                                copied[table] += len(batch)
+
+                            # Only delete once the rows are committed on their new shard
+                            if delete and batches:
+                                ids = [(row[0],) for batch in batches.values() for row in batch]
+                                app.get_cursor(conn).executemany(f"DELETE FROM {table} WHERE id = ?", ids)
+                                conn.commit()
+                                deleted[table] += len(ids)
+                finally:
+                    conn.close()
+
+            # New ids on every target shard start above anything copied. Ids from other shards
+            # never collide with them, but the unsharded primary keeps writing plain ids until
+            # the new map is deployed, so those get headroom
+            gap = self.args.id_gap if self.source.map is None else 0
+            for shard, target in targets.items():
+                if shard is None:
+                    continue
+                for table in ("messages", "group_messages"):
+                    app.raise_id_floor(target, table, shard, highest[table] + gap)
+                target.commit()
+        finally:
+            for target in targets.values():
+                target.close()
+
+        for table in COLUMNS:
+            line = f"  {table:<16} {copied[table]:>10,} copied"
+            print(line + (f", {deleted[table]:,} deleted from the old shard" if delete else ""))
+
+
+def main():
+    args = parse_args()
+
+    if args.mode == "map":
+        base = current_map(args.source)
+        urls = [url.strip() for url in args.shards.split(",") if url.strip()]
+        shard_map, moved = rebalance(base, urls, args.buckets)
+        shard_map.save(args.out)
+        counts = Counter(shard_map.buckets)
+        for shard, url in sorted(shard_map.shards.items()):
+            print(f"  shard {shard:<3} {url:<40} {counts[shard]:>4} bucket(s)")
+        summary = f"{moved} of {len(shard_map.buckets)} buckets move" if base else "first map, everything moves off the primary"
+        print(f"✅ Wrote {args.out} ({summary})")
+        return
+
+    # Creates the message tables on any shard that is new in the target map
+    for shard in app.ShardMap.load(args.to).shards.values():
+        conn = app.connect_shard_url(shard)
+        app.create_message_tables(app.get_cursor(conn), foreign_keys=False)
+        conn.commit()
+        conn.close()
+
+    mover = Mover(args)
+    started = time.time()
+    if args.mode == "plan":
+        mover.plan()
+    else:
+        mover.move(delete=args.mode == "finish")
+        print(f"✅ {args.mode} done in {time.time() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
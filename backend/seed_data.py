@@ -0,0 +1,300 @@
+"""Synthetic dataset generator for scale testing.
+
+Loads users, direct messages, groups, group messages, posts and likes into the
+schema defined by ``create_tables()`` in app.py, using ``COPY`` on Postgres and
+one batched ``executemany`` transaction on SQLite.
+
+    python seed_data.py --users 20000 --conversations 50000 --seed 42
+"""
+import argparse
+import io
+import random
+import time
+from datetime import datetime, timedelta
+
+import bcrypt
+
+from app import DATABASE_URL, create_tables, get_db_connection
+
+# Every seeded user shares one password so we hash it once instead of per row.
+SEED_PASSWORD = "password123"
+
+WORDS = (
+    "exam lab notes assignment quiz cat fat viva slot project review mess hostel "
+    "library canteen deadline ppt report submission attendance proxy faculty "
+    "internship placement club fest riviera gravitas tt hod cgpa grade"
+).split()
+
+TABLE_COLUMNS = {
+    "users": ("id", "full_name", "username", "email", "password", "date_of_joining"),
+    "messages": ("id", "sender", "receiver", "message", "timestamp"),
+    "groups": ("id", "name", "description", "created_by", "created_at"),
+    "group_members": ("id", "group_id", "username", "joined_at", "is_admin"),
+    "group_messages": ("id", "group_id", "sender", "message", "timestamp"),
+    "posts": ("id", "username", "caption", "image_url", "timestamp"),
+    "post_likes": ("id", "post_id", "username", "timestamp"),
+}
+
+# Children first so a reset never trips a foreign key.
+RESET_ORDER = ["post_likes", "posts", "group_messages", "group_members", "groups", "messages", "users"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bulk-load a synthetic ConnectVit dataset.")
+    parser.add_argument("--seed", type=int, default=42, help="RNG seed; the same seed produces the same dataset")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--conversations", type=int, default=20000, help="number of direct-message conversations")
+    parser.add_argument("--messages-per-conversation", type=float, default=40.0, help="mean of an exponential distribution")
+    parser.add_argument("--groups", type=int, default=1000)
+    parser.add_argument("--group-size-alpha", type=float, default=1.3, help="pareto shape for group sizes; lower is more skewed")
+    parser.add_argument("--min-group-size", type=int, default=3)
+    parser.add_argument("--max-group-size", type=int, default=2000)
+    parser.add_argument("--messages-per-group", type=float, default=200.0, help="mean of an exponential distribution")
+    parser.add_argument("--posts", type=int, default=20000)
+    parser.add_argument("--likes-alpha", type=float, default=1.1, help="pareto shape for likes per post; lower is more skewed")
+    parser.add_argument("--max-likes", type=int, default=5000)
+    parser.add_argument("--user-skew", type=float, default=1.2, help="how strongly activity concentrates on a few users")
+    parser.add_argument("--prefix", default="seed_", help="username prefix, keeps seeded users apart from real ones")
+    parser.add_argument("--days", type=int, default=180, help="spread timestamps over this many past days")
+    parser.add_argument("--reset", action="store_true", help="delete all existing rows before loading")
+    return parser.parse_args()
+
+
+class Generator:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.start = datetime(2025, 1, 1)
+        self.span = args.days * 86400
+        # Sentences are drawn from a fixed pool; building one per row dominated load time.
+        self.phrases = [" ".join(self.rng.choices(WORDS, k=self.rng.randint(2, 20))) for _ in range(4096)]
+
+    def username(self, index):
+        return f"{self.args.prefix}{index}"
+
+    def pick_user(self):
+        # Power-law pick so a handful of users dominate the traffic, like real chats.
+        n = self.args.users
+        return min(int(n * self.rng.random() ** self.args.user_skew), n - 1)
+
+    def timestamp(self):
+        return (self.start + timedelta(seconds=self.rng.randrange(self.span))).isoformat()
+
+    def text(self):
+        return self.phrases[self.rng.getrandbits(12)]
+
+    def exponential(self, mean):
+        return int(self.rng.expovariate(1.0 / mean)) + 1 if mean > 0 else 0
+
+    def pareto(self, alpha, low, high):
+        return min(int(low * self.rng.paretovariate(alpha)), high)
+
+    def users(self, base_id, password_hash):
+        joined = self.start.strftime("%d-%m-%Y")
+        for i in range(self.args.users):
+            username = self.username(i)
+            yield (base_id + i, f"Seed User {i}", username, f"{username}@vitstudent.ac.in", password_hash, joined)
+
+    def messages(self, base_id):
+        next_id = base_id
+        for _ in range(self.args.conversations):
+            a = self.pick_user()
+            b = self.rng.randrange(self.args.users)
+            if a == b:
+                b = (b + 1) % self.args.users
+            a, b = self.username(a), self.username(b)
+            for _ in range(self.exponential(self.args.messages_per_conversation)):
+                sender, receiver = (a, b) if self.rng.random() < 0.5 else (b, a)
+                yield (next_id, sender, receiver, self.text(), self.timestamp())
+                next_id += 1
+
+    def groups(self, base_id, member_base_id, message_base_id):
+        # Groups, their members and their messages are generated together so the
+        # membership sample is only held for one group at a time.
+        groups, members, messages = [], [], []
+        member_id, message_id = member_base_id, message_base_id
+        max_size = min(self.args.max_group_size, self.args.users)
+        min_size = min(self.args.min_group_size, max_size)
+        for i in range(self.args.groups):
+            group_id = base_id + i
+            size = max(self.pareto(self.args.group_size_alpha, min_size, max_size), 1)
+            roster = [self.username(u) for u in self.rng.sample(range(self.args.users), size)]
+            created_at = self.timestamp()
+            groups.append((group_id, f"Study Group {i}", self.text(), roster[0], created_at))
+            for position, username in enumerate(roster):
+                members.append((member_id, group_id, username, created_at, 1 if position == 0 else 0))
+                member_id += 1
+            for _ in range(self.exponential(self.args.messages_per_group)):
+                messages.append((message_id, group_id, self.rng.choice(roster), self.text(), self.timestamp()))
+                message_id += 1
+            yield groups, members, messages
+            groups, members, messages = [], [], []
+
+    def posts(self, base_id):
+        for i in range(self.args.posts):
+            username = self.username(self.pick_user())
+            yield (base_id + i, username, self.text(), f"https://picsum.photos/seed/{base_id + i}/600/600", self.timestamp())
+
+    def likes(self, post_base_id, base_id):
+        like_id = base_id
+        max_likes = min(self.args.max_likes, self.args.users)
+        for i in range(self.args.posts):
+            count = self.pareto(self.args.likes_alpha, 1, max_likes) - 1
+            for user in self.rng.sample(range(self.args.users), count):
+                yield (like_id, post_base_id + i, self.username(user), self.timestamp())
+                like_id += 1
+
+
+# ---------- Postgres (COPY) ----------
+
+def copy_escape(value):
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+class RowStream(io.RawIOBase):
+    """File-like adapter that feeds generated rows to ``copy_expert`` lazily."""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = b""
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        parts, pending = [self.buffer], len(self.buffer)
+        while pending < len(target):
+            row = next(self.rows, None)
+            if row is None:
+                break
+            line = ("\t".join(copy_escape(v) for v in row) + "\n").encode("utf-8")
+            parts.append(line)
+            pending += len(line)
+            self.count += 1
+        self.buffer = b"".join(parts)
+        size = min(len(target), len(self.buffer))
+        target[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+
+class PostgresLoader:
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.cursor()
+
+    def max_id(self, table):
+        self.cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+        return self.cursor.fetchone()[0]
+
+    def has_users(self, prefix):
+        self.cursor.execute("SELECT 1 FROM users WHERE substr(username, 1, %s) = %s LIMIT 1", (len(prefix), prefix))
+        return self.cursor.fetchone() is not None
+
+    def reset(self):
+        self.cursor.execute(f"TRUNCATE {', '.join(RESET_ORDER)} RESTART IDENTITY")
+
+    def load(self, table, rows):
+        stream = RowStream(rows)
+        columns = ", ".join(TABLE_COLUMNS[table])
+        self.cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN", io.BufferedReader(stream, 1 << 20))
+        return stream.count
+
+    def finish(self):
+        # Explicit ids bypass the SERIAL sequences, so move them past what we loaded.
+        for table in TABLE_COLUMNS:
+            self.cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM {table}"
+            )
+        self.conn.commit()
+
+
+# ---------- SQLite (executemany) ----------
+
+class SqliteLoader:
+    def __init__(self, conn):
+        self.conn = conn
+        self.conn.isolation_level = None
+        self.cursor = conn.cursor()
+        self.cursor.execute("PRAGMA synchronous = OFF")
+        self.cursor.execute("PRAGMA journal_mode = MEMORY")
+        self.cursor.execute("BEGIN")
+
+    def max_id(self, table):
+        self.cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+        return self.cursor.fetchone()[0]
+
+    def has_users(self, prefix):
+        self.cursor.execute("SELECT 1 FROM users WHERE substr(username, 1, ?) = ? LIMIT 1", (len(prefix), prefix))
+        return self.cursor.fetchone() is not None
+
+    def reset(self):
+        for table in RESET_ORDER:
+            self.cursor.execute(f"DELETE FROM {table}")
+
+    def load(self, table, rows):
+        columns = TABLE_COLUMNS[table]
+        placeholders = ", ".join("?" for _ in columns)
+        before = self.conn.total_changes
+        self.cursor.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+        return self.conn.total_changes - before
+
+    def finish(self):
+        self.cursor.execute("COMMIT")
+
+
+def main():
+    args = parse_args()
+    create_tables()
+
+    conn = get_db_connection()
+    loader = PostgresLoader(conn) if DATABASE_URL else SqliteLoader(conn)
+    gen = Generator(args)
+    started = time.time()
+
+    try:
+        if args.reset:
+            loader.reset()
+        elif loader.has_users(args.prefix):
+            # Seeded usernames and emails are unique, so a second load would fail halfway
+            raise SystemExit(f"❌ Users named {args.prefix}* already exist; rerun with --reset or a different --prefix")
+
+        base = {table: loader.max_id(table) + 1 for table in TABLE_COLUMNS}
+        password_hash = bcrypt.hashpw(SEED_PASSWORD.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+        counts = dict.fromkeys(TABLE_COLUMNS, 0)
+
+        counts["users"] = loader.load("users", gen.users(base["users"], password_hash))
+        counts["messages"] = loader.load("messages", gen.messages(base["messages"]))
+
+        # Buffer a few groups at a time and flush each table in turn.
+        pending = {"groups": [], "group_members": [], "group_messages": []}
+        for groups, members, messages in gen.groups(base["groups"], base["group_members"], base["group_messages"]):
+            pending["groups"] += groups
+            pending["group_members"] += members
+            pending["group_messages"] += messages
+            if len(pending["group_messages"]) + len(pending["group_members"]) >= 200000:
+                for table, rows in pending.items():
+                    counts[table] += loader.load(table, rows)
+                    rows.clear()
+        for table, rows in pending.items():
+            counts[table] += loader.load(table, rows)
+
+        counts["posts"] = loader.load("posts", gen.posts(base["posts"]))
+        counts["post_likes"] = loader.load("post_likes", gen.likes(base["posts"], base["post_likes"]))
+
+        loader.finish()
+    finally:
+        conn.close()
+
+    elapsed = time.time() - started
+    total = sum(counts.values())
+    for table, count in counts.items():
+        print(f"  {table:<15} {count:>12,}")
+    print(f"✅ Loaded {total:,} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
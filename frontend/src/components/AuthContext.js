@@ -1,4 +1,56 @@
 import React, { createContext, useState, useContext, useEffect } from 'react';
+import axios from 'axios';
+
+const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:5010';
+
+export const getAuthToken = () => localStorage.getItem('token');
+
+// Attach the session token to every call to our API, whether made with fetch or axios
+const isApiUrl = (url) => typeof url === 'string' && url.startsWith(API_URL);
+
+// A 401 on a request that carried our token means the session is gone (expired,
+// revoked or signed with a rotated-out key), so drop it and log out
+let onSessionExpired = () => {};
+
+const expireSession = (token) => {
+  if (getAuthToken() !== token) return;
+  localStorage.removeItem('token');
+  localStorage.removeItem('user');
+  onSessionExpired();
+};
+
+const nativeFetch = window.fetch.bind(window);
+window.fetch = (input, init = {}) => {
+  const token = getAuthToken();
+  if (!token || !isApiUrl(typeof input === 'string' ? input : input.url)) {
+    return nativeFetch(input, init);
+  }
+  const headers = new Headers(init.headers || {});
+  if (!headers.has('Authorization')) headers.set('Authorization', `Bearer ${token}`);
+  return nativeFetch(input, { ...init, headers }).then((response) => {
+    if (response.status === 401) expireSession(token);
+    return response;
+  });
+};
+
+axios.interceptors.request.use((config) => {
+  const token = getAuthToken();
+  if (token && isApiUrl(config.url) && !config.headers.Authorization) {
+    config.headers.Authorization = `Bearer ${token}`;
+  }
+  return config;
+});
+
+axios.interceptors.response.use(
+  (response) => response,
+  (error) => {
+    const sent = error.config && error.config.headers && error.config.headers.Authorization;
+    if (error.response && error.response.status === 401 && sent) {
+      expireSession(String(sent).replace(/^Bearer /, ''));
+    }
+    return Promise.reject(error);
+  }
+);
 
 // Create context
 const AuthContext = createContext();
@@ -7,6 +59,13 @@ const AuthContext = createContext();
 export const AuthProvider = ({ children }) => {
   const [currentUser, setCurrentUser] = useState(null);
   const [loading, setLoading] = useState(true);
+
+  useEffect(() => {
+    onSessionExpired = () => setCurrentUser(null);
+    return () => {
+      onSessionExpired = () => {};
+    };
+  }, []);
   
   // Check if user is already logged in from localStorage
   useEffect(() => {
@@ -42,7 +101,6 @@ export const AuthProvider = ({ children }) => {
     try {
       console.log("Attempting login with:", { username, password });
       
-      const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:5010';
       const response = await fetch(`${API_URL}/api/login`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
@@ -56,9 +114,10 @@ export const AuthProvider = ({ children }) => {
         throw new Error(data.error || 'Login failed');
       }
       
-      // Save user to state and localStorage
+      // Save user and session token to state and localStorage
       setCurrentUser(data.user);
       localStorage.setItem('user', JSON.stringify(data.user));
+      localStorage.setItem('token', data.token);
       
       return { success: true };
     } catch (error) {
@@ -73,8 +132,11 @@ export const AuthProvider = ({ children }) => {
   // Logout function
   const logout = () => {
     console.log("Logging out user");
+    // Revoke the token server-side; logging out locally doesn't wait on it
+    fetch(`${API_URL}/api/logout`, { method: 'POST' }).catch(() => {});
     setCurrentUser(null);
     localStorage.removeItem('user');
+    localStorage.removeItem('token');
   };
   
   // Context value
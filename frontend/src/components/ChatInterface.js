@@ -1,15 +1,20 @@
 import React, { useState, useEffect, useRef } from 'react';
 import io from 'socket.io-client';
-import { useAuth } from './AuthContext';
+import { useAuth, getAuthToken } from './AuthContext';
 import './utils.css';
 
+// Newest messages per request; older ones load on demand
+const PAGE_SIZE = 50;
+
 function ChatInterface({ activeChat }) {
   const [messages, setMessages] = useState([]);
   const [newMessage, setNewMessage] = useState('');
   const [socket, setSocket] = useState(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
+  const [hasOlder, setHasOlder] = useState(false);
   const messagesEndRef = useRef(null);
+  const keepScroll = useRef(false);
   const { currentUser } = useAuth();
   
   // Get username from auth context
@@ -23,27 +28,30 @@ function ChatInterface({ activeChat }) {
   const currentUsername = getCurrentUsername();
   const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:5010';
 
-  // Connect to socket when component mounts
+  // Connect to socket when component mounts; the server joins us to our own user room
   useEffect(() => {
-    const newSocket = io(API_URL);
+    if (!currentUsername) return;
+
+    const newSocket = io(API_URL, { auth: { username: currentUsername, token: getAuthToken() } });
     setSocket(newSocket);
 
+    // Keep our presence fresh while the chat is open
+    const heartbeat = setInterval(() => newSocket.emit('heartbeat'), 30000);
+
     return () => {
+      clearInterval(heartbeat);
       newSocket.disconnect();
     };
-  }, [API_URL]);
+  }, [API_URL, currentUsername]);
 
   // Fetch messages when active chat changes
   useEffect(() => {
     if (socket && activeChat && currentUsername) {
-      // Join the room for this chat
-      socket.emit('join', { sender: currentUsername, receiver: activeChat });
-      
       // Fetch messages from backend
       const fetchMessages = async () => {
         try {
           setLoading(true);
-          const response = await fetch(`${API_URL}/api/messages?sender=${currentUsername}&receiver=${activeChat}`);
+          const response = await fetch(`${API_URL}/api/messages?sender=${currentUsername}&receiver=${activeChat}&limit=${PAGE_SIZE}`);
           
           if (!response.ok) {
             throw new Error('Failed to fetch messages');
@@ -51,7 +59,12 @@ function ChatInterface({ activeChat }) {
           
           const data = await response.json();
           setMessages(data);
+          setHasOlder(data.length === PAGE_SIZE);
           setError(null);
+
+          if (data.length > 0) {
+            socket.emit('mark_read', { receiver: activeChat, last_read_id: data[data.length - 1].id });
+          }
         } catch (err) {
           console.error('Error fetching messages:', err);
           setError('Failed to load messages. Please try again.');
@@ -65,11 +78,16 @@ function ChatInterface({ activeChat }) {
     }
   }, [socket, activeChat, currentUsername]);
 
-  // Listen for incoming messages
+  // Listen for incoming messages (our user room receives every DM, so keep only the open chat)
   useEffect(() => {
     if (socket) {
       socket.on('receive_message', (message) => {
-        setMessages(prevMessages => [...prevMessages, message]);
+        if (message.sender === activeChat || message.receiver === activeChat) {
+          setMessages(prevMessages => [...prevMessages, message]);
+          if (message.sender === activeChat) {
+            socket.emit('mark_read', { receiver: activeChat, last_read_id: message.id });
+          }
+        }
       });
     }
     
@@ -78,13 +96,34 @@ function ChatInterface({ activeChat }) {
         socket.off('receive_message');
       }
     };
-  }, [socket]);
+  }, [socket, activeChat]);
 
-  // Scroll to bottom when messages change
+  // Scroll to bottom when messages change, but not when older ones are prepended
   useEffect(() => {
+    if (keepScroll.current) {
+      keepScroll.current = false;
+      return;
+    }
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   }, [messages]);
 
+  const loadOlderMessages = async () => {
+    const oldest = messages.find(msg => msg.id != null);
+    if (!oldest) return;
+    try {
+      const response = await fetch(`${API_URL}/api/messages?sender=${currentUsername}&receiver=${activeChat}&limit=${PAGE_SIZE}&before=${oldest.id}`);
+      if (!response.ok) {
+        throw new Error('Failed to fetch messages');
+      }
+      const data = await response.json();
+      keepScroll.current = true;
+      setMessages(prevMessages => [...data, ...prevMessages]);
+      setHasOlder(data.length === PAGE_SIZE);
+    } catch (err) {
+      console.error('Error fetching older messages:', err);
+    }
+  };
+
   const handleSendMessage = (e) => {
     e.preventDefault();
     if (newMessage.trim() && socket && activeChat && currentUsername) {
@@ -93,11 +132,17 @@ function ChatInterface({ activeChat }) {
         sender: currentUsername,
         receiver: activeChat,
         message: newMessage.trim(),
-        timestamp: timestamp
+        timestamp: timestamp,
+        // Lets the server drop the duplicate if this send is retried after a reconnect
+        client_id: `${currentUsername}-${Date.now()}-${Math.random().toString(36).slice(2, 10)}`
       };
       
-      // Send to server
-      socket.emit('send_message', messageData);
+      // Send to server; the ack carries the stored id and timestamp
+      socket.emit('send_message', messageData, (ack) => {
+        if (ack && ack.error) {
+          setError(ack.error);
+        }
+      });
       setNewMessage('');
     }
   };
@@ -134,7 +179,13 @@ function ChatInterface({ activeChat }) {
         ) : error ? (
           <div className="error-messages">{error}</div>
         ) : messages.length > 0 ? (
-          messages.map((msg, index) => (
+          <>
+          {hasOlder && (
+            <button className="load-older-messages" onClick={loadOlderMessages}>
+              Load earlier messages
+            </button>
+          )}
+          {messages.map((msg, index) => (
             <div 
               key={index} 
               className={`message ${msg.sender === currentUsername ? 'sent' : 'received'}`}
@@ -146,7 +197,8 @@ function ChatInterface({ activeChat }) {
                 {new Date(msg.timestamp).toLocaleTimeString([], {hour: '2-digit', minute:'2-digit'})}
               </div>
             </div>
-          ))
+          ))}
+          </>
         ) : (
           <div className="no-messages">No messages yet. Start the conversation!</div>
         )}
@@ -23,20 +23,29 @@ function ChatList({ onSelectChat, activeChat }) {
       try {
         setLoading(true);
         
-        // Fetch all users
-        const usersResponse = await fetch(`${API_URL}/api/users`);
-        if (!usersResponse.ok) {
+        // Fetch users, chat history (for sorting) and presence in one round trip
+        const batchResponse = await fetch(`${API_URL}/api/batch`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({
+            requests: [
+              { path: '/api/users' },
+              { path: `/api/chat-history?username=${currentUser.username}` },
+              { path: '/api/presence' }
+            ]
+          })
+        });
+        if (!batchResponse.ok) {
           throw new Error('Failed to fetch users');
         }
-        const userData = await usersResponse.json();
-        
-        // Fetch chat history for sorting
-        const chatHistoryResponse = await fetch(`${API_URL}/api/chat-history?username=${currentUser.username}`);
-        let chatHistory = [];
-        
-        if (chatHistoryResponse.ok) {
-          chatHistory = await chatHistoryResponse.json();
+        const [usersResult, chatHistoryResult, presenceResult] = (await batchResponse.json()).responses;
+
+        if (usersResult.status !== 200) {
+          throw new Error('Failed to fetch users');
         }
+        const userData = usersResult.body;
+        const chatHistory = chatHistoryResult.status === 200 ? chatHistoryResult.body : [];
+        const onlineUsers = presenceResult.status === 200 ? presenceResult.body.users || {} : {};
         
         // Process and transform users data
         const usersWithChat = userData
@@ -52,7 +61,9 @@ function ChatList({ onSelectChat, activeChat }) {
               fullName: user.full_name,
               lastMessage: lastChat ? lastChat.lastMessage : 'Click to start chatting',
               timestamp: lastChat ? lastChat.timestamp : null,
-              hasHistory: !!lastChat
+              hasHistory: !!lastChat,
+              unread: lastChat ? lastChat.unread || 0 : 0,
+              online: !!(onlineUsers[user.username] && onlineUsers[user.username].online)
             };
           });
         
@@ -127,13 +138,16 @@ function ChatList({ onSelectChat, activeChat }) {
               className={`chat-item ${activeChat === chat.username ? 'active' : ''} ${chat.hasHistory ? 'has-history' : ''}`}
               onClick={() => onSelectChat(chat.username)}
             >
-              <div className="chat-avatar">
+              <div className={`chat-avatar ${chat.online ? 'online' : ''}`}>
                 {chat.fullName ? chat.fullName.charAt(0) : '?'}
               </div>
               <div className="chat-info">
                 <div className="chat-name">{chat.fullName || chat.username}</div>
                 <div className="chat-last-message">{chat.lastMessage}</div>
               </div>
+              {chat.unread > 0 && activeChat !== chat.username && (
+                <div className="chat-unread-badge">{chat.unread}</div>
+              )}
             </div>
           ))
         ) : (
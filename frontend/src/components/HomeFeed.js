@@ -6,22 +6,31 @@ import './HomeFeed.css';
 export default function HomeFeed() {
   const [posts, setPosts] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextBefore, setNextBefore] = useState(null);
   const { currentUser } = useAuth();
 
   useEffect(() => {
     loadPosts();
   }, [currentUser]);
 
-  const loadPosts = async () => {
+  const loadPosts = async (before = null) => {
     try {
-      setLoading(true);
+      if (!before) setLoading(true);
       
       const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:5010';
-      const response = await fetch(`${API_URL}/api/posts`);
+      const response = currentUser
+        ? await fetch(`${API_URL}/api/timeline?username=${currentUser.username}${before ? `&before=${before}` : ''}`)
+        : await fetch(`${API_URL}/api/posts`);
       
       if (response.ok) {
-        const allPosts = await response.json();
-        setPosts(allPosts);
+        const data = await response.json();
+        if (currentUser) {
+          // Home timeline is paged; keep appending older pages
+          setPosts(prev => (before ? [...prev, ...data.posts] : data.posts));
+          setNextBefore(data.next_before);
+        } else {
+          setPosts(data);
+        }
       } else {
         // Fallback to local storage if API fails (or for offline demo)
         const savedPosts = localStorage.getItem('posts');
@@ -47,6 +56,11 @@ export default function HomeFeed() {
             {posts.map(post => (
               <PostCard key={post.id} post={post} />
             ))}
+            {nextBefore && (
+              <button className="load-more-posts" onClick={() => loadPosts(nextBefore)}>
+                Load more
+              </button>
+            )}
           </div>
         ) : (
           <div className="no-posts">
@@ -6,10 +6,11 @@ import formatDistanceToNow from 'date-fns/formatDistanceToNow';
 
 function PostCard({ post }) {
   const { currentUser } = useAuth();
+  // Timeline posts carry likes_count/liked; the plain posts list carries the likes array
   const [isLiked, setIsLiked] = useState(
-    post.likes?.includes(currentUser?.username) || false
+    post.liked ?? (post.likes?.includes(currentUser?.username) || false)
   );
-  const [likesCount, setLikesCount] = useState(post.likes?.length || 0);
+  const [likesCount, setLikesCount] = useState(post.likes_count ?? (post.likes?.length || 0));
   const [comment, setComment] = useState('');
   const [showComments, setShowComments] = useState(false);
   const navigate = useNavigate();
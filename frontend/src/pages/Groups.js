@@ -1,6 +1,6 @@
 import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate, useLocation } from 'react-router-dom';
-import { useAuth } from '../components/AuthContext';
+import { useAuth, getAuthToken } from '../components/AuthContext';
 import LeftPanel from '../components/LeftPanel';
 import RightPanel from '../components/RightPanel';
 import axios from 'axios';
@@ -9,6 +9,7 @@ import './Groups.css';
 import formatDistanceToNow from 'date-fns/formatDistanceToNow';
 
 const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:5010';
+const MESSAGE_PAGE_SIZE = 50;
 
 function Groups() {
   const [userGroups, setUserGroups] = useState([]);
@@ -20,6 +21,7 @@ function Groups() {
   const [loading, setLoading] = useState(true);
   const [message, setMessage] = useState('');
   const [groupMessages, setGroupMessages] = useState([]);
+  const [hasOlderMessages, setHasOlderMessages] = useState(false);
   const [createGroupData, setCreateGroupData] = useState({
     name: '',
     description: '',
@@ -29,6 +31,7 @@ function Groups() {
   const location = useLocation();
   const { currentUser, isAuthenticated } = useAuth();
   const messagesEndRef = useRef(null);
+  const keepScroll = useRef(false);
   const messageInputRef = useRef(null);
   const [groupMembers, setGroupMembers] = useState([]);
   const [newMemberUsername, setNewMemberUsername] = useState('');
@@ -36,7 +39,7 @@ function Groups() {
 
   // Initialize Socket.IO
   useEffect(() => {
-    socket.current = io(API_URL);
+    socket.current = io(API_URL, { auth: { token: getAuthToken() } });
     
     return () => {
       if (socket.current) socket.current.disconnect();
@@ -54,6 +57,9 @@ function Groups() {
           if (prevMessages.some(m => m.id === newMessage.id)) return prevMessages;
           return [...prevMessages, newMessage];
         });
+        if (newMessage.id != null) {
+          socket.current.emit('mark_read', { group_id: newMessage.group_id, last_read_id: newMessage.id });
+        }
       }
     });
 
@@ -84,8 +90,12 @@ function Groups() {
     }
   }, [location.search, allGroups]);
 
-  // Scroll to bottom of messages
+  // Scroll to bottom of messages, but not when older ones are prepended
   useEffect(() => {
+    if (keepScroll.current) {
+      keepScroll.current = false;
+      return;
+    }
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   }, [groupMessages]);
 
@@ -94,18 +104,24 @@ function Groups() {
     try {
       setLoading(true);
       
-      // Fetch user's groups
-      const userGroupsResponse = await axios.get(`${API_URL}/api/groups?username=${currentUser.username}`);
-      
-      // Fetch all groups
-      const allGroupsResponse = await axios.get(`${API_URL}/api/all-groups`);
+      // Fetch user's groups and all groups in one round trip
+      const batchResponse = await axios.post(`${API_URL}/api/batch`, {
+        requests: [
+          { path: `/api/groups?username=${currentUser.username}` },
+          { path: '/api/all-groups' }
+        ]
+      });
+      const [userGroupsResult, allGroupsResult] = batchResponse.data.responses;
+      if (userGroupsResult.status !== 200 || allGroupsResult.status !== 200) {
+        throw new Error('Failed to fetch groups');
+      }
       
-      const userGroupsData = userGroupsResponse.data.map(group => ({
+      const userGroupsData = userGroupsResult.body.map(group => ({
         ...group,
         members: group.members || []
       }));
       
-      const allGroupsData = allGroupsResponse.data.map(group => ({
+      const allGroupsData = allGroupsResult.body.map(group => ({
         ...group,
         members: group.members || []
       }));
@@ -333,25 +349,61 @@ function Groups() {
   // Fetch group messages
   const fetchGroupMessages = async (groupId) => {
     try {
-      const response = await axios.get(`${API_URL}/api/groups/${groupId}/messages`);
+      const response = await axios.get(`${API_URL}/api/groups/${groupId}/messages?limit=${MESSAGE_PAGE_SIZE}`);
       setGroupMessages(response.data);
+      setHasOlderMessages(response.data.length === MESSAGE_PAGE_SIZE);
+
+      const latest = response.data[response.data.length - 1];
+      if (latest && latest.id != null && socket.current) {
+        socket.current.emit('mark_read', { group_id: groupId, last_read_id: latest.id });
+      }
     } catch (err) {
       console.error('Error fetching group messages:', err);
     }
   };
 
+  // Fetch the page of group messages before the oldest one shown
+  const loadOlderGroupMessages = async () => {
+    const oldest = groupMessages.find(msg => msg.id != null);
+    if (!selectedGroup || !oldest) return;
+    try {
+      const response = await axios.get(`${API_URL}/api/groups/${selectedGroup.id}/messages?limit=${MESSAGE_PAGE_SIZE}&before=${oldest.id}`);
+      keepScroll.current = true;
+      setGroupMessages(prevMessages => [...response.data, ...prevMessages]);
+      setHasOlderMessages(response.data.length === MESSAGE_PAGE_SIZE);
+    } catch (err) {
+      console.error('Error fetching older group messages:', err);
+    }
+  };
+
   // Handle adding a new member to the group
   const handleAddMember = async (e) => {
     e.preventDefault();
     
     if (!newMemberUsername.trim() || !selectedGroup) return;
     
+    // Several usernames (comma or space separated) go through the bulk endpoint in one request
+    const usernames = newMemberUsername.split(/[\s,]+/).filter(Boolean);
+
     try {
-      await axios.post(`${API_URL}/api/groups/${selectedGroup.id}/members`, {
-        username: newMemberUsername,
-        added_by: currentUser.username
-      });
-      
+      if (usernames.length > 1) {
+        const response = await axios.post(`${API_URL}/api/groups/${selectedGroup.id}/members/bulk`, {
+          add: usernames,
+          added_by: currentUser.username
+        });
+        const failed = Object.entries(response.data.results)
+          .filter(([, status]) => status !== 'added')
+          .map(([username, status]) => `${username}: ${status.replace('_', ' ')}`);
+        if (failed.length > 0) {
+          alert(`Some users were not added:\n${failed.join('\n')}`);
+        }
+      } else {
+        await axios.post(`${API_URL}/api/groups/${selectedGroup.id}/members`, {
+          username: usernames[0],
+          added_by: currentUser.username
+        });
+      }
+
       setNewMemberUsername('');
       
       // Refresh group details
@@ -368,18 +420,28 @@ function Groups() {
     setGroupMessages([]);
     
     try {
-      // Fetch group details to get members
-      const detailsResponse = await axios.get(`${API_URL}/api/groups/${group.id}`);
+      // Fetch group details (for members) and messages in one round trip
+      const batchResponse = await axios.post(`${API_URL}/api/batch`, {
+        requests: [
+          { path: `/api/groups/${group.id}` },
+          { path: `/api/groups/${group.id}/messages?limit=${MESSAGE_PAGE_SIZE}` }
+        ]
+      });
+      const [detailsResult, messagesResult] = batchResponse.data.responses;
+      if (detailsResult.status !== 200) {
+        throw new Error('Failed to fetch group details');
+      }
+
       // Update the selected group with members from the response
       setSelectedGroup(prev => ({
         ...prev,
-        members: detailsResponse.data.members || []
+        members: detailsResult.body.members || []
       }));
-      setGroupMembers(detailsResponse.data.members || []);
+      setGroupMembers(detailsResult.body.members || []);
       
-      // Fetch group messages
-      const messagesResponse = await axios.get(`${API_URL}/api/groups/${group.id}/messages`);
-      setGroupMessages(messagesResponse.data || []);
+      const messages = messagesResult.status === 200 ? messagesResult.body || [] : [];
+      setGroupMessages(messages);
+      setHasOlderMessages(messages.length === MESSAGE_PAGE_SIZE);
 
       // Join socket room for this group
       if (socket.current) {
@@ -518,9 +580,15 @@ function Groups() {
                   </p>
                 </div>
               ) : (
-                groupMessages.map(msg => (
+                <>
+                {hasOlderMessages && (
+                  <button className="load-older-messages" onClick={loadOlderGroupMessages}>
+                    Load earlier messages
+                  </button>
+                )}
+                {groupMessages.map(msg => (
                   <div 
-                    key={msg.id}
+                    key={msg.id ?? msg.client_id}
                     className={`message-item ${msg.sender === currentUser.username ? 'own-message' : ''}`}
                   >
                     <div className="message-bubble">
@@ -533,7 +601,8 @@ function Groups() {
                       {formatDate(msg.timestamp)}
                     </div>
                   </div>
-                ))
+                ))}
+                </>
               )}
               <div ref={messagesEndRef} />
             </div>
@@ -12,6 +12,14 @@ function Notifications() {
   const navigate = useNavigate();
   const { currentUser, isAuthenticated } = useAuth();
 
+  const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:5010';
+
+  // Server notifications have numeric ids; anything else only lives in local storage
+  const isServerNotification = (notif) => typeof notif.id === 'number';
+  const saveLocalNotifications = (notifs) => {
+    localStorage.setItem('notifications', JSON.stringify(notifs.filter(notif => !isServerNotification(notif))));
+  };
+
   // Redirect to login if not authenticated
   useEffect(() => {
     if (!isAuthenticated) {
@@ -21,8 +29,8 @@ function Notifications() {
     }
   }, [isAuthenticated, navigate]);
 
-  // Load notifications from local storage
-  const loadNotifications = () => {
+  // Load notifications from the server and local storage
+  const loadNotifications = async () => {
     try {
       const savedNotifications = localStorage.getItem('notifications');
       let notifs = savedNotifications ? JSON.parse(savedNotifications) : [];
@@ -30,6 +38,16 @@ function Notifications() {
       // Filter notifications for current user
       if (currentUser) {
         notifs = notifs.filter(notif => notif.recipient === currentUser.username);
+
+        try {
+          const response = await fetch(`${API_URL}/api/notifications?username=${currentUser.username}`);
+          if (response.ok) {
+            const data = await response.json();
+            notifs = [...notifs, ...data.notifications];
+          }
+        } catch (error) {
+          console.error('Error fetching notifications:', error);
+        }
         
         // Sort by timestamp (newest first)
         notifs.sort((a, b) => new Date(b.timestamp) - new Date(a.timestamp));
@@ -57,8 +75,16 @@ function Notifications() {
       const updatedNotifs = notifications.map(notif => 
         notif.id === notificationId ? { ...notif, read: true } : notif
       );
+
+      if (typeof notificationId === 'number') {
+        fetch(`${API_URL}/api/notifications/read`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ username: currentUser.username, id: notificationId })
+        });
+      }
       
-      localStorage.setItem('notifications', JSON.stringify(updatedNotifs));
+      saveLocalNotifications(updatedNotifs);
       setNotifications(updatedNotifs);
     } catch (error) {
       console.error('Error marking notification as read:', error);
@@ -69,8 +95,14 @@ function Notifications() {
   const markAllAsRead = () => {
     try {
       const updatedNotifs = notifications.map(notif => ({ ...notif, read: true }));
+
+      fetch(`${API_URL}/api/notifications/read`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ username: currentUser.username })
+      });
       
-      localStorage.setItem('notifications', JSON.stringify(updatedNotifs));
+      saveLocalNotifications(updatedNotifs);
       setNotifications(updatedNotifs);
     } catch (error) {
       console.error('Error marking all notifications as read:', error);
@@ -277,7 +309,7 @@ function Notifications() {
                         Post Like
                       </div>
                       <div className="notification-group-info">
-                        Someone liked your post
+                        {notification.message || 'Someone liked your post'}
                       </div>
                       <button 
                         className="notification-group-action"
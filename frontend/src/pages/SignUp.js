@@ -61,6 +61,7 @@ function SignUp() {
           username: username,
           email: email
         }));
+        localStorage.setItem('token', data.token);
         navigate('/home');
       } else {
         setError(data.error || 'Registration failed');